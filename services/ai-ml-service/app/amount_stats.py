@@ -0,0 +1,163 @@
+"""
+Amount Statistics Store
+Streaming per-account transaction amount statistics (Welford mean/variance and decayed mean)
+"""
+
+import logging
+import math
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class AmountStatsStore:
+    def __init__(self, decay: float = 0.1, min_history: int = 3, max_accounts: int = 1_000_000):
+        """
+        Keeps running count, mean, variance (Welford) and an exponentially
+        decayed mean of amounts per account in struct-of-arrays layout.
+        Ratios and z-scores are only reported once an account has at least
+        `min_history` prior transactions. The least recently seen account is
+        evicted when the store is full.
+        """
+        self.decay = decay
+        self.min_history = min_history
+        self.max_accounts = max_accounts
+
+        self._count = np.zeros(max_accounts, dtype=np.int64)
+        self._mean = np.zeros(max_accounts, dtype=np.float64)
+        self._m2 = np.zeros(max_accounts, dtype=np.float64)
+        self._decayed_mean = np.zeros(max_accounts, dtype=np.float64)
+
+        self._slots: OrderedDict = OrderedDict()  # account -> slot, least recent first
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def update(self, account: str, amount: float) -> Tuple[float, float]:
+        """
+        Score `amount` against the account's history, then fold it in.
+        Returns (amount_ratio, amount_zscore) relative to the history
+        before this transaction.
+        """
+        with self._lock:
+            slot = self._slot_for(account)
+            count = int(self._count[slot])
+            mean = float(self._mean[slot])
+            m2 = float(self._m2[slot])
+
+            amount_ratio, amount_zscore = self._score(count, mean, m2, amount)
+
+            # Welford update
+            count += 1
+            delta = amount - mean
+            mean += delta / count
+            self._count[slot] = count
+            self._mean[slot] = mean
+            self._m2[slot] = m2 + delta * (amount - mean)
+            if count == 1:
+                self._decayed_mean[slot] = amount
+            else:
+                self._decayed_mean[slot] += self.decay * (amount - self._decayed_mean[slot])
+
+            return amount_ratio, amount_zscore
+
+    def peek(self, account: str, amount: float) -> Tuple[float, float]:
+        """Score `amount` against the account's history without folding it in"""
+        with self._lock:
+            slot = self._slots.get(account)
+            if slot is None:
+                return 1.0, 0.0
+            return self._score(int(self._count[slot]), float(self._mean[slot]), float(self._m2[slot]), amount)
+
+    def update_batch(self, accounts: Sequence[Optional[str]], amounts: Sequence[float],
+                     update: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Update in row order and return the ratio and z-score of each row.
+        Rows where the `update` mask is False are only scored.
+        """
+        n = len(amounts)
+        amount_ratio = np.ones(n, dtype=np.float64)
+        amount_zscore = np.zeros(n, dtype=np.float64)
+        for i, (account, amount) in enumerate(zip(accounts, amounts)):
+            if account:
+                apply = self.update if update is None or update[i] else self.peek
+                amount_ratio[i], amount_zscore[i] = apply(account, float(amount))
+        return amount_ratio, amount_zscore
+
+    def get(self, account: str) -> Optional[Dict]:
+        """Current statistics for an account, or None if it is not tracked"""
+        with self._lock:
+            slot = self._slots.get(account)
+            if slot is None:
+                return None
+            count = int(self._count[slot])
+            return {
+                'count': count,
+                'mean': float(self._mean[slot]),
+                'variance': float(self._m2[slot]) / (count - 1) if count > 1 else 0.0,
+                'decayed_mean': float(self._decayed_mean[slot])
+            }
+
+    def export_state(self) -> Dict:
+        """Copy of the store's contents, least recently seen account first"""
+        with self._lock:
+            slots = np.fromiter(self._slots.values(), dtype=np.int64, count=len(self._slots))
+            return {
+                'accounts': list(self._slots.keys()),
+                'count': self._count[slots],
+                'mean': self._mean[slots],
+                'm2': self._m2[slots],
+                'decayed_mean': self._decayed_mean[slots]
+            }
+
+    def import_state(self, state: Dict):
+        """Replace the store's contents with an exported state"""
+        # Keep the most recently seen accounts if the snapshot exceeds the cap
+        accounts = state['accounts'][-self.max_accounts:]
+        n = len(accounts)
+        start = len(state['accounts']) - n
+        with self._lock:
+            self._count[:n] = state['count'][start:]
+            self._mean[:n] = state['mean'][start:]
+            self._m2[:n] = state['m2'][start:]
+            self._decayed_mean[:n] = state['decayed_mean'][start:]
+            self._slots = OrderedDict(zip(accounts, range(n)))
+
+    def stats(self) -> Dict:
+        return {
+            'accounts': len(self._slots),
+            'max_accounts': self.max_accounts,
+            'evictions': self._evictions,
+            'memory_bytes': self._count.nbytes + self._mean.nbytes + self._m2.nbytes + self._decayed_mean.nbytes
+        }
+
+    def _score(self, count: int, mean: float, m2: float, amount: float) -> Tuple[float, float]:
+        amount_ratio, amount_zscore = 1.0, 0.0
+        if count >= self.min_history:
+            if mean > 0:
+                amount_ratio = amount / mean
+            std = math.sqrt(m2 / (count - 1)) if count > 1 else 0.0
+            if std > 0:
+                amount_zscore = (amount - mean) / std
+        return amount_ratio, amount_zscore
+
+    def _slot_for(self, account: str) -> int:
+        slot = self._slots.get(account)
+        if slot is not None:
+            self._slots.move_to_end(account)
+            return slot
+
+        if len(self._slots) < self.max_accounts:
+            slot = len(self._slots)
+        else:
+            # Reuse the slot of the least recently seen account
+            _, slot = self._slots.popitem(last=False)
+            self._evictions += 1
+        self._count[slot] = 0
+        self._mean[slot] = 0.0
+        self._m2[slot] = 0.0
+        self._decayed_mean[slot] = 0.0
+        self._slots[account] = slot
+        return slot
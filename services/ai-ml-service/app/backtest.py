@@ -0,0 +1,317 @@
+"""
+Threshold Backtesting
+Replays labelled transaction history in time order and sweeps FraudDetector thresholds in one pass
+
+    python -m app.backtest history.parquet curves.csv --label-column is_fraud
+    python -m app.backtest history.csv curves.csv --amount-thresholds 20000:200000:10000 --workers 8
+    python -m app.backtest unsorted.csv curves.csv --sort
+
+Feature state (velocity, amount averages, devices) evolves exactly as it
+would live, because every row goes through engineer_batch in timestamp
+order. The threshold grid never re-runs the replay: only two rules
+depend on the swept thresholds, so each row is scored four times (with
+the amount and velocity rules forced off/on) and every configuration
+picks its score from those four. Alert and true-positive counts are
+accumulated per configuration and cutoff with bincount. --sort orders
+the input with an external merge sort: sorted runs of --chunk-size rows
+are spilled to a temporary directory ($TMPDIR) and merged back holding
+one small block per run, so the input never has to fit in memory.
+
+With several workers the input is parsed once, as in bulk_score: each
+worker spills one range of it per account shard, then every worker
+replays (and with --sort, sorts) only its own shard. Order is checked
+per shard, since accounts never cross shards.
+"""
+
+import argparse
+import logging
+import os
+import pickle
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .bulk_score import (SPILL_DIR, build_feature_engineer, build_fraud_detector, input_ranges, read_chunks,
+                         spill_range, spilled_chunks, to_columns)
+from .rules import OPERATORS
+
+logger = logging.getLogger(__name__)
+
+TRUE_LABELS = {'1', '1.0', 'true', 't', 'yes', 'y', 'fraud'}
+SWEPT_RULES = ('high_amount', 'velocity')
+_LAST = np.iinfo(np.int64).max  # sort key of rows without a valid timestamp
+MERGE_BLOCK_ROWS = 4096  # rows per spilled block; a merge holds one block per run
+
+class HistoryOrderError(ValueError):
+    """Raised when the input is not sorted by timestamp and sorting was not requested"""
+
+def parse_grid(spec: str) -> np.ndarray:
+    """'a,b,c' or 'start:stop:step' (stop inclusive) as a sorted float array"""
+    if ':' in spec:
+        start, stop, step = (float(part) for part in spec.split(':'))
+        # Rounded so steps land on the values written (0.7, not 0.7000000000000001)
+        values = np.round(np.arange(start, stop + step / 2, step), 10)
+    else:
+        values = np.array([float(part) for part in spec.split(',') if part.strip()])
+    if not len(values):
+        raise ValueError(f"Empty threshold grid: {spec!r}")
+    return np.unique(values)
+
+def _labels(series: pd.Series) -> np.ndarray:
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series):
+        return series.fillna(0).astype(bool).to_numpy()
+    return series.astype(str).str.strip().str.lower().isin(TRUE_LABELS).to_numpy()
+
+def _epochs(frame: pd.DataFrame) -> np.ndarray:
+    """Sort keys: nanoseconds since the epoch, rows without a valid timestamp last"""
+    epochs = pd.to_datetime(frame['timestamp'], utc=True, format='ISO8601', errors='coerce')
+    keys = epochs.to_numpy('datetime64[ns]').view(np.int64).copy()
+    keys[epochs.isna().to_numpy()] = _LAST
+    return keys
+
+def _history(options: Dict, chunks: Iterator[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """Chunks in timestamp order; sorts when asked, otherwise checks the order"""
+    if options['sort']:
+        yield from _sorted(chunks, options['chunk_size'])
+        return
+
+    previous = None
+    for frame in chunks:
+        epochs = pd.to_datetime(frame['timestamp'], utc=True, format='ISO8601', errors='coerce').dropna()
+        if len(epochs):
+            if not epochs.is_monotonic_increasing or (previous is not None and epochs.iloc[0] < previous):
+                raise HistoryOrderError("Input is not sorted by timestamp; rerun with --sort")
+            previous = epochs.iloc[-1]
+        yield frame
+
+def _sorted(chunks: Iterator[pd.DataFrame], chunk_size: int) -> Iterator[pd.DataFrame]:
+    """
+    Stable external merge sort by timestamp. Each chunk is sorted and
+    spilled as a run of pickled blocks; the runs are then merged holding
+    one block per run, in chunks of about chunk_size rows.
+    """
+    with tempfile.TemporaryDirectory(prefix='backtest-sort-') as directory:
+        paths = []
+        for chunk in chunks:
+            keys = _epochs(chunk)
+            order = np.argsort(keys, kind='stable')
+            chunk, keys = chunk.iloc[order].reset_index(drop=True), keys[order]
+            paths.append(os.path.join(directory, f"run-{len(paths)}.pkl"))
+            block_size = min(chunk_size, MERGE_BLOCK_ROWS)
+            with open(paths[-1], 'wb') as f:
+                for start in range(0, len(chunk), block_size):
+                    pickle.dump((chunk.iloc[start:start + block_size], keys[start:start + block_size]), f,
+                                protocol=pickle.HIGHEST_PROTOCOL)
+        if not paths:
+            return
+        files = [open(path, 'rb') for path in paths]
+        try:
+            pending, size = [], 0
+            for merged in _merge_runs(files):
+                pending.append(merged)
+                size += len(merged)
+                if size >= chunk_size:
+                    yield pd.concat(pending, ignore_index=True)
+                    pending, size = [], 0
+            if pending:
+                yield pd.concat(pending, ignore_index=True)
+        finally:
+            for f in files:
+                f.close()
+
+def _merge_runs(files: Sequence) -> Iterator[pd.DataFrame]:
+    """Merge sorted runs block by block, keeping earlier runs first among equal timestamps"""
+    def load(f):
+        try:
+            return pickle.load(f)
+        except EOFError:
+            return None
+    buffers = [load(f) for f in files]
+    while any(buffer is not None for buffer in buffers):
+        live = [i for i, buffer in enumerate(buffers) if buffer is not None]
+        lasts = [buffers[i][1][-1] for i in live]
+        bound = min(lasts)
+        # Rows at the bound are safe to emit only from runs up to the first one ending there:
+        # a run before it that ends at the bound may hold more such rows in its next block
+        first = live[lasts.index(bound)]
+        frames, keys, runs = [], [], []
+        for i in live:
+            frame, run_keys = buffers[i]
+            take = np.searchsorted(run_keys, bound, side='right' if i <= first else 'left')
+            if take:
+                frames.append(frame.iloc[:take])
+                keys.append(run_keys[:take])
+                runs.append(np.full(take, i))
+            buffers[i] = (frame.iloc[take:], run_keys[take:]) if take < len(run_keys) else load(files[i])
+        keys, runs = np.concatenate(keys), np.concatenate(runs)
+        order = np.lexsort((np.arange(len(keys)), runs, keys))
+        yield pd.concat(frames, ignore_index=True).iloc[order]
+
+def _swept_rules(detector) -> Dict[str, Dict]:
+    """The rules whose thresholds are swept, as defined in the active table"""
+    rules = detector.rules.active
+    swept = {}
+    for name in SWEPT_RULES:
+        if name not in rules.names:
+            raise ValueError(f"The rule table has no {name!r} rule to sweep")
+        rule = rules.rules[rules.names.index(name)]
+        if rule['op'] not in OPERATORS:
+            raise ValueError(f"Rule {name!r} has no threshold to sweep")
+        swept[name] = rule
+    return swept
+
+def _fires(rule: Dict, features: Dict, thresholds: np.ndarray) -> np.ndarray:
+    """Whether the rule fires for each (threshold, row), with the rule's own feature, default and operator"""
+    values = features.get(rule['feature'])
+    values = np.full(len(features['amount']), rule['default']) if values is None else np.asarray(values)
+    return OPERATORS[rule['op']](values[None, :], thresholds[:, None])
+
+def replay_shard(options: Dict, shard: int) -> Dict[str, np.ndarray]:
+    """Replay one account shard and count alerts and true positives for every configuration"""
+    amounts, velocities, cutoffs = options['amount_thresholds'], options['velocity_thresholds'], options['cutoffs']
+    shape = (len(amounts), len(velocities), len(cutoffs))
+    counts = {'alerts': np.zeros(shape, dtype=np.int64), 'true_positives': np.zeros(shape, dtype=np.int64),
+              'rows': 0, 'positives': 0}
+    engineer = build_feature_engineer(options['max_accounts'])
+    detector = build_fraud_detector(options)
+    swept = _swept_rules(detector)
+
+    chunks = (read_chunks(options['input'], options['chunk_size']) if options['shards'] == 1
+              else spilled_chunks(options, shard))
+    for frame in _history(options, chunks):
+        if not len(frame):
+            continue
+        if options['label_column'] not in frame.columns:
+            raise ValueError(f"Input has no label column {options['label_column']!r}")
+        labels = _labels(frame[options['label_column']])
+        features = engineer.engineer_batch(to_columns(frame), needed=detector.required_features)
+
+        # Cutoffs at or below each variant's score: variant[a][v] has the amount
+        # rule forced to a and the velocity rule forced to v
+        variant = [[None, None], [None, None]]
+        for a, amount_threshold in enumerate(_forced(swept['high_amount']['op'])):
+            for v, velocity_threshold in enumerate(_forced(swept['velocity']['op'])):
+                detector.high_amount_threshold = amount_threshold
+                detector.velocity_threshold = velocity_threshold
+                score = detector.predict_batch(features, with_reasons=False)['fraud_probability']
+                variant[a][v] = np.searchsorted(cutoffs, score, side='right')
+
+        velocity_fires = _fires(swept['velocity'], features, velocities)
+        all_amount_fires = _fires(swept['high_amount'], features, amounts)
+        offsets = np.arange(len(velocities))[:, None] * (len(cutoffs) + 1)
+        for h in range(len(amounts)):
+            amount_fires = all_amount_fires[h]
+            passed = np.where(velocity_fires,
+                              np.where(amount_fires, variant[1][1], variant[0][1]),
+                              np.where(amount_fires, variant[1][0], variant[0][0])) + offsets
+            for name, weights in (('alerts', None), ('true_positives', np.broadcast_to(labels, passed.shape))):
+                histogram = np.bincount(passed.ravel(), weights=None if weights is None else weights.ravel(),
+                                        minlength=len(velocities) * (len(cutoffs) + 1))
+                histogram = histogram.reshape(len(velocities), len(cutoffs) + 1).astype(np.int64)
+                # A row alerts at every cutoff index below the number of cutoffs it passed
+                counts[name][h] += np.cumsum(histogram[:, ::-1], axis=1)[:, ::-1][:, 1:]
+        counts['rows'] += len(frame)
+        counts['positives'] += int(labels.sum())
+    return counts
+
+def _forced(op: str):
+    """Thresholds that make a rule with this operator (never, always) fire; != and == are not sweepable"""
+    if op in ('>', '>='):
+        return np.inf, -np.inf
+    if op in ('<', '<='):
+        return -np.inf, np.inf
+    raise ValueError(f"Cannot sweep a threshold compared with {op!r}")
+
+def curves(counts: Dict, options: Dict) -> pd.DataFrame:
+    """One row per (amount threshold, velocity threshold, cutoff) with precision, recall and alert volume"""
+    amount, velocity, cutoff = np.meshgrid(options['amount_thresholds'], options['velocity_thresholds'],
+                                           options['cutoffs'], indexing='ij')
+    alerts = counts['alerts'].ravel()
+    true_positives = counts['true_positives'].ravel()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(alerts > 0, true_positives / alerts, np.nan)
+        recall = np.where(counts['positives'] > 0, true_positives / max(counts['positives'], 1), np.nan)
+    return pd.DataFrame({
+        'high_amount_threshold': amount.ravel(),
+        'velocity_threshold': velocity.ravel(),
+        'cutoff': cutoff.ravel(),
+        'alerts': alerts,
+        'true_positives': true_positives,
+        'false_positives': alerts - true_positives,
+        'precision': precision,
+        'recall': recall,
+        'alert_rate': alerts / counts['rows'] if counts['rows'] else np.nan
+    })
+
+def run(options: Dict) -> pd.DataFrame:
+    """Replay every shard (in-process when there is one) and return the combined curves"""
+    if options['shards'] == 1:
+        shards = [replay_shard(options, 0)]
+    else:
+        with tempfile.TemporaryDirectory(prefix='backtest-shards-') as directory:
+            options = {**options, 'output': directory}  # where spill_range writes
+            os.makedirs(os.path.join(directory, SPILL_DIR))
+            with ProcessPoolExecutor(max_workers=options['shards']) as pool:
+                # Each worker parses one range of the input, then each replays one shard
+                ranges = input_ranges(options['input'], options['shards'])
+                list(pool.map(spill_range, [options] * len(ranges), range(len(ranges)), ranges))
+                shards = list(pool.map(replay_shard, [options] * options['shards'], range(options['shards'])))
+    total = {name: sum(shard[name] for shard in shards)
+             for name in ('alerts', 'true_positives', 'rows', 'positives')}
+    return curves(total, options)
+
+def _write(frame: pd.DataFrame, path: str):
+    if path.endswith(('.parquet', '.pq')):
+        frame.to_parquet(path, index=False)
+    elif path.endswith('.json'):
+        frame.to_json(path, orient='records', indent=2)
+    else:
+        frame.to_csv(path, index=False)
+
+def main(argv: Sequence[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m app.backtest', description=__doc__.strip().splitlines()[1])
+    parser.add_argument('input', help='CSV or Parquet history with a label column')
+    parser.add_argument('output', help='curves as .csv, .parquet or .json')
+    parser.add_argument('--label-column', default='is_fraud', help='column marking confirmed fraud')
+    parser.add_argument('--amount-thresholds', default='10000:200000:10000', help="'a,b,c' or 'start:stop:step'")
+    parser.add_argument('--velocity-thresholds', default='1:20:1', help="'a,b,c' or 'start:stop:step'")
+    parser.add_argument('--cutoffs', default='0.05:1.0:0.05', help='fraud_probability cutoffs (is_fraud = score >= cutoff)')
+    parser.add_argument('--sort', action='store_true',
+                        help='sort the input by timestamp first (external merge sort through $TMPDIR)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='processes (= account shards)')
+    parser.add_argument('--chunk-size', type=int, default=100_000, help='rows replayed per batch')
+    parser.add_argument('--max-accounts', type=int,
+                        help='accounts each worker keeps feature state for (default: the service settings)')
+    parser.add_argument('--rules', help='fraud rule table to tune (default: FRAUD_RULES_PATH, else the built-in rules)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    options = {
+        'input': os.path.abspath(args.input),
+        'label_column': args.label_column,
+        'amount_thresholds': parse_grid(args.amount_thresholds),
+        'velocity_thresholds': parse_grid(args.velocity_thresholds),
+        'cutoffs': parse_grid(args.cutoffs),
+        'sort': args.sort,
+        'shards': max(1, args.workers),
+        'chunk_size': max(1, args.chunk_size),
+        'max_accounts': args.max_accounts,
+        'rules_path': args.rules
+    }
+    started = time.perf_counter()
+    try:
+        result = run(options)
+    except HistoryOrderError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+    _write(result, args.output)
+    print(f"{len(result)} configurations in {time.perf_counter() - started:.1f}s -> {args.output}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,421 @@
+"""
+Offline Bulk Scoring
+Re-scores exported transactions (CSV or Parquet) across a process pool and writes Parquet results
+
+    python -m app.bulk_score transactions.csv scored/ --workers 8
+    python -m app.bulk_score transactions.parquet scored/ --high-amount-threshold 75000
+
+Rows are sharded by from_account, so each account's transactions are
+scored by one worker, in file order, with the same FeatureEngineer and
+FraudDetector logic as the service. The input is parsed once: each
+worker first reads one range of it (CSV byte ranges split at line breaks,
+or Parquet row groups) and spills its rows per shard, then every shard
+scores its spilled rows range by range. Every shard writes numbered
+Parquet parts and periodically checkpoints its feature state; rerunning
+the same command resumes after the last checkpoint. Rows whose amount is
+missing or not a finite number are not scored: they are counted and
+written to _rejects/.
+"""
+
+import argparse
+import io
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import shutil
+import sys
+import time
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .amount_stats import AmountStatsStore
+from .config import settings
+from .device_tracker import DeviceTracker
+from .feature_engineer import FeatureEngineer
+from .feature_snapshot import read_snapshot, write_snapshot
+from .fraud_detector import FraudDetector
+from .model_registry import ModelRegistry, FRAUD_MODEL_FEATURES
+from .rules import RuleEngine
+from .time_features import TimestampFeatures
+from .velocity_store import VelocityStore
+
+logger = logging.getLogger(__name__)
+
+TRANSACTION_FIELDS = ['transaction_id', 'amount', 'from_account', 'to_account', 'merchant_category',
+                      'location', 'device_id', 'ip_address', 'timestamp', 'user_id']
+# Column names of the transactions table export (backend/database/init/01_schema.sql)
+COLUMN_ALIASES = {'id': 'transaction_id', 'sender': 'from_account', 'receiver': 'to_account',
+                  'created_at': 'timestamp'}
+# Underscore names are skipped by Parquet dataset readers, so OUTPUT reads as one table
+MANIFEST = '_manifest.json'
+SPILL_DIR = '_spill'
+REJECTS_DIR = '_rejects'
+
+_progress = None  # shared row counter, set in each worker
+
+def _init_worker(progress):
+    global _progress
+    _progress = progress
+    logging.basicConfig(level=logging.WARNING)
+
+def _is_parquet(path: str) -> bool:
+    return path.endswith(('.parquet', '.pq'))
+
+def _service_names(frame: pd.DataFrame) -> pd.DataFrame:
+    return frame.rename(columns={old: new for old, new in COLUMN_ALIASES.items()
+                                 if old in frame.columns and new not in frame.columns})
+
+def _read_csv(source, chunk_size: int, **kwargs) -> Iterator[pd.DataFrame]:
+    return pd.read_csv(source, chunksize=chunk_size, dtype=str, keep_default_na=False, na_values=[''], **kwargs)
+
+def read_chunks(path: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """Yield the input as DataFrames of at most chunk_size rows, with service field names"""
+    if _is_parquet(path):
+        import pyarrow.parquet as pq
+        batches = (batch.to_pandas() for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size))
+    else:
+        batches = _read_csv(path, chunk_size)
+    for frame in batches:
+        yield _service_names(frame)
+
+def input_ranges(path: str, count: int) -> List[Tuple]:
+    """
+    Split the input into at most count contiguous, non-empty ranges in file
+    order: (first, last) row groups of a Parquet file, or (start, end) byte
+    offsets of a CSV's data lines. CSV ranges start at line breaks, so fields
+    must not contain embedded newlines.
+    """
+    if _is_parquet(path):
+        import pyarrow.parquet as pq
+        groups = pq.ParquetFile(path).num_row_groups
+        bounds = sorted({groups * i // count for i in range(count + 1)})
+        return [(first, last) for first, last in zip(bounds, bounds[1:])]
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.readline()  # header
+        bounds = [f.tell()]
+        for i in range(1, count):
+            # Step back one byte so an offset already at a line start is kept
+            f.seek(max(size * i // count, bounds[-1]) - 1)
+            f.readline()
+            bounds.append(f.tell())
+    bounds = sorted(set(bounds + [size]))
+    return [(start, end) for start, end in zip(bounds, bounds[1:])]
+
+class _ByteRange(io.RawIOBase):
+    """Read-only view of bytes [start, end) of a file"""
+
+    def __init__(self, path: str, start: int, end: int):
+        self._file = open(path, 'rb')
+        self._file.seek(start)
+        self._left = end - start
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        size = self._file.readinto(memoryview(buffer)[:min(len(buffer), self._left)])
+        self._left -= size
+        return size
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+def read_range(path: str, part: Tuple, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """read_chunks() for one range from input_ranges()"""
+    if _is_parquet(path):
+        import pyarrow.parquet as pq
+        batches = (batch.to_pandas() for batch in
+                   pq.ParquetFile(path).iter_batches(batch_size=chunk_size, row_groups=range(*part)))
+        for frame in batches:
+            yield _service_names(frame)
+        return
+    names = pd.read_csv(path, nrows=0).columns.tolist()
+    with io.BufferedReader(_ByteRange(path, *part)) as source:
+        for frame in _read_csv(source, chunk_size, header=None, names=names):
+            yield _service_names(frame)
+
+def _spill_path(output: str, part: int, shard: int) -> str:
+    return os.path.join(output, SPILL_DIR, f"range-{part:03d}-shard-{shard:03d}.pkl")
+
+def spill_range(options: Dict, index: int, part: Tuple) -> int:
+    """Read one input range and append its rows to one spill file per shard, in file order"""
+    done = os.path.join(options['output'], SPILL_DIR, f"range-{index:03d}.done")
+    if os.path.exists(done):
+        return 0
+    files = {}
+    rows = 0
+    try:
+        for frame in read_range(options['input'], part, options['chunk_size']):
+            shards = shard_of(frame['from_account'], options['shards'])
+            for shard in np.unique(shards).tolist():
+                if shard not in files:
+                    files[shard] = open(_spill_path(options['output'], index, shard) + '.tmp', 'wb')
+                pickle.dump(frame[shards == shard], files[shard], protocol=pickle.HIGHEST_PROTOCOL)
+            rows += len(frame)
+    finally:
+        for f in files.values():
+            f.close()
+    for shard in files:
+        path = _spill_path(options['output'], index, shard)
+        os.replace(path + '.tmp', path)
+    open(done, 'w').close()
+    return rows
+
+def spilled_chunks(options: Dict, shard: int) -> Iterator[pd.DataFrame]:
+    """A shard's spilled rows, range by range, regrouped into chunks of about chunk_size rows"""
+    pending, size = [], 0
+    for index in range(options['shards']):
+        path = _spill_path(options['output'], index, shard)
+        if not os.path.exists(path):
+            continue
+        with open(path, 'rb') as f:
+            while True:
+                try:
+                    frame = pickle.load(f)
+                except EOFError:
+                    break
+                pending.append(frame)
+                size += len(frame)
+                if size >= options['chunk_size']:
+                    yield pd.concat(pending, ignore_index=True)
+                    pending, size = [], 0
+    if pending:
+        yield pd.concat(pending, ignore_index=True)
+
+def valid_amounts(frame: pd.DataFrame) -> np.ndarray:
+    """Rows whose amount is present and a finite number"""
+    if 'amount' not in frame.columns:
+        return np.ones(len(frame), dtype=bool)  # to_columns reports the missing column
+    return np.isfinite(pd.to_numeric(frame['amount'], errors='coerce').to_numpy(np.float64))
+
+def to_columns(frame: pd.DataFrame) -> Dict:
+    """Convert a chunk to the columns engineer_batch expects"""
+    n = len(frame)
+    missing = [name for name in ('transaction_id', 'amount', 'from_account') if name not in frame.columns]
+    if missing:
+        raise ValueError(f"Input is missing columns: {', '.join(missing)}")
+    columns = {'amount': pd.to_numeric(frame['amount'], errors='coerce').fillna(0).to_numpy(np.float64)}
+    for name in TRANSACTION_FIELDS:
+        if name == 'amount':
+            continue
+        if name not in frame.columns:
+            columns[name] = [None] * n
+            continue
+        series = frame[name]
+        if name == 'timestamp' and pd.api.types.is_datetime64_any_dtype(series):
+            series = series.map(lambda ts: ts.isoformat() if not pd.isna(ts) else None)
+        else:
+            series = series.astype(object).where(series.notna(), None)
+            if name != 'timestamp':
+                series = series.map(lambda v: v if v is None else str(v))
+        columns[name] = series.tolist()
+    return columns
+
+def shard_of(accounts: pd.Series, shards: int) -> np.ndarray:
+    """Stable shard per account (independent of the interpreter's hash seed)"""
+    return (pd.util.hash_pandas_object(accounts.fillna(''), index=False).to_numpy() % np.uint64(shards)).astype(np.int64)
+
+def build_feature_engineer(max_accounts: Optional[int]) -> FeatureEngineer:
+    """Stores configured like the service's; max_accounts overrides each store's account limit"""
+    return FeatureEngineer(
+        velocity_store=VelocityStore(window_seconds=settings.velocity_window_minutes * 60,
+                                     capacity=settings.velocity_capacity,
+                                     max_accounts=max_accounts or settings.velocity_max_accounts),
+        amount_stats=AmountStatsStore(decay=settings.amount_stats_decay,
+                                      min_history=settings.amount_stats_min_history,
+                                      max_accounts=max_accounts or settings.amount_stats_max_accounts),
+        device_tracker=DeviceTracker(max_hot_accounts=max_accounts or settings.device_max_hot_accounts,
+                                     max_devices=settings.device_max_per_account,
+                                     max_locations=settings.device_max_locations, cold_mode=settings.device_cold_mode,
+                                     cold_capacity=settings.device_cold_capacity,
+                                     cold_fp_rate=settings.device_cold_fp_rate),
+        timestamps=TimestampFeatures(settings.business_timezone, settings.timestamp_cache_size)
+    )
+
+def build_fraud_detector(options: Dict) -> FraudDetector:
+    """A rules detector with optional threshold overrides, or one pinned to a registry model"""
+    registry = None
+    if options.get('model_path'):
+        # Pinned to the newest version at start-up; workers never hot-swap mid-run
+        registry = ModelRegistry(options['model_path'], 'fraud', 'classifier', FRAUD_MODEL_FEATURES,
+                                 backend=settings.model_backend)
+        registry.refresh()
+    detector = FraudDetector(registry=registry, rules=RuleEngine(options.get('rules_path') or settings.fraud_rules_path))
+    if options.get('high_amount_threshold') is not None:
+        detector.high_amount_threshold = options['high_amount_threshold']
+    if options.get('velocity_threshold') is not None:
+        detector.velocity_threshold = options['velocity_threshold']
+    return detector
+
+def _write_parquet(frame: pd.DataFrame, path: str):
+    """Write beside the target and rename, so a part file is never partial"""
+    directory, name = os.path.split(path)
+    temporary = os.path.join(directory, f".{name}.tmp")
+    frame.to_parquet(temporary, index=False)
+    os.replace(temporary, path)
+
+def score_shard(options: Dict, shard: int) -> Dict:
+    """Score one shard of the input; resumes from the shard's checkpoint if present"""
+    started = time.perf_counter()
+    output = options['output']
+    state_path = os.path.join(output, f"_state-{shard:03d}.snap")
+    engineer = build_feature_engineer(options['max_accounts'])
+    stores = {'velocity': engineer.velocity_store, 'amount_stats': engineer.amount_stats,
+              'devices': engineer.device_tracker}
+    detector = build_fraud_detector(options)
+
+    next_chunk = 0
+    if os.path.exists(state_path):
+        header, sections = read_snapshot(state_path)
+        for name, store in stores.items():
+            store.import_state(sections[name])
+        next_chunk = header['metadata']['next_chunk']
+
+    rows = 0
+    flagged = 0
+    rejected = 0
+    last_chunk = -1
+    chunks = (read_chunks(options['input'], options['chunk_size']) if options['shards'] == 1
+              else spilled_chunks(options, shard))
+    for chunk, frame in enumerate(chunks):
+        last_chunk = chunk
+        if chunk < next_chunk:
+            continue
+        valid = valid_amounts(frame)
+        if not valid.all():
+            # Scoring them as 0 would hide them; keep them aside with their input fields
+            _write_parquet(frame[~valid],
+                           os.path.join(output, REJECTS_DIR, f"rejects-{shard:03d}-{chunk:06d}.parquet"))
+            rejected += int(np.count_nonzero(~valid))
+            frame = frame[valid]
+        if len(frame):
+            columns = to_columns(frame)
+            result = detector.predict_batch(engineer.engineer_batch(columns, needed=detector.required_features),
+                                            with_reasons=options['with_reasons'])
+            probability = result['fraud_probability']
+            scored = pd.DataFrame({
+                'transaction_id': columns['transaction_id'],
+                'from_account': columns['from_account'],
+                'to_account': columns['to_account'],
+                'amount': columns['amount'],
+                'timestamp': columns['timestamp'],
+                'is_fraud': result['is_fraud'],
+                'fraud_probability': probability,
+                'risk_score': result['risk_score'],
+                'risk_level': result['risk_level'].astype(str),
+                'reason_mask': result['reason_mask'],
+                'recommended_action': np.select([probability > 0.9, probability > 0.7], ['BLOCK', 'REVIEW'],
+                                                default='APPROVE'),
+                'model_version': result['model_version']
+            })
+            if options['with_reasons']:
+                scored['reasons'] = result['reasons']
+            _write_parquet(scored, os.path.join(output, f"part-{shard:03d}-{chunk:06d}.parquet"))
+            rows += len(frame)
+            flagged += int(np.count_nonzero(result['is_fraud']))
+            if _progress is not None:
+                with _progress.get_lock():
+                    _progress.value += len(frame)
+        if (chunk + 1) % options['checkpoint_every'] == 0:
+            write_snapshot(state_path, {name: store.export_state() for name, store in stores.items()},
+                           {'next_chunk': chunk + 1})
+
+    if last_chunk + 1 > next_chunk:
+        write_snapshot(state_path, {name: store.export_state() for name, store in stores.items()},
+                       {'next_chunk': last_chunk + 1})
+    return {'shard': shard, 'rows': rows, 'flagged': flagged, 'rejected': rejected, 'resumed_at_chunk': next_chunk,
+            'seconds': time.perf_counter() - started}
+
+def _check_manifest(options: Dict):
+    """Refuse to resume into an output directory written with different settings"""
+    path = os.path.join(options['output'], MANIFEST)
+    manifest = {key: options.get(key) for key in ('input', 'shards', 'chunk_size', 'max_accounts',
+                                                  'high_amount_threshold', 'velocity_threshold', 'model_path',
+                                                  'rules_path', 'with_reasons')}
+    if os.path.exists(path):
+        with open(path) as f:
+            previous = json.load(f)
+        if previous != manifest:
+            raise SystemExit(f"{options['output']} holds results of a different run: {previous}")
+    else:
+        with open(path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+def run(options: Dict, progress_interval: float = 2.0) -> Dict:
+    """Score every shard (in-process when there is one) and return per-shard stats"""
+    os.makedirs(os.path.join(options['output'], REJECTS_DIR), exist_ok=True)
+    _check_manifest(options)
+    started = time.perf_counter()
+
+    if options['shards'] == 1:
+        shards = [score_shard(options, 0)]
+    else:
+        os.makedirs(os.path.join(options['output'], SPILL_DIR), exist_ok=True)
+        progress = multiprocessing.Value('q', 0)
+        with ProcessPoolExecutor(max_workers=options['shards'], initializer=_init_worker,
+                                 initargs=(progress,)) as pool:
+            # Each worker parses one range of the input, then each scores one shard
+            ranges = input_ranges(options['input'], options['shards'])
+            list(pool.map(spill_range, [options] * len(ranges), range(len(ranges)), ranges))
+            futures = [pool.submit(score_shard, options, shard) for shard in range(options['shards'])]
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=progress_interval, return_when=FIRST_EXCEPTION)
+                if any(f.exception() for f in done):
+                    break
+                elapsed = time.perf_counter() - started
+                print(f"\r{progress.value:,} rows scored, {progress.value / elapsed:,.0f} rows/s",
+                      end='', file=sys.stderr, flush=True)
+            print(file=sys.stderr)
+            shards = [f.result() for f in futures]
+        shutil.rmtree(os.path.join(options['output'], SPILL_DIR))
+
+    elapsed = time.perf_counter() - started
+    rows = sum(s['rows'] for s in shards)
+    return {'rows': rows, 'flagged': sum(s['flagged'] for s in shards),
+            'rejected': sum(s['rejected'] for s in shards), 'seconds': elapsed,
+            'rows_per_second': rows / elapsed if elapsed else 0.0, 'shards': shards}
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m app.bulk_score', description=__doc__.strip().splitlines()[1])
+    parser.add_argument('input', help='CSV or Parquet export of transactions')
+    parser.add_argument('output', help='directory for Parquet parts, checkpoints and the manifest')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='processes (= account shards)')
+    parser.add_argument('--chunk-size', type=int, default=100_000, help='rows read per chunk')
+    parser.add_argument('--checkpoint-every', type=int, default=10, help='chunks between feature-state checkpoints')
+    parser.add_argument('--max-accounts', type=int,
+                        help='accounts each worker keeps feature state for (default: the service settings)')
+    parser.add_argument('--high-amount-threshold', type=float)
+    parser.add_argument('--velocity-threshold', type=int)
+    parser.add_argument('--model-path', help='score with the newest model under MODEL_PATH/fraud instead of rules')
+    parser.add_argument('--rules', help='fraud rule table (default: FRAUD_RULES_PATH, else the built-in rules)')
+    parser.add_argument('--with-reasons', action='store_true', help='include a reasons list column beside reason_mask')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    options = {
+        'input': os.path.abspath(args.input),
+        'output': args.output,
+        'shards': max(1, args.workers),
+        'chunk_size': max(1, args.chunk_size),
+        'checkpoint_every': max(1, args.checkpoint_every),
+        'max_accounts': args.max_accounts,
+        'high_amount_threshold': args.high_amount_threshold,
+        'velocity_threshold': args.velocity_threshold,
+        'model_path': args.model_path,
+        'rules_path': args.rules,
+        'with_reasons': args.with_reasons
+    }
+    summary = run(options)
+    print(json.dumps({key: value for key, value in summary.items() if key != 'shards'}))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""
+Columnar Batch Codecs
+Decodes fraud batches sent as msgpack or Arrow IPC columns and encodes results the same way
+"""
+
+import logging
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {
+    'application/msgpack': 'msgpack',
+    'application/x-msgpack': 'msgpack',
+    'application/vnd.msgpack': 'msgpack',
+    'application/vnd.apache.arrow.stream': 'arrow'
+}
+MEDIA_TYPES = {'msgpack': 'application/msgpack', 'arrow': 'application/vnd.apache.arrow.stream'}
+
+class ColumnarFormatError(ValueError):
+    """Raised when a columnar body is malformed or missing required columns"""
+
+def codec_for(content_type: Optional[str]) -> Optional[str]:
+    """'msgpack', 'arrow' or None for a request Content-Type header"""
+    if not content_type:
+        return None
+    return CONTENT_TYPES.get(content_type.split(';')[0].strip().lower())
+
+def decode_columns(body: bytes, codec: str, string_fields: Sequence[str], numeric_fields: Sequence[str],
+                   required: Sequence[str]) -> Dict[str, Sequence]:
+    """
+    Decode a batch into scoring columns: numeric fields become float64
+    arrays (zero-copy where the format allows), string fields lists of
+    str/None. Missing optional fields become all-None columns.
+    """
+    raw = _decode_msgpack(body) if codec == 'msgpack' else _decode_arrow(body)
+
+    missing = [name for name in required if name not in raw]
+    if missing:
+        raise ColumnarFormatError(f"Missing required columns: {', '.join(missing)}")
+    lengths = {len(values) for values in raw.values()}
+    if len(lengths) > 1:
+        raise ColumnarFormatError("Columns have different lengths")
+    n = lengths.pop() if lengths else 0
+
+    columns = {}
+    for name in numeric_fields:
+        if name in raw:
+            try:
+                columns[name] = np.asarray(raw[name], dtype=np.float64)
+            except (TypeError, ValueError):
+                raise ColumnarFormatError(f"Column {name} must be numeric")
+            if np.isnan(columns[name]).any():
+                raise ColumnarFormatError(f"Column {name} has missing values")
+        else:
+            columns[name] = np.zeros(n, dtype=np.float64)
+    for name in string_fields:
+        values = raw.get(name)
+        if values is None:
+            columns[name] = [None] * n
+        else:
+            values = values.tolist() if isinstance(values, np.ndarray) else list(values)
+            if name in required and any(v is None for v in values):
+                raise ColumnarFormatError(f"Column {name} has missing values")
+            columns[name] = values
+    return columns
+
+def encode_columns(columns: Dict[str, Sequence], codec: str) -> bytes:
+    """Encode result columns (NumPy arrays or lists) in the request's format"""
+    if codec == 'msgpack':
+        import msgpack
+        return msgpack.packb({
+            name: values.tolist() if isinstance(values, np.ndarray) else list(values)
+            for name, values in columns.items()
+        })
+
+    import pyarrow as pa
+    table = pa.table({name: pa.array(values) for name, values in columns.items()})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def _decode_msgpack(body: bytes) -> Dict:
+    """A map of column name to a list, or to raw little-endian float64 bytes for numeric columns"""
+    import msgpack
+    try:
+        raw = msgpack.unpackb(body, raw=False)
+    except (ValueError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError) as e:
+        raise ColumnarFormatError(f"Invalid msgpack body: {str(e)}")
+    if not isinstance(raw, dict):
+        raise ColumnarFormatError("Expected a msgpack map of column name to values")
+    return {
+        name: np.frombuffer(values, dtype='<f8') if isinstance(values, bytes) else values
+        for name, values in raw.items()
+    }
+
+def _decode_arrow(body: bytes) -> Dict:
+    """An Arrow IPC stream whose columns are the batch fields"""
+    import pyarrow as pa
+    try:
+        table = pa.ipc.open_stream(pa.py_buffer(body)).read_all()
+    except pa.ArrowInvalid as e:
+        raise ColumnarFormatError(f"Invalid Arrow stream: {str(e)}")
+    raw = {}
+    for name in table.column_names:
+        column = table.column(name)
+        if pa.types.is_integer(column.type) or pa.types.is_floating(column.type):
+            # Null-free float64 columns come out zero-copy
+            raw[name] = column.to_numpy().astype(np.float64, copy=False)
+        else:
+            raw[name] = column.to_pylist()
+    return raw
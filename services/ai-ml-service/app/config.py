@@ -0,0 +1,82 @@
+"""
+Service Configuration
+Deployment settings loaded from environment variables and .env
+"""
+
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+class Settings(BaseSettings):
+    model_config = SettingsConfigDict(env_file='.env', extra='ignore')
+    
+    # Model registry (<model_path>/fraud and <model_path>/risk; 0 disables watching)
+    model_path: str = './models'
+    model_reload_interval_seconds: float = 30
+    model_warmup_rows: int = 256
+    model_backend: str = 'library'  # 'library' or 'compiled' (NumPy tree traversal)
+    
+    # Fraud rule table (JSON or YAML; empty uses the built-in rules; 0 disables watching)
+    fraud_rules_path: str = ''
+    fraud_rules_reload_interval_seconds: float = 10
+    
+    # Decode/encode /api/fraud/detect and /api/fraud/batch without request
+    # and response models (same JSON on the wire)
+    fast_path_enabled: bool = False
+    
+    # Micro-batching of concurrent /api/fraud/detect calls
+    fraud_microbatch_enabled: bool = False
+    fraud_microbatch_max_size: int = 64
+    fraud_microbatch_max_wait_ms: float = 2.0
+    fraud_microbatch_max_concurrent: int = 4
+    fraud_microbatch_max_queue: int = 1024
+    
+    # Scoring budget of /api/fraud/detect calls without an X-Deadline-Ms header (0: none)
+    fraud_default_deadline_ms: float = 0
+    
+    # Idempotent detect result cache (0 entries disables)
+    result_cache_max_entries: int = 100_000
+    result_cache_ttl_seconds: float = 600
+    result_cache_max_seen: int = 1_000_000
+    
+    # Per-user risk profile cache (0 entries disables)
+    risk_cache_max_entries: int = 100_000
+    risk_cache_ttl_seconds: float = 300
+    
+    # Scoring executors: 'light' runs rules and feature engineering on
+    # threads, 'heavy' runs batch model inference on threads or processes
+    scoring_light_workers: int = 4
+    scoring_light_max_queue: int = 256
+    scoring_heavy_executor: str = 'thread'
+    scoring_heavy_workers: int = 2
+    scoring_heavy_max_queue: int = 16
+    
+    # Rows scored per chunk by /api/risk/batch and NDJSON /api/fraud/batch
+    risk_batch_chunk_size: int = 10_000
+    fraud_batch_chunk_size: int = 10_000
+    
+    # Sliding-window velocity feature store
+    velocity_window_minutes: int = 60
+    velocity_capacity: int = 16
+    velocity_max_accounts: int = 1_000_000
+    
+    # Streaming per-user amount statistics
+    amount_stats_decay: float = 0.1
+    amount_stats_min_history: int = 3
+    amount_stats_max_accounts: int = 1_000_000
+    
+    # Seen devices / recent locations ('bloom' or 'none' for evicted accounts)
+    device_max_hot_accounts: int = 500_000
+    device_max_per_account: int = 8
+    device_max_locations: int = 3
+    device_cold_mode: str = 'bloom'
+    device_cold_capacity: int = 50_000_000
+    device_cold_fp_rate: float = 0.01
+    
+    # Timestamp features: hour/weekday/unusual time in this IANA zone (empty: each timestamp's own offset)
+    business_timezone: str = ''
+    timestamp_cache_size: int = 4096
+    
+    # Feature state snapshots (empty path disables; interval 0 saves only on shutdown)
+    feature_snapshot_path: str = ''
+    feature_snapshot_interval_seconds: float = 300
+
+settings = Settings()
@@ -0,0 +1,228 @@
+"""
+Device and Location Tracker
+Per-account seen devices and recent locations in bounded memory
+"""
+
+import hashlib
+import logging
+import math
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def _hash64(*parts: str) -> int:
+    """Stable 64-bit hash (unlike hash(), identical across processes)"""
+    digest = hashlib.blake2b('\x1f'.join(parts).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+class BloomFilter:
+    def __init__(self, capacity: int, fp_rate: float = 0.01):
+        """
+        Sized for `capacity` items at the given false-positive rate. The bit
+        array is allocated on the first add, so an unused filter costs nothing.
+        """
+        self.capacity = max(1, capacity)
+        self.fp_rate = fp_rate
+        self.num_bits = max(8, int(-self.capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / self.capacity * math.log(2)))
+        self.bits: Optional[bytearray] = None
+        self.items = 0
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self.bits) if self.bits is not None else 0
+
+    def add(self, key: int):
+        if self.bits is None:
+            self.bits = bytearray((self.num_bits + 7) // 8)
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.items += 1
+
+    def __contains__(self, key: int) -> bool:
+        if self.bits is None:
+            return False
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def estimated_fp_rate(self) -> float:
+        return (1 - math.exp(-self.num_hashes * self.items / self.num_bits)) ** self.num_hashes
+
+    def _positions(self, key: int):
+        # Double hashing: derive k positions from two halves of the key
+        h1 = key & 0xFFFFFFFF
+        h2 = (key >> 32) | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+class DeviceTracker:
+    def __init__(self, max_hot_accounts: int = 500_000, max_devices: int = 8, max_locations: int = 3,
+                 cold_mode: str = 'bloom', cold_capacity: int = 50_000_000, cold_fp_rate: float = 0.01):
+        """
+        Recently active accounts keep hashed device ids and their last few
+        locations in memory. When an account is evicted from this hot set,
+        its (account, device) and (account, location) pairs move into a
+        Bloom filter if cold_mode is 'bloom', or are forgotten if 'none'.
+        Unknown accounts are never flagged, so a cold start does not mark
+        every transaction as a new device.
+
+        A hot account's location changes when it is not among the last
+        max_locations. The Bloom filter cannot forget, so once an account
+        has been evicted, every location that was among its recent ones at
+        any eviction stays known, even after it falls out of the hot list.
+        """
+        if cold_mode not in ('bloom', 'none'):
+            raise ValueError(f"Unknown cold mode: {cold_mode}")
+        self.max_hot_accounts = max_hot_accounts
+        self.max_devices = max_devices
+        self.max_locations = max_locations
+        self.cold = BloomFilter(cold_capacity, cold_fp_rate) if cold_mode == 'bloom' else None
+
+        # account -> (device hashes, recent location hashes), least recent first.
+        # Entries are tuples replaced on every change, so export_state() only
+        # has to copy the dict under the lock
+        self._hot: OrderedDict = OrderedDict()
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def observe(self, account: str, device_id: Optional[str], location: Optional[str]) -> Tuple[bool, bool]:
+        """
+        Check a transaction against the account's history, then record it.
+        Returns (new_device, location_change).
+        """
+        device = _hash64(account, 'device', device_id) if device_id else None
+        place = _hash64(account, 'location', location) if location else None
+
+        with self._lock:
+            entry = self._hot.get(account)
+            if entry is not None:
+                self._hot.move_to_end(account)
+                known = True
+            else:
+                known = self.cold is not None and _hash64(account) in self.cold
+                entry = ((), ())
+                self._hot[account] = entry
+                self._evict()
+            new_device, location_change, entry = self._check(entry, known, device, place, record=True)
+            if account in self._hot:
+                self._hot[account] = entry
+            return new_device, location_change
+
+    def peek(self, account: str, device_id: Optional[str], location: Optional[str]) -> Tuple[bool, bool]:
+        """Check a transaction against the account's history without recording it"""
+        device = _hash64(account, 'device', device_id) if device_id else None
+        place = _hash64(account, 'location', location) if location else None
+
+        with self._lock:
+            entry = self._hot.get(account)
+            if entry is not None:
+                return self._check(entry, True, device, place, record=False)[:2]
+            known = self.cold is not None and _hash64(account) in self.cold
+            return self._check(((), ()), known, device, place, record=False)[:2]
+
+    def observe_batch(self, accounts: Sequence[Optional[str]], device_ids: Sequence[Optional[str]],
+                      locations: Sequence[Optional[str]], update: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Observe transactions in row order. Rows where the `update` mask is
+        False are only checked.
+        """
+        n = len(accounts)
+        new_device = np.zeros(n, dtype=bool)
+        location_change = np.zeros(n, dtype=bool)
+        for i, (account, device_id, location) in enumerate(zip(accounts, device_ids, locations)):
+            if account:
+                apply = self.observe if update is None or update[i] else self.peek
+                new_device[i], location_change[i] = apply(account, device_id, location)
+        return new_device, location_change
+
+    def export_state(self) -> Dict:
+        """Copy of the tracker's contents, least recently seen account first"""
+        # Under the lock: a shallow copy of the (immutable) entries and the Bloom bits
+        with self._lock:
+            accounts = list(self._hot.keys())
+            entries = list(self._hot.values())
+            cold_bits = bytes(self.cold.bits) if self.cold is not None and self.cold.bits is not None else None
+            cold_meta = [self.cold.num_bits, self.cold.num_hashes, self.cold.items] if cold_bits else None
+
+        device_counts = np.fromiter((len(devices) for devices, _ in entries), dtype=np.int64, count=len(entries))
+        location_counts = np.fromiter((len(locations) for _, locations in entries), dtype=np.int64, count=len(entries))
+        state = {
+            'accounts': accounts,
+            'device_counts': device_counts,
+            'devices': np.fromiter((d for devices, _ in entries for d in devices), dtype=np.uint64,
+                                   count=int(device_counts.sum())),
+            'location_counts': location_counts,
+            'locations': np.fromiter((l for _, locations in entries for l in locations), dtype=np.uint64,
+                                     count=int(location_counts.sum()))
+        }
+        if cold_bits is not None:
+            state['cold_bits'] = np.frombuffer(cold_bits, dtype=np.uint8)
+            state['cold_meta'] = np.array(cold_meta, dtype=np.int64)
+        return state
+
+    def import_state(self, state: Dict):
+        """Replace the tracker's contents with an exported state"""
+        def unflatten(values, counts):
+            values = values.tolist()
+            ends = np.cumsum(counts).tolist()
+            return [tuple(values[end - count:end]) for end, count in zip(ends, counts.tolist())]
+
+        entries = zip(unflatten(state['devices'], state['device_counts']),
+                      unflatten(state['locations'], state['location_counts']))
+        with self._lock:
+            self._hot = OrderedDict(zip(state['accounts'], entries))
+            self._evict()
+            if self.cold is not None and 'cold_bits' in state:
+                num_bits, num_hashes, items = state['cold_meta'].tolist()
+                if num_bits == self.cold.num_bits and num_hashes == self.cold.num_hashes:
+                    self.cold.bits = bytearray(state['cold_bits'].tobytes())
+                    self.cold.items = items
+                else:
+                    logger.warning("Device snapshot Bloom filter size differs from configuration; skipping")
+
+    def stats(self) -> Dict:
+        stats = {
+            'hot_accounts': len(self._hot),
+            'max_hot_accounts': self.max_hot_accounts,
+            'evictions': self._evictions,
+            'cold_mode': 'bloom' if self.cold is not None else 'none'
+        }
+        if self.cold is not None:
+            stats.update({
+                'cold_items': self.cold.items,
+                'cold_capacity': self.cold.capacity,
+                'cold_memory_bytes': self.cold.memory_bytes,
+                'cold_estimated_fp_rate': self.cold.estimated_fp_rate()
+            })
+        return stats
+
+    def _check(self, entry: Tuple[Tuple, Tuple], known: bool, device: Optional[int], place: Optional[int],
+               record: bool) -> Tuple[bool, bool, Tuple[Tuple, Tuple]]:
+        """(new_device, location_change, the entry with this transaction recorded if record)"""
+        devices, locations = entry
+
+        new_device = False
+        if device is not None and device not in devices:
+            new_device = known and not (self.cold is not None and device in self.cold)
+            if record:
+                devices = (devices + (device,))[-self.max_devices:]
+
+        location_change = False
+        if place is not None:
+            if place not in locations:
+                location_change = known and not (self.cold is not None and place in self.cold)
+            if record:
+                locations = (tuple(l for l in locations if l != place) + (place,))[-self.max_locations:]
+
+        return new_device, location_change, (devices, locations)
+
+    def _evict(self):
+        while len(self._hot) > self.max_hot_accounts:
+            account, (devices, locations) = self._hot.popitem(last=False)
+            self._evictions += 1
+            if self.cold is not None:
+                self.cold.add(_hash64(account))
+                for key in devices + locations:
+                    self.cold.add(key)
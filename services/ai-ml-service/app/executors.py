@@ -0,0 +1,137 @@
+"""
+Scoring Executors
+Bounded thread/process pools that keep CPU-bound scoring off the event loop
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Shared objects installed in this (worker) process: name -> (generation, object)
+_installed: Dict[str, Tuple[Any, Any]] = {}
+
+class ExecutorSaturatedError(Exception):
+    """Raised when an executor has no worker or queue slot left"""
+
+class StaleWorkerObject(Exception):
+    """Raised in a worker whose copy of a shared object is older than the caller's"""
+
+def _install(objects: List[Tuple[str, Any, Any]]):
+    """Pool initializer: keep each (name, generation, object) for later calls"""
+    for name, generation, obj in objects:
+        _installed[name] = (generation, obj)
+
+def _call_installed(name: str, generation, method: str, args: tuple, kwargs: Dict, obj: Any = None) -> Any:
+    """Call method on the worker's copy of a shared object, replacing the copy if obj is sent"""
+    if obj is not None:
+        _installed[name] = (generation, obj)
+    entry = _installed.get(name)
+    if entry is None or entry[0] != generation:
+        raise StaleWorkerObject(name)
+    return getattr(entry[1], method)(*args, **kwargs)
+
+class BoundedExecutor:
+    def __init__(self, name: str, kind: str = 'thread', max_workers: int = 4, max_queue: int = 64):
+        """
+        kind is 'thread' or 'process'. At most max_workers calls run at
+        once and at most max_queue more wait; further calls are rejected.
+        """
+        if kind not in ('thread', 'process'):
+            raise ValueError(f"Unknown executor kind: {kind}")
+        self.name = name
+        self.kind = kind
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self._executor: Executor = None
+        self._shared: Dict[str, Any] = {}
+
+        # Stats
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._resends = 0
+        self._rejected = 0
+        self._busy_seconds = 0.0
+        self._started_at = time.monotonic()
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) on the pool, or raise ExecutorSaturatedError"""
+        if self._in_flight >= self.max_workers + self.max_queue:
+            self._rejected += 1
+            raise ExecutorSaturatedError(f"{self.name} executor is saturated")
+
+        self._in_flight += 1
+        started = time.monotonic()
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._get_executor(), partial(fn, *args, **kwargs))
+            self._completed += 1
+            return result
+        except StaleWorkerObject:
+            raise  # not a failure: call() resends the object
+        except Exception:
+            self._failed += 1
+            raise
+        finally:
+            self._in_flight -= 1
+            self._busy_seconds += time.monotonic() - started
+
+    def share(self, name: str, obj: Any):
+        """
+        Make obj callable by name through call(). Process workers receive
+        it once, when they start, instead of with every call. obj.generation
+        must change whenever its state does (a model or rule swap); a worker
+        holding an older copy is sent the current one on its next call.
+        """
+        self._shared[name] = obj
+
+    async def call(self, name: str, method: str, *args, **kwargs) -> Any:
+        """Run shared object name's method(*args, **kwargs) on the pool, sending only the arguments"""
+        obj = self._shared[name]
+        if self.kind == 'thread':
+            return await self.run(getattr(obj, method), *args, **kwargs)
+        generation = obj.generation
+        try:
+            return await self.run(_call_installed, name, generation, method, args, kwargs)
+        except StaleWorkerObject:
+            self._resends += 1
+            return await self.run(_call_installed, name, generation, method, args, kwargs, obj)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict:
+        running = min(self._in_flight, self.max_workers)
+        elapsed = time.monotonic() - self._started_at
+        return {
+            'kind': self.kind,
+            'max_workers': self.max_workers,
+            'max_queue': self.max_queue,
+            'running': running,
+            'queued': self._in_flight - running,
+            'utilization': running / self.max_workers,
+            'average_utilization': min(1.0, self._busy_seconds / (elapsed * self.max_workers)) if elapsed else 0.0,
+            'completed': self._completed,
+            'failed': self._failed,
+            'resends': self._resends,
+            'rejected': self._rejected
+        }
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == 'process':
+                shared = [(name, obj.generation, obj) for name, obj in self._shared.items()]
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     initializer=_install, initargs=(shared,))
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix=f"scoring-{self.name}")
+            logger.info(f"Started {self.name} scoring executor ({self.kind}, {self.max_workers} workers)")
+        return self._executor
@@ -3,46 +3,213 @@ Feature Engineering for ML Models
 Transforms raw transaction data into features for ML models
 """
 
-from datetime import datetime, time
-from typing import Dict
+import math
+import numpy as np
+from collections import Counter
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, FrozenSet, List, Optional, Sequence
 import logging
 
+from .velocity_store import VelocityStore
+from .amount_stats import AmountStatsStore
+from .device_tracker import DeviceTracker
+from .feature_graph import FeatureGraph, FeatureNode
+from .time_features import DEFAULT_HOUR, DEFAULT_WEEKDAY, TimestampFeatures
+
 logger = logging.getLogger(__name__)
 
+# (name, default, dtype) of the numeric user features the risk scorer reads
+USER_FEATURE_DEFAULTS = [
+    ('account_age_days', 0, np.int64),
+    ('total_transactions', 0, np.int64),
+    ('average_transaction_amount', 0, np.float64),
+    ('failed_transactions', 0, np.int64),
+    ('disputes', 0, np.int64),
+    ('kyc_verified', False, bool)
+]
+
+# Histories at least this long are reduced with NumPy instead of Python sums
+HISTORY_VECTORIZE_MIN = 256
+HISTORY_FEATURES = ('total_transactions', 'average_transaction_amount', 'failed_transactions',
+                    'disputes', 'days_since_last_transaction')
+FAILED_STATUSES = frozenset({'failed', 'failure', 'declined', 'rejected'})
+
+def _history_amount(value) -> Optional[float]:
+    """
+    A history amount as a float: numbers, Decimals and numeric strings (how
+    DECIMAL columns often arrive) count; bools, nulls, junk and non-finite
+    values are skipped. Both history reductions apply this same rule.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float, Decimal)):
+        amount = float(value)
+    elif isinstance(value, str):
+        try:
+            amount = float(value)
+        except ValueError:
+            return None
+    else:
+        return None
+    return amount if math.isfinite(amount) else None
+
 class FeatureEngineer:
-    def __init__(self):
-        pass
+    def __init__(self, velocity_store: Optional[VelocityStore] = None,
+                 amount_stats: Optional[AmountStatsStore] = None,
+                 device_tracker: Optional[DeviceTracker] = None,
+                 timestamps: Optional[TimestampFeatures] = None):
+        self.velocity_store = velocity_store
+        self.amount_stats = amount_stats
+        self.device_tracker = device_tracker
+        self.timestamps = timestamps or TimestampFeatures()
+        self.graph = self._build_graph()
     
-    def engineer_transaction_features(self, transaction: Dict) -> Dict:
+    def engineer_transaction_features(self, transaction: Dict, update_state: bool = True,
+                                      in_place: bool = False, needed: Optional[FrozenSet[str]] = None,
+                                      skip: FrozenSet[str] = frozenset()) -> Dict:
         """
-        Engineer features from transaction data
+        Engineer features from transaction data. With update_state=False the
+        stateful stores are read but not updated (for re-scored transactions).
+        With in_place=True features are added to the caller's dict instead of a copy.
+        needed limits the work to the features a scorer reads (None: all of them);
+        skip names graph nodes an earlier call already ran on this dict.
         """
-        features = transaction.copy()
-        
-        # Time-based features
-        if 'timestamp' in transaction and transaction['timestamp']:
-            features['is_unusual_time'] = self._is_unusual_time(transaction['timestamp'])
-            features['hour_of_day'] = self._get_hour(transaction['timestamp'])
-            features['day_of_week'] = self._get_day_of_week(transaction['timestamp'])
+        features = transaction if in_place else transaction.copy()
+        features.setdefault('amount', 0)
+        return self.graph.evaluate(features, needed, update_state, skip)
+    
+    def engineer_batch(self, columns: Dict[str, Sequence], update_state: Optional[np.ndarray] = None,
+                       needed: Optional[FrozenSet[str]] = None) -> Dict[str, np.ndarray]:
+        """
+        Engineer features for a batch of transactions held as columns
+        (field name -> sequence of values). Produces the same features as
+        engineer_transaction_features, one NumPy array per feature. Rows
+        where the update_state mask is False do not update stateful stores.
+        """
+        features = dict(columns)
+        amount = np.asarray(columns['amount'], dtype=np.float64)
+        features['amount'] = amount
+        return self.graph.evaluate_batch(features, len(amount), needed, update_state)
+    
+    def _build_graph(self) -> FeatureGraph:
+        """Transaction features, in dependency order; costs are rough microseconds per row"""
+        return FeatureGraph([
+            FeatureNode('timestamp', ('epoch_seconds', 'is_unusual_time', 'hour_of_day', 'day_of_week'),
+                        ('timestamp',), self._time_features, self._time_features_batch, cost=1.5),
+            FeatureNode('round_amount', ('is_round_amount',), ('amount',),
+                        self._round_amount, self._round_amount_batch, cost=0.1),
+            FeatureNode('amount_log', ('amount_log',), ('amount',),
+                        self._amount_log, self._amount_log_batch, cost=0.1),
+            FeatureNode('velocity', ('transaction_velocity',), ('from_account', 'epoch_seconds'),
+                        self._velocity, self._velocity_batch, cost=1.0, stateful=self.velocity_store is not None),
+            FeatureNode('amount_stats', ('amount_ratio', 'amount_zscore'), ('user_id', 'from_account', 'amount'),
+                        self._amount_stats, self._amount_stats_batch, cost=1.0, stateful=self.amount_stats is not None),
+            FeatureNode('devices', ('new_device', 'location_change'), ('from_account', 'device_id', 'location'),
+                        self._devices, self._devices_batch, cost=1.5, stateful=self.device_tracker is not None),
+            # Requires historical data; in production this would be fetched from the database
+            FeatureNode('account_age', ('account_age_days',), (),
+                        self._account_age, self._account_age_batch, cost=0.0, lookup=True)
+        ])
+    
+    # Time-based features (the timestamp is parsed once)
+    def _time_features(self, features: Dict, update_state: bool):
+        parsed = self.timestamps.parse(features['timestamp']) if features.get('timestamp') else None
+        if parsed is not None:
+            (features['epoch_seconds'], features['is_unusual_time'],
+             features['hour_of_day'], features['day_of_week']) = parsed
         else:
+            features['epoch_seconds'] = datetime.now().timestamp()
             features['is_unusual_time'] = False
-            features['hour_of_day'] = 12
-            features['day_of_week'] = 3
-        
-        # Amount-based features
-        amount = transaction.get('amount', 0)
-        features['is_round_amount'] = self._is_round_amount(amount)
-        features['amount_log'] = self._safe_log(amount)
-        
-        # Default values for features that require historical data
-        # In production, these would be fetched from database
+            features['hour_of_day'] = DEFAULT_HOUR
+            features['day_of_week'] = DEFAULT_WEEKDAY
+    
+    def _time_features_batch(self, features: Dict, n: int, update_state: Optional[np.ndarray]):
+        # datetime64 parse, vectorized calendar fields
+        timestamps = self.timestamps.parse_batch(features.get('timestamp') or [None] * n)
+        features['epoch_seconds'] = np.where(timestamps['valid'], timestamps['epoch_seconds'],
+                                             datetime.now().timestamp())
+        features['is_unusual_time'] = timestamps['is_unusual_time']
+        features['hour_of_day'] = timestamps['hour_of_day']
+        features['day_of_week'] = timestamps['day_of_week']
+    
+    # Amount-based features
+    def _round_amount(self, features: Dict, update_state: bool):
+        features['is_round_amount'] = self._is_round_amount(features['amount'])
+    
+    def _round_amount_batch(self, features: Dict, n: int, update_state: Optional[np.ndarray]):
+        amount = features['amount']
+        features['is_round_amount'] = (np.mod(amount, 1000) == 0) | (np.mod(amount, 500) == 0)
+    
+    def _amount_log(self, features: Dict, update_state: bool):
+        features['amount_log'] = self._safe_log(features['amount'])
+    
+    def _amount_log_batch(self, features: Dict, n: int, update_state: Optional[np.ndarray]):
+        features['amount_log'] = np.log(np.maximum(features['amount'], 1))
+    
+    # Stateful features (updated with this transaction, in row order for batches)
+    def _velocity(self, features: Dict, update_state: bool):
         features['transaction_velocity'] = 0
-        features['account_age_days'] = 30
-        features['location_change'] = False
-        features['new_device'] = False
+        if self.velocity_store is not None and features.get('from_account'):
+            record = self.velocity_store.record if update_state else self.velocity_store.count
+            features['transaction_velocity'] = record(features['from_account'], features['epoch_seconds'])
+    
+    def _velocity_batch(self, features: Dict, n: int, update_state: Optional[np.ndarray]):
+        if self.velocity_store is not None and features.get('from_account') is not None:
+            features['transaction_velocity'] = self.velocity_store.record_batch(
+                features['from_account'], features['epoch_seconds'], update_state
+            )
+        else:
+            features['transaction_velocity'] = np.zeros(n, dtype=np.int64)
+    
+    def _amount_stats(self, features: Dict, update_state: bool):
         features['amount_ratio'] = 1.0
-        
-        return features
+        features['amount_zscore'] = 0.0
+        stats_key = features.get('user_id') or features.get('from_account')
+        if self.amount_stats is not None and stats_key:
+            update = self.amount_stats.update if update_state else self.amount_stats.peek
+            features['amount_ratio'], features['amount_zscore'] = update(stats_key, features['amount'])
+    
+    def _amount_stats_batch(self, features: Dict, n: int, update_state: Optional[np.ndarray]):
+        if self.amount_stats is not None:
+            stats_keys = [
+                user_id or from_account
+                for user_id, from_account in zip(features.get('user_id') or [None] * n,
+                                                 features.get('from_account') or [None] * n)
+            ]
+            features['amount_ratio'], features['amount_zscore'] = self.amount_stats.update_batch(
+                stats_keys, features['amount'], update_state
+            )
+        else:
+            features['amount_ratio'] = np.ones(n, dtype=np.float64)
+            features['amount_zscore'] = np.zeros(n, dtype=np.float64)
+    
+    def _devices(self, features: Dict, update_state: bool):
+        features['new_device'] = False
+        features['location_change'] = False
+        if self.device_tracker is not None and features.get('from_account'):
+            observe = self.device_tracker.observe if update_state else self.device_tracker.peek
+            features['new_device'], features['location_change'] = observe(
+                features['from_account'], features.get('device_id'), features.get('location')
+            )
+    
+    def _devices_batch(self, features: Dict, n: int, update_state: Optional[np.ndarray]):
+        if self.device_tracker is not None and features.get('from_account') is not None:
+            features['new_device'], features['location_change'] = self.device_tracker.observe_batch(
+                features['from_account'],
+                features.get('device_id') or [None] * n,
+                features.get('location') or [None] * n,
+                update_state
+            )
+        else:
+            features['new_device'] = np.zeros(n, dtype=bool)
+            features['location_change'] = np.zeros(n, dtype=bool)
+    
+    def _account_age(self, features: Dict, update_state: bool):
+        features['account_age_days'] = 30
+    
+    def _account_age_batch(self, features: Dict, n: int, update_state: Optional[np.ndarray]):
+        features['account_age_days'] = np.full(n, 30, dtype=np.int64)
     
     def engineer_user_features(self, user_data: Dict) -> Dict:
         """
@@ -50,46 +217,127 @@ class FeatureEngineer:
         """
         features = user_data.copy()
         
-        # Set defaults for missing features
-        features.setdefault('account_age_days', 0)
-        features.setdefault('total_transactions', 0)
-        features.setdefault('average_transaction_amount', 0)
-        features.setdefault('failed_transactions', 0)
-        features.setdefault('disputes', 0)
-        features.setdefault('kyc_verified', False)
+        # Aggregates derived from the history fill in what the caller left out
+        if features.get('transaction_history'):
+            for name, value in self.aggregate_history(features['transaction_history']).items():
+                if features.get(name) is None:
+                    features[name] = value
+        
+        # Set defaults for missing (or explicitly null) features
+        for name, default, _ in USER_FEATURE_DEFAULTS:
+            if features.get(name) is None:
+                features[name] = default
         
         return features
     
-    def _is_unusual_time(self, timestamp: str) -> bool:
-        """Check if transaction is at unusual time (10 PM - 6 AM)"""
-        try:
-            dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-            txn_time = dt.time()
-            
-            unusual_start = time(22, 0)  # 10 PM
-            unusual_end = time(6, 0)     # 6 AM
-            
-            if unusual_start <= txn_time or txn_time <= unusual_end:
-                return True
-            return False
-        except:
-            return False
-    
-    def _get_hour(self, timestamp: str) -> int:
-        """Extract hour from timestamp"""
+    def engineer_user_batch(self, columns: Dict[str, Sequence]) -> Dict[str, np.ndarray]:
+        """
+        Engineer features for a batch of users held as columns, applying the
+        same defaults as engineer_user_features to missing columns and values
+        """
+        features = dict(columns)
+        n = len(columns['user_id'])
+        
+        histories = columns.get('transaction_history')
+        if histories is not None and any(histories):
+            features = {name: list(values) if name in HISTORY_FEATURES else values
+                        for name, values in features.items()}
+            for name in HISTORY_FEATURES:
+                features.setdefault(name, [None] * n)
+            for i, history in enumerate(histories):
+                if history:
+                    for name, value in self.aggregate_history(history).items():
+                        if features[name][i] is None:
+                            features[name][i] = value
+            columns = features
+        
+        for name, default, dtype in USER_FEATURE_DEFAULTS:
+            values = columns.get(name)
+            if values is None:
+                features[name] = np.full(n, default, dtype=dtype)
+            else:
+                features[name] = np.array([default if v is None else v for v in values], dtype=dtype)
+        
+        return features
+    
+    def aggregate_history(self, history: List[Dict]) -> Dict:
+        """
+        Reduce a transaction history (dicts with amount, status, disputed and
+        timestamp or created_at) to total_transactions, average_transaction_amount,
+        failed_transactions, disputes and days_since_last_transaction
+        """
+        if len(history) >= HISTORY_VECTORIZE_MIN:
+            average, failed_count, dispute_count, latest = self._reduce_history_columns(history)
+        else:
+            average, failed_count, dispute_count, latest = self._reduce_history_rows(history)
+        
+        return {
+            'total_transactions': len(history),
+            'average_transaction_amount': average,
+            'failed_transactions': failed_count,
+            'disputes': dispute_count,
+            'days_since_last_transaction': (
+                (datetime.now().timestamp() - latest) / 86400 if latest is not None else None
+            )
+        }
+    
+    def _reduce_history_rows(self, history: List[Dict]):
+        """One pass over a short history with plain Python accumulators"""
+        total = 0.0
+        counted = 0
+        failed_count = 0
+        dispute_count = 0
+        latest = None
+        for entry in history:
+            amount = _history_amount(entry.get('amount'))
+            if amount is not None:
+                total += amount
+                counted += 1
+            status = entry.get('status')
+            status = status.lower() if isinstance(status, str) else ''
+            failed_count += status in FAILED_STATUSES
+            dispute_count += bool(entry.get('disputed')) or status == 'disputed'
+            dt = self._parse_timestamp(entry.get('timestamp') or entry.get('created_at'))
+            if dt is not None and (latest is None or dt.timestamp() > latest):
+                latest = dt.timestamp()
+        return (total / counted if counted else 0.0), failed_count, dispute_count, latest
+    
+    def _reduce_history_columns(self, history: List[Dict]):
+        """Pull each field out as a column and reduce it with NumPy / C-level counting"""
+        amounts = [entry.get('amount') for entry in history]
+        if set(map(type, amounts)) <= {int, float}:
+            amounts = np.array(amounts, dtype=np.float64)
+            amounts = amounts[np.isfinite(amounts)]
+        else:
+            # Strings, Decimals, bools or nulls: same per-value rule as the row path
+            amounts = np.array([a for a in map(_history_amount, amounts) if a is not None], dtype=np.float64)
+        average = float(amounts.mean()) if len(amounts) else 0.0
+        
+        # Statuses repeat heavily, so count them once per distinct value
+        statuses = Counter(entry.get('status') for entry in history)
+        failed_count = sum(count for status, count in statuses.items()
+                           if isinstance(status, str) and status.lower() in FAILED_STATUSES)
+        disputed_statuses = {status for status in statuses
+                             if isinstance(status, str) and status.lower() == 'disputed'}
+        dispute_count = sum(1 for entry in history
+                            if entry.get('disputed') or entry.get('status') in disputed_statuses)
+        
+        timestamps = [t for t in (entry.get('timestamp') or entry.get('created_at') for entry in history) if t]
         try:
-            dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-            return dt.hour
-        except:
-            return 12
+            latest = max(map(datetime.fromisoformat, timestamps)).timestamp()
+        except (TypeError, ValueError):
+            # Mixed naive/aware, 'Z' suffixes before 3.11 or malformed values
+            parsed = [self._parse_timestamp(t) for t in timestamps]
+            epochs = [dt.timestamp() for dt in parsed if dt is not None]
+            latest = max(epochs) if epochs else None
+        return average, failed_count, dispute_count, latest
     
-    def _get_day_of_week(self, timestamp: str) -> int:
-        """Extract day of week from timestamp (0=Monday, 6=Sunday)"""
+    def _parse_timestamp(self, timestamp: str) -> Optional[datetime]:
+        """Parse an ISO timestamp, returning None if it is malformed"""
         try:
-            dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-            return dt.weekday()
-        except:
-            return 3
+            return datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+        except (AttributeError, TypeError, ValueError):
+            return None
     
     def _is_round_amount(self, amount: float) -> bool:
         """Check if amount is a round number"""
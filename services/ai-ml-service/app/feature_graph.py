@@ -0,0 +1,145 @@
+"""
+Feature Graph
+Declares features as nodes with dependencies and costs, and evaluates only the subgraph a scorer needs
+"""
+
+import logging
+import time
+from typing import Callable, Dict, FrozenSet, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class FeatureNode:
+    """
+    One step of feature engineering. compute(features, update_state) adds
+    the node's outputs to a transaction's feature dict; compute_batch(features,
+    n, update_state) adds them as arrays of length n. Inputs are raw fields
+    or outputs of earlier nodes. Stateful nodes read and update a feature
+    store, so they run on every state-updating call whether or not their
+    outputs are needed: the store must stay current for the next scorer.
+    Lookup nodes read data beyond the request (stateful nodes always do),
+    so their latency depends on something other than the request itself.
+    """
+
+    def __init__(self, name: str, outputs: Sequence[str], inputs: Sequence[str],
+                 compute: Callable[[Dict, bool], None],
+                 compute_batch: Callable[[Dict, int, Optional[np.ndarray]], None],
+                 cost: float = 1.0, stateful: bool = False, lookup: bool = False):
+        self.name = name
+        self.outputs = tuple(outputs)
+        self.inputs = tuple(inputs)
+        self.compute = compute
+        self.compute_batch = compute_batch
+        self.cost = cost  # estimated microseconds per row, reported beside the measured time
+        self.stateful = stateful
+        self.lookup = lookup or stateful
+
+class FeatureGraph:
+    def __init__(self, nodes: Sequence[FeatureNode]):
+        self.nodes = list(nodes)
+        self._producers: Dict[str, FeatureNode] = {}
+        for node in self.nodes:
+            for name in node.inputs:
+                if name in self._producers or not any(name in later.outputs for later in self.nodes):
+                    continue
+                raise ValueError(f"Feature node {node.name} reads {name} before it is produced")
+            for name in node.outputs:
+                if name in self._producers:
+                    raise ValueError(f"Feature {name} is produced by both {self._producers[name].name} and {node.name}")
+                self._producers[name] = node
+        # Features computable from the request alone: no lookup node upstream
+        self.request_features = frozenset(
+            name for node in self.nodes
+            if not node.lookup and all(self._request_only(name) for name in node.inputs)
+            for name in node.outputs
+        )
+        self._plans: Dict = {}
+        # node name -> [calls, rows, seconds]
+        self._timings = {node.name: [0, 0, 0.0] for node in self.nodes}
+
+    def _request_only(self, name: str) -> bool:
+        producer = self._producers.get(name)
+        return producer is None or (not producer.lookup and all(self._request_only(i) for i in producer.inputs))
+
+    @property
+    def features(self) -> List[str]:
+        """Every feature the graph can produce, in evaluation order"""
+        return [name for node in self.nodes for name in node.outputs]
+
+    def plan(self, needed: Optional[FrozenSet[str]] = None, update_state: bool = True,
+             skip: FrozenSet[str] = frozenset()) -> List[FeatureNode]:
+        """
+        Nodes to run, in declaration order, for the needed features (None:
+        all of them). Names that no node produces are raw fields and need
+        no work. Nodes named in skip already ran on these features. Plans
+        are cached per (needed, update_state, skip).
+        """
+        key = (needed, update_state, skip)
+        plan = self._plans.get(key)
+        if plan is not None:
+            return plan
+
+        if needed is None:
+            selected = set(node.name for node in self.nodes)
+        else:
+            selected = set()
+            pending = [self._producers[name] for name in needed if name in self._producers]
+            if update_state:
+                pending.extend(node for node in self.nodes if node.stateful)
+            while pending:
+                node = pending.pop()
+                if node.name in selected:
+                    continue
+                selected.add(node.name)
+                pending.extend(self._producers[name] for name in node.inputs if name in self._producers)
+        plan = self._plans[key] = [node for node in self.nodes if node.name in selected and node.name not in skip]
+        return plan
+
+    def evaluate(self, features: Dict, needed: Optional[FrozenSet[str]] = None,
+                 update_state: bool = True, skip: FrozenSet[str] = frozenset()) -> Dict:
+        """Add the needed features (and their dependencies) to one transaction's dict"""
+        for node in self.plan(needed, update_state, skip):
+            started = time.perf_counter()
+            node.compute(features, update_state)
+            timing = self._timings[node.name]
+            timing[0] += 1
+            timing[1] += 1
+            timing[2] += time.perf_counter() - started
+        return features
+
+    def evaluate_batch(self, features: Dict, n: int, needed: Optional[FrozenSet[str]] = None,
+                       update_state: Optional[np.ndarray] = None) -> Dict:
+        """Add the needed features as arrays; rows where update_state is False only read state"""
+        updates = update_state is None or bool(np.any(update_state))
+        for node in self.plan(needed, updates):
+            started = time.perf_counter()
+            node.compute_batch(features, n, update_state)
+            timing = self._timings[node.name]
+            timing[0] += 1
+            timing[1] += n
+            timing[2] += time.perf_counter() - started
+        return features
+
+    def plan_cost(self, needed: Optional[FrozenSet[str]] = None, update_state: bool = True) -> float:
+        """Estimated microseconds per row of a plan"""
+        return sum(node.cost for node in self.plan(needed, update_state))
+
+    def stats(self) -> Dict:
+        """Per node: declared cost and the measured calls, rows and time per row"""
+        return {
+            node.name: {
+                'outputs': list(node.outputs),
+                'inputs': list(node.inputs),
+                'stateful': node.stateful,
+                'lookup': node.lookup,
+                'estimated_us_per_row': node.cost,
+                'calls': calls,
+                'rows': rows,
+                'seconds': seconds,
+                'us_per_row': seconds / rows * 1e6 if rows else 0.0
+            }
+            for node in self.nodes
+            for calls, rows, seconds in [self._timings[node.name]]
+        }
@@ -4,106 +4,144 @@ Uses rule-based and ML-based approaches to detect fraudulent transactions
 """
 
 import numpy as np
-from datetime import datetime, time
-from typing import Dict, List
+from typing import Dict, FrozenSet, Optional
 import logging
 
+from .model_registry import ModelRegistry, FRAUD_MODEL_FEATURES, feature_matrix
+from .rules import RuleEngine
+
 logger = logging.getLogger(__name__)
 
 class FraudDetector:
-    def __init__(self):
-        self.model_version = "1.0.0"
+    def __init__(self, registry: Optional[ModelRegistry] = None, rules: Optional[RuleEngine] = None):
+        self.registry = registry
+        self.rules = rules or RuleEngine()
         self._loaded = True
-        
-        # Rule-based thresholds
-        self.high_amount_threshold = 50000  # KES
-        self.velocity_threshold = 5  # transactions per hour
-        self.unusual_time_start = time(22, 0)  # 10 PM
-        self.unusual_time_end = time(6, 0)    # 6 AM
+        self._model_features = frozenset(registry.feature_names if registry is not None else ())
+        self._required = (None, None, None)  # (rule table, model active, features they need)
+    
+    @property
+    def rules_version(self) -> str:
+        return self.rules.active.version
+    
+    @property
+    def required_features(self) -> FrozenSet[str]:
+        """
+        Features the active rules, and the active model if there is one, read;
+        recomputed when either changes. Features planned before a model was
+        activated lack its inputs, and the rules score them (see _model_for).
+        """
+        rules, with_model, needed = self._required
+        active = self.registry is not None and self.registry.active is not None
+        if rules is not self.rules.active or with_model != active:
+            rules = self.rules.active
+            needed = rules.features | {'amount'} | (self._model_features if active else frozenset())
+            self._required = (rules, active, needed)
+        return needed
+    
+    # Thresholds of the amount and velocity rules; setting one swaps in a recompiled table
+    @property
+    def high_amount_threshold(self):
+        return self.rules.active.threshold('high_amount')
+    
+    @high_amount_threshold.setter
+    def high_amount_threshold(self, value):
+        self.rules.swap(self.rules.active.with_threshold('high_amount', value))
+    
+    @property
+    def velocity_threshold(self):
+        return self.rules.active.threshold('velocity')
+    
+    @velocity_threshold.setter
+    def velocity_threshold(self, value):
+        self.rules.swap(self.rules.active.with_threshold('velocity', value))
         
     def is_loaded(self) -> bool:
         return self._loaded
     
-    def predict(self, features: Dict) -> Dict:
+    @property
+    def model_version(self) -> str:
+        model = self.registry.active if self.registry is not None else None
+        return model.version if model is not None else self.rules_version
+    
+    @property
+    def generation(self) -> tuple:
+        """Changes whenever the active model or rule table does"""
+        return (self.registry.generation if self.registry is not None else None, self.rules.generation)
+    
+    @property
+    def model_type(self) -> str:
+        model = self.registry.active if self.registry is not None else None
+        return model.model_type if model is not None else "Rule-based"
+    
+    def predict(self, features: Dict, explain: bool = False, use_model: bool = True) -> Dict:
         """
-        Predict if transaction is fraudulent
+        Predict if transaction is fraudulent. Fired rules come back as
+        reason_mask; reason texts are added only when explain is set.
+        use_model=False scores with the rules even when a model is loaded.
         """
-        reasons = []
-        risk_score = 0.0
-        
-        # Rule 1: High amount transactions
-        if features.get('amount', 0) > self.high_amount_threshold:
-            risk_score += 0.3
-            reasons.append(f"High transaction amount (>{self.high_amount_threshold} KES)")
-        
-        # Rule 2: Unusual time
-        if features.get('is_unusual_time', False):
-            risk_score += 0.2
-            reasons.append("Transaction at unusual time (10 PM - 6 AM)")
-        
-        # Rule 3: High velocity
-        if features.get('transaction_velocity', 0) > self.velocity_threshold:
-            risk_score += 0.25
-            reasons.append(f"High transaction velocity (>{self.velocity_threshold}/hour)")
-        
-        # Rule 4: New account
-        if features.get('account_age_days', 365) < 7:
-            risk_score += 0.15
-            reasons.append("New account (< 7 days old)")
+        rules = self.rules.active
+        risk_score, reason_mask = rules.evaluate(features)
         
-        # Rule 5: Round amount (common in fraud)
-        if features.get('is_round_amount', False):
-            risk_score += 0.1
-            reasons.append("Round transaction amount")
+        # A loaded model replaces the rule score; rules still explain it
+        model = self._model_for(features) if use_model else None
+        if model is not None:
+            risk_score = min(max(float(model.predict(feature_matrix(features, FRAUD_MODEL_FEATURES))[0]), 0.0), 1.0)
         
-        # Rule 6: Different location
-        if features.get('location_change', False):
-            risk_score += 0.2
-            reasons.append("Transaction from different location")
+        risk_level = rules.classify(risk_score)
+        is_fraud = risk_score >= rules.fraud_threshold
         
-        # Rule 7: New device
-        if features.get('new_device', False):
-            risk_score += 0.15
-            reasons.append("Transaction from new device")
-        
-        # Rule 8: High amount for user
-        if features.get('amount_ratio', 1.0) > 5.0:
-            risk_score += 0.25
-            reasons.append("Amount significantly higher than user average")
-        
-        # Cap risk score at 1.0
-        risk_score = min(risk_score, 1.0)
-        
-        # Determine risk level
-        if risk_score >= 0.8:
-            risk_level = "CRITICAL"
-        elif risk_score >= 0.6:
-            risk_level = "HIGH"
-        elif risk_score >= 0.4:
-            risk_level = "MEDIUM"
-        else:
-            risk_level = "LOW"
-        
-        # Determine if fraud
-        is_fraud = risk_score >= 0.7
-        
-        return {
+        result = {
             'is_fraud': is_fraud,
             'fraud_probability': risk_score,
             'risk_score': risk_score * 100,  # 0-100 scale
             'risk_level': risk_level,
-            'reasons': reasons if reasons else ["No fraud indicators detected"]
+            'reason_mask': reason_mask,
+            'model_version': model.version if model is not None else rules.version,
+            'used_model': model is not None
+        }
+        if explain:
+            result['reasons'] = rules.explain(reason_mask)
+        return result
+    
+    def predict_batch(self, features: Dict[str, np.ndarray], with_reasons: bool = False,
+                      count_hits: bool = True) -> Dict:
+        """
+        Predict fraud for a batch of transactions given column features
+        (as produced by FeatureEngineer.engineer_batch). Every rule is
+        evaluated as an array mask; results match predict() row for row.
+        count_hits=False leaves rule hits to the caller (see record_hits).
+        """
+        n = len(features['amount'])
+        rules = self.rules.active
+        risk_score, reason_mask = rules.evaluate_batch(features, n, count_hits)
+        
+        model = self._model_for(features)
+        if model is not None:
+            risk_score = np.clip(model.predict(feature_matrix(features, FRAUD_MODEL_FEATURES, n)), 0.0, 1.0)
+        
+        result = {
+            'is_fraud': risk_score >= rules.fraud_threshold,
+            'fraud_probability': risk_score,
+            'risk_score': risk_score * 100,  # 0-100 scale
+            'risk_level': rules.classify_batch(risk_score),
+            'reason_mask': reason_mask,
+            'model_version': model.version if model is not None else rules.version,
+            'used_model': model is not None
         }
+        
+        if with_reasons:
+            result['reasons'] = rules.explain_batch(reason_mask)
+        
+        return result
+    
+    def _model_for(self, features: Dict):
+        """The active model, unless the features were planned without its inputs (it was activated since)"""
+        model = self.registry.active if self.registry is not None else None
+        if model is not None and not self._model_features.issubset(features):
+            return None
+        return model
     
-    def _is_unusual_time(self, timestamp: str) -> bool:
-        """Check if transaction is at unusual time"""
-        try:
-            dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-            txn_time = dt.time()
-            
-            # Check if between 10 PM and 6 AM
-            if self.unusual_time_start <= txn_time or txn_time <= self.unusual_time_end:
-                return True
-            return False
-        except:
-            return False
+    def record_hits(self, reason_mask: np.ndarray):
+        """Count rule hits for a predict_batch(count_hits=False) result"""
+        self.rules.active.record_batch_hits(reason_mask)
@@ -3,27 +3,97 @@ AI/ML Service for Eazepay
 Provides fraud detection, risk scoring, and predictive analytics
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, List, Dict
+from fastapi.responses import Response, StreamingResponse
+from fastapi.routing import APIRoute
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from pydantic import BaseModel, TypeAdapter, ValidationError
+import numpy as np
+from typing import AsyncIterator, Awaitable, Callable, Optional, List, Dict, Tuple
+from typing_extensions import NotRequired, TypedDict
 import logging
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from functools import partial
 from datetime import datetime
 
+from .config import settings
 from .fraud_detector import FraudDetector
+from .rules import RuleEngine
 from .risk_scorer import RiskScorer
 from .feature_engineer import FeatureEngineer
+from .micro_batcher import MicroBatcher
+from .executors import BoundedExecutor, ExecutorSaturatedError
+from .velocity_store import VelocityStore
+from .amount_stats import AmountStatsStore
+from .device_tracker import DeviceTracker
+from .time_features import TimestampFeatures
+from .tiered_scoring import TieredScorer
+from .feature_snapshot import FeatureSnapshotter
+from .model_registry import ModelRegistry, FRAUD_MODEL_FEATURES, RISK_MODEL_FEATURES
+from .result_cache import ResultCache
+from .risk_cache import RiskProfileCache
+from .streaming import list_chunks, ndjson_chunks
+from .columnar import ColumnarFormatError, MEDIA_TYPES, codec_for, decode_columns, encode_columns
+from .metrics import (
+    InstrumentedRoute, BATCH_SIZE, BATCH_FEATURES_SECONDS, BATCH_PREDICT_SECONDS, EXECUTOR_IN_FLIGHT,
+    PARSE_SECONDS, SERIALIZE_SECONDS, FRAUD_DECISIONS, RISK_ASSESSMENTS,
+    record_fraud_decisions, record_risk_levels, register_rule_hits
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup: load and warm models before taking traffic
+    for registry in model_registries.values():
+        await asyncio.to_thread(registry.refresh)
+    watch_tasks = []
+    if settings.model_reload_interval_seconds > 0:
+        watch_tasks = [
+            asyncio.create_task(registry.watch(settings.model_reload_interval_seconds))
+            for registry in model_registries.values()
+        ]
+    if settings.fraud_rules_path and settings.fraud_rules_reload_interval_seconds > 0:
+        watch_tasks.append(asyncio.create_task(fraud_rules.watch(settings.fraud_rules_reload_interval_seconds)))
+    
+    # Warm the feature stores from the last snapshot
+    snapshot_task = None
+    if feature_snapshotter is not None:
+        await asyncio.to_thread(feature_snapshotter.load)
+        if settings.feature_snapshot_interval_seconds > 0:
+            snapshot_task = asyncio.create_task(
+                feature_snapshotter.run_periodically(settings.feature_snapshot_interval_seconds)
+            )
+    yield
+    # Shutdown
+    for task in watch_tasks:
+        task.cancel()
+    if fraud_batcher is not None:
+        await fraud_batcher.stop()
+    await asyncio.gather(*_deferred_updates, return_exceptions=True)
+    if snapshot_task is not None:
+        snapshot_task.cancel()
+    if feature_snapshotter is not None:
+        await asyncio.to_thread(feature_snapshotter.save)
+    light_executor.shutdown()
+    heavy_executor.shutdown()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Eazepay AI/ML Service",
     description="Fraud detection and risk scoring for financial transactions",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
+# Per-route latency, stage and in-flight metrics for every endpoint below
+app.router.route_class = InstrumentedRoute
 
 # CORS middleware
 app.add_middleware(
@@ -34,10 +104,63 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize ML models
-fraud_detector = FraudDetector()
-risk_scorer = RiskScorer()
-feature_engineer = FeatureEngineer()
+# Initialize ML models (rules serve until a registry model is activated)
+model_registries = {
+    'fraud': ModelRegistry(settings.model_path, 'fraud', 'classifier', FRAUD_MODEL_FEATURES,
+                           warmup_rows=settings.model_warmup_rows, backend=settings.model_backend),
+    'risk': ModelRegistry(settings.model_path, 'risk', 'regressor', RISK_MODEL_FEATURES,
+                          warmup_rows=settings.model_warmup_rows, backend=settings.model_backend)
+}
+fraud_rules = RuleEngine(settings.fraud_rules_path)
+register_rule_hits(fraud_rules.hit_counts)
+fraud_detector = FraudDetector(registry=model_registries['fraud'], rules=fraud_rules)
+risk_scorer = RiskScorer(registry=model_registries['risk'])
+velocity_store = VelocityStore(
+    window_seconds=settings.velocity_window_minutes * 60,
+    capacity=settings.velocity_capacity,
+    max_accounts=settings.velocity_max_accounts
+)
+amount_stats = AmountStatsStore(
+    decay=settings.amount_stats_decay,
+    min_history=settings.amount_stats_min_history,
+    max_accounts=settings.amount_stats_max_accounts
+)
+device_tracker = DeviceTracker(
+    max_hot_accounts=settings.device_max_hot_accounts,
+    max_devices=settings.device_max_per_account,
+    max_locations=settings.device_max_locations,
+    cold_mode=settings.device_cold_mode,
+    cold_capacity=settings.device_cold_capacity,
+    cold_fp_rate=settings.device_cold_fp_rate
+)
+feature_engineer = FeatureEngineer(
+    velocity_store=velocity_store,
+    amount_stats=amount_stats,
+    device_tracker=device_tracker,
+    timestamps=TimestampFeatures(settings.business_timezone, settings.timestamp_cache_size)
+)
+tiered_scorer = TieredScorer(feature_engineer, fraud_detector)
+feature_snapshotter = FeatureSnapshotter(
+    settings.feature_snapshot_path,
+    {'velocity': velocity_store, 'amount_stats': amount_stats, 'devices': device_tracker}
+) if settings.feature_snapshot_path else None
+
+# Scoring executors keep CPU-bound work off the event loop
+light_executor = BoundedExecutor(
+    'light',
+    kind='thread',
+    max_workers=settings.scoring_light_workers,
+    max_queue=settings.scoring_light_max_queue
+)
+heavy_executor = BoundedExecutor(
+    'heavy',
+    kind=settings.scoring_heavy_executor,
+    max_workers=settings.scoring_heavy_workers,
+    max_queue=settings.scoring_heavy_max_queue
+)
+# Process workers get the scorers once at start-up; calls send only feature arrays
+heavy_executor.share('fraud_detector', fraud_detector)
+heavy_executor.share('risk_scorer', risk_scorer)
 
 # Request/Response Models
 class TransactionRequest(BaseModel):
@@ -59,9 +182,11 @@ class FraudDetectionResponse(BaseModel):
     fraud_probability: float
     risk_score: float
     risk_level: str  # LOW, MEDIUM, HIGH, CRITICAL
-    reasons: List[str]
+    reasons: Optional[List[str]] = None  # only with ?explain=true
+    reason_mask: int  # bit i: rule i of the active rule table fired
     recommended_action: str  # APPROVE, REVIEW, BLOCK
     model_version: str
+    tier: str  # rules, features or model: the richest scoring tier that ran
 
 class RiskAssessmentRequest(BaseModel):
     user_id: str
@@ -70,15 +195,380 @@ class RiskAssessmentRequest(BaseModel):
     kyc_verified: bool = False
     total_transactions: Optional[int] = None
     average_transaction_amount: Optional[float] = None
+    failed_transactions: Optional[int] = None
+    disputes: Optional[int] = None
 
 class RiskAssessmentResponse(BaseModel):
     user_id: str
     risk_score: float
     risk_level: str
     credit_limit: float
-    reasons: List[str]
+    reasons: Optional[List[str]] = None  # only with ?explain=true
+    reason_mask: int  # bits of RISK_REASONS
     model_version: str
 
+def _recommended_action(fraud_probability: float) -> str:
+    if fraud_probability > 0.9:
+        return "BLOCK"
+    elif fraud_probability > 0.7:
+        return "REVIEW"
+    return "APPROVE"
+
+def _to_columns(transactions: List[TransactionRequest]) -> Dict[str, List]:
+    return {
+        field: [getattr(txn, field) for txn in transactions]
+        for field in TransactionRequest.model_fields
+    }
+
+def _explain_flag(http_request: Request, default: bool) -> bool:
+    """The ?explain= query flag, parsed as a FastAPI bool query parameter would be"""
+    value = http_request.query_params.get('explain')
+    if value is None:
+        return default
+    try:
+        return _bool_adapter.validate_python(value)
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**error, 'loc': ('query', 'explain')} for error in e.errors(include_url=False)]
+        )
+
+def _cache_hash(payload: bytes, explain: bool) -> str:
+    """Result cache key: explained and mask-only responses are cached separately"""
+    return ResultCache.payload_hash(payload) + (':explain' if explain else '')
+
+def _deadline(budget_ms: Optional[float], started: float) -> Optional[float]:
+    """time.monotonic() instant by which a detect call should be scored, or None"""
+    if budget_ms is None:
+        budget_ms = settings.fraud_default_deadline_ms or None
+    return None if budget_ms is None else started + budget_ms / 1000
+
+def _deadline_header(http_request: Request) -> Optional[float]:
+    """The X-Deadline-Ms header in milliseconds, parsed as a FastAPI float header would be"""
+    value = http_request.headers.get('x-deadline-ms')
+    if value is None:
+        return None
+    try:
+        return _float_adapter.validate_python(value)
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**error, 'loc': ('header', 'x-deadline-ms')} for error in e.errors(include_url=False)]
+        )
+
+def _detection_fields(transaction: Dict, update_state: bool = True, explain: bool = True,
+                      deadline: Optional[float] = None) -> Tuple[Dict, bool]:
+    """
+    Score a single transaction dict through the scalar path, in tiers when
+    there is a deadline. Features are added to the dict in place, so
+    callers pass a dict they own. Returns (response fields, whether the
+    stateful update was deferred).
+    """
+    result, deferred = tiered_scorer.score(transaction, update_state, explain, deadline)
+    
+    # Same field order and types as FraudDetectionResponse (dumped without None)
+    fields = {
+        'transaction_id': transaction['transaction_id'],
+        'is_fraud': bool(result['is_fraud']),
+        'fraud_probability': float(result['fraud_probability']),
+        'risk_score': float(result['risk_score']),
+        'risk_level': result['risk_level'],
+        'reasons': result.get('reasons'),
+        'reason_mask': result['reason_mask'],
+        'recommended_action': _recommended_action(result['fraud_probability']),
+        'model_version': result['model_version'],
+        'tier': result['tier']
+    }
+    if not explain:
+        del fields['reasons']
+    return fields, deferred
+
+def _score_transaction(request: TransactionRequest, update_state: bool = True, explain: bool = True,
+                       deadline: Optional[float] = None) -> Tuple[FraudDetectionResponse, bool]:
+    """Score a single transaction through the scalar path; (response, whether the state update was deferred)"""
+    fields, deferred = _detection_fields(request.dict(), update_state, explain, deadline)
+    return FraudDetectionResponse(**fields), deferred
+
+def _assess_user(request: RiskAssessmentRequest, explain: bool = True) -> RiskAssessmentResponse:
+    """Assess a single user through the scalar path"""
+    # Engineer features
+    features = feature_engineer.engineer_user_features(request.dict())
+    
+    # Assess risk
+    result = risk_scorer.predict(features, explain)
+    
+    return RiskAssessmentResponse(
+        user_id=request.user_id,
+        risk_score=result['risk_score'],
+        risk_level=result['risk_level'],
+        credit_limit=result['credit_limit'],
+        reasons=result.get('reasons'),
+        reason_mask=result['reason_mask'],
+        model_version=result['model_version']
+    )
+
+def _user_features(rows: List[Dict]) -> Dict[str, np.ndarray]:
+    """Validate a chunk of raw user rows and engineer columnar features"""
+    requests = [RiskAssessmentRequest.model_validate(row) for row in rows]
+    columns = {
+        field: [getattr(request, field) for request in requests]
+        for field in RiskAssessmentRequest.model_fields
+    }
+    return feature_engineer.engineer_user_batch(columns)
+
+def _risk_lines(user_ids: List[str], result: Dict) -> bytes:
+    """Render batch risk results as NDJSON lines, with reason texts if the result has them"""
+    model_version = result['model_version']
+    if 'reasons' in result:
+        return b''.join(
+            json.dumps({
+                "user_id": user_id,
+                "risk_score": risk_score,
+                "risk_level": risk_level,
+                "credit_limit": credit_limit,
+                "reasons": reasons,
+                "reason_mask": reason_mask,
+                "model_version": model_version
+            }).encode() + b'\n'
+            for user_id, risk_score, risk_level, credit_limit, reasons, reason_mask in zip(
+                user_ids,
+                result['risk_score'].tolist(),
+                result['risk_level'].tolist(),
+                result['credit_limit'].tolist(),
+                result['reasons'],
+                result['reason_mask'].tolist()
+            )
+        )
+    return b''.join(
+        json.dumps({
+            "user_id": user_id,
+            "risk_score": risk_score,
+            "risk_level": risk_level,
+            "credit_limit": credit_limit,
+            "reason_mask": reason_mask,
+            "model_version": model_version
+        }).encode() + b'\n'
+        for user_id, risk_score, risk_level, credit_limit, reason_mask in zip(
+            user_ids,
+            result['risk_score'].tolist(),
+            result['risk_level'].tolist(),
+            result['credit_limit'].tolist(),
+            result['reason_mask'].tolist()
+        )
+    )
+
+def _saturated(e: ExecutorSaturatedError) -> HTTPException:
+    logger.warning(f"Rejecting request: {str(e)}")
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+def _score_transactions(transactions: List[TransactionRequest], update_state: Optional[np.ndarray] = None,
+                        explain: Optional[List[bool]] = None) -> List[FraudDetectionResponse]:
+    """Score a batch of transactions through the columnar path; explain[i] adds row i's reason texts"""
+    columns = _to_columns(transactions)
+    explain = explain or [False] * len(transactions)
+    with BATCH_FEATURES_SECONDS.time():
+        features = feature_engineer.engineer_batch(columns, update_state, fraud_detector.required_features)
+    with BATCH_PREDICT_SECONDS.time():
+        result = fraud_detector.predict_batch(features, with_reasons=any(explain))
+    reasons = result.get('reasons') or [None] * len(transactions)
+    tier = 'model' if result['used_model'] else 'features'
+    tiered_scorer.record(tier, len(transactions))
+    return [
+        FraudDetectionResponse(
+            transaction_id=transaction_id,
+            is_fraud=is_fraud,
+            fraud_probability=fraud_probability,
+            risk_score=risk_score,
+            risk_level=risk_level,
+            reasons=row_reasons if row_explain else None,
+            reason_mask=reason_mask,
+            recommended_action=_recommended_action(fraud_probability),
+            model_version=result['model_version'],
+            tier=tier
+        )
+        for transaction_id, is_fraud, fraud_probability, risk_score, risk_level, row_reasons, reason_mask, row_explain in zip(
+            columns['transaction_id'],
+            result['is_fraud'].tolist(),
+            result['fraud_probability'].tolist(),
+            result['risk_score'].tolist(),
+            result['risk_level'].tolist(),
+            reasons,
+            result['reason_mask'].tolist(),
+            explain
+        )
+    ]
+
+def _score_queued(items: List) -> List[FraudDetectionResponse]:
+    """Score micro-batched (request, update_state, explain) triples"""
+    BATCH_SIZE.labels('microbatch').observe(len(items))
+    return _score_transactions([request for request, _, _ in items],
+                               np.array([update_state for _, update_state, _ in items], dtype=bool),
+                               [explain for _, _, explain in items])
+
+# Coalesces concurrent detect calls into batches when enabled
+fraud_batcher = MicroBatcher(
+    partial(light_executor.run, _score_queued),
+    max_batch_size=settings.fraud_microbatch_max_size,
+    max_wait_ms=settings.fraud_microbatch_max_wait_ms,
+    max_concurrent_batches=settings.fraud_microbatch_max_concurrent,
+    max_queue=settings.fraud_microbatch_max_queue
+) if settings.fraud_microbatch_enabled else None
+
+# Idempotent detect results, keyed by transaction_id + payload hash
+result_cache = ResultCache(
+    max_entries=settings.result_cache_max_entries,
+    ttl_seconds=settings.result_cache_ttl_seconds,
+    max_seen=settings.result_cache_max_seen
+) if settings.result_cache_max_entries > 0 else None
+
+# Per-user risk profiles, invalidated when a user's transactions change
+risk_cache = RiskProfileCache(
+    max_entries=settings.risk_cache_max_entries,
+    ttl_seconds=settings.risk_cache_ttl_seconds
+) if settings.risk_cache_max_entries > 0 else None
+
+def _invalidate_risk_profiles(user_ids) -> int:
+    """Drop cached risk profiles of users whose history changed"""
+    if risk_cache is None:
+        return 0
+    return sum(risk_cache.invalidate(user_id) for user_id in set(user_ids) if user_id)
+
+# Stateful updates deferred by deadline-limited scoring, applied after the response
+_deferred_updates = set()
+
+async def _apply_deferred_state(transaction: Dict):
+    try:
+        await light_executor.run(tiered_scorer.apply_state, transaction)
+    except Exception as e:
+        logger.error(f"Deferred feature update for {transaction.get('transaction_id')} failed: {str(e)}")
+
+def _defer_state_update(transaction: Dict):
+    task = asyncio.create_task(_apply_deferred_state(transaction))
+    _deferred_updates.add(task)
+    task.add_done_callback(_deferred_updates.discard)
+
+async def _detect(request: TransactionRequest, update_state: bool, explain: bool = True,
+                  deadline: Optional[float] = None) -> FraudDetectionResponse:
+    # Calls with a deadline are scored directly rather than waiting for a micro-batch
+    if fraud_batcher is not None and deadline is None:
+        return await fraud_batcher.submit((request, update_state, explain))
+    response, deferred = await light_executor.run(_score_transaction, request, update_state, explain, deadline)
+    if deferred:
+        _defer_state_update(request.model_dump())
+    return response
+
+# Fast path: requests decode straight to plain dicts in one validating pass
+# (pydantic-core), and responses are encoded exactly as FastAPI's JSONResponse
+# would, without response-model validation
+TransactionFields = TypedDict('TransactionFields', {
+    name: field.annotation if field.is_required() else NotRequired[field.annotation]
+    for name, field in TransactionRequest.model_fields.items()
+})
+_transaction_adapter = TypeAdapter(TransactionFields)
+_transactions_adapter = TypeAdapter(List[TransactionFields])
+_bool_adapter = TypeAdapter(bool)
+_float_adapter = TypeAdapter(float)
+_encode_json = json.JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode
+
+def _decode_body(adapter: TypeAdapter, body: bytes):
+    try:
+        return adapter.validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**error, 'loc': ('body', *error['loc'])} for error in e.errors(include_url=False)],
+            body=body
+        )
+
+def _json_response(content) -> Response:
+    with SERIALIZE_SECONDS.time():
+        return Response(_encode_json(content).encode("utf-8"), media_type="application/json")
+
+async def _detect_fields(transaction: Dict, update_state: bool, explain: bool = True,
+                         deadline: Optional[float] = None) -> Dict:
+    if fraud_batcher is not None and deadline is None:
+        request = TransactionRequest.model_construct(**transaction)
+        return (await fraud_batcher.submit((request, update_state, explain))).model_dump(exclude_none=True)
+    state = dict(transaction) if deadline is not None else None  # scoring adds features to the dict it is given
+    fields, deferred = await light_executor.run(_detection_fields, transaction, update_state, explain, deadline)
+    if deferred:
+        _defer_state_update(state)
+    return fields
+
+async def detect_fraud_fast(http_request: Request) -> Response:
+    """Fast-path /api/fraud/detect"""
+    started = time.monotonic()
+    body = await http_request.body()
+    with PARSE_SECONDS.time():
+        transaction = _decode_body(_transaction_adapter, body)
+        explain = _explain_flag(http_request, True)
+        deadline = _deadline(_deadline_header(http_request), started)
+    transaction_id = transaction['transaction_id']
+    try:
+        if result_cache is not None:
+            response, cached = await result_cache.get_or_compute(
+                transaction_id, _cache_hash(body, explain),
+                partial(_detect_fields, transaction, explain=explain, deadline=deadline),
+                lambda fields: tiered_scorer.is_full(fields['tier'])
+            )
+        else:
+            response, cached = await _detect_fields(transaction, True, explain, deadline), False
+        if not cached:
+            _invalidate_risk_profiles([transaction.get('user_id')])
+        FRAUD_DECISIONS.labels(response['risk_level'], response['recommended_action']).inc()
+        
+    except ExecutorSaturatedError as e:
+        raise _saturated(e)
+    except Exception as e:
+        logger.error(f"Fraud detection error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return _json_response(response)
+
+async def batch_fraud_detection_fast(http_request: Request) -> Response:
+    """Fast-path /api/fraud/batch"""
+    body = await http_request.body()
+    with PARSE_SECONDS.time():
+        transactions = _decode_body(_transactions_adapter, body)
+        explain = _explain_flag(http_request, False)
+    try:
+        columns = {field: [txn.get(field) for txn in transactions] for field in TransactionRequest.model_fields}
+        return _json_response(await _batch_detect(columns, explain))
+    except ExecutorSaturatedError as e:
+        raise _saturated(e)
+    except Exception as e:
+        logger.error(f"Batch fraud detection error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+NDJSON_TYPES = ('application/x-ndjson', 'application/ndjson')
+
+def _with_columnar(handler: Callable) -> Callable:
+    """
+    Send NDJSON bodies to the streaming batch handler, msgpack and Arrow
+    bodies to the columnar one and everything else to handler
+    """
+    async def dispatch(http_request: Request) -> Response:
+        content_type = http_request.headers.get('content-type')
+        if content_type and content_type.split(';')[0].strip().lower() in NDJSON_TYPES:
+            return await batch_fraud_detection_stream(http_request)
+        codec = codec_for(content_type)
+        if codec is not None:
+            return await batch_fraud_detection_columnar(http_request, codec)
+        return await handler(http_request)
+    return dispatch
+
+def _post_served_by(path: str, make_handler: Callable[[Callable], Callable], **kwargs) -> Callable:
+    """
+    Declare a POST endpoint whose requests are handled by make_handler(the
+    endpoint's FastAPI handler), through APIRoute.get_route_handler. The
+    endpoint still defines the route's OpenAPI schema, and the handler is
+    instrumented like any other route's.
+    """
+    class ServedRoute(InstrumentedRoute):
+        def get_route_handler(self) -> Callable:
+            return self.instrument(make_handler(APIRoute.get_route_handler(self)))
+
+    def register(endpoint: Callable) -> Callable:
+        app.router.add_api_route(path, endpoint, methods=["POST"], route_class_override=ServedRoute, **kwargs)
+        return endpoint
+    return register
+
 # Health check
 @app.get("/health")
 async def health_check():
@@ -93,100 +583,205 @@ async def health_check():
     }
 
 # Fraud Detection Endpoint
-@app.post("/api/fraud/detect", response_model=FraudDetectionResponse)
-async def detect_fraud(request: TransactionRequest):
+@_post_served_by("/api/fraud/detect", lambda default: detect_fraud_fast if settings.fast_path_enabled else default,
+                 response_model=FraudDetectionResponse, response_model_exclude_none=True)
+async def detect_fraud(request: TransactionRequest, explain: bool = True,
+                       x_deadline_ms: Optional[float] = Header(None)):
     """
-    Detect if a transaction is potentially fraudulent
+    Detect if a transaction is potentially fraudulent. explain=false omits
+    the reason texts; reason_mask is always returned. With an X-Deadline-Ms
+    budget, richer scoring tiers run only if they fit in it.
     """
+    deadline = _deadline(x_deadline_ms, time.monotonic())
     try:
         logger.info(f"Fraud detection request for transaction: {request.transaction_id}")
         
-        # Engineer features
-        features = feature_engineer.engineer_transaction_features(request.dict())
-        
-        # Detect fraud
-        result = fraud_detector.predict(features)
-        
-        # Determine recommended action
-        if result['fraud_probability'] > 0.9:
-            action = "BLOCK"
-        elif result['fraud_probability'] > 0.7:
-            action = "REVIEW"
+        if result_cache is not None:
+            payload_hash = _cache_hash(request.model_dump_json().encode(), explain)
+            response, cached = await result_cache.get_or_compute(
+                request.transaction_id, payload_hash, partial(_detect, request, explain=explain, deadline=deadline),
+                lambda response: tiered_scorer.is_full(response.tier)
+            )
         else:
-            action = "APPROVE"
-        
-        response = FraudDetectionResponse(
-            transaction_id=request.transaction_id,
-            is_fraud=result['is_fraud'],
-            fraud_probability=result['fraud_probability'],
-            risk_score=result['risk_score'],
-            risk_level=result['risk_level'],
-            reasons=result['reasons'],
-            recommended_action=action,
-            model_version=fraud_detector.model_version
-        )
+            response, cached = await _detect(request, True, explain, deadline), False
+        if not cached:
+            _invalidate_risk_profiles([request.user_id])
+        FRAUD_DECISIONS.labels(response.risk_level, response.recommended_action).inc()
         
-        logger.info(f"Fraud detection result: {action} (probability: {result['fraud_probability']:.2f})")
+        logger.info(f"Fraud detection result: {response.recommended_action} (probability: {response.fraud_probability:.2f})")
         return response
         
+    except ExecutorSaturatedError as e:
+        raise _saturated(e)
     except Exception as e:
         logger.error(f"Fraud detection error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # Risk Assessment Endpoint
-@app.post("/api/risk/assess", response_model=RiskAssessmentResponse)
-async def assess_risk(request: RiskAssessmentRequest):
+@app.post("/api/risk/assess", response_model=RiskAssessmentResponse, response_model_exclude_none=True)
+async def assess_risk(request: RiskAssessmentRequest, explain: bool = True):
     """
-    Assess customer risk and determine credit limit
+    Assess customer risk and determine credit limit. explain=false omits
+    the reason texts; reason_mask is always returned.
     """
     try:
         logger.info(f"Risk assessment request for user: {request.user_id}")
         
-        # Engineer features
-        features = feature_engineer.engineer_user_features(request.dict())
-        
-        # Assess risk
-        result = risk_scorer.predict(features)
-        
-        response = RiskAssessmentResponse(
-            user_id=request.user_id,
-            risk_score=result['risk_score'],
-            risk_level=result['risk_level'],
-            credit_limit=result['credit_limit'],
-            reasons=result['reasons'],
-            model_version=risk_scorer.model_version
-        )
+        if risk_cache is not None:
+            input_hash = _cache_hash(request.model_dump_json().encode(), explain)
+            response, _ = await risk_cache.get_or_compute(
+                request.user_id, input_hash, partial(light_executor.run, _assess_user, request, explain)
+            )
+        else:
+            response = await light_executor.run(_assess_user, request, explain)
+        RISK_ASSESSMENTS.labels(response.risk_level).inc()
         
-        logger.info(f"Risk assessment result: {result['risk_level']} (score: {result['risk_score']:.2f})")
+        logger.info(f"Risk assessment result: {response.risk_level} (score: {response.risk_score:.2f})")
         return response
         
+    except ExecutorSaturatedError as e:
+        raise _saturated(e)
     except Exception as e:
         logger.error(f"Risk assessment error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _batch_rows(columns: Dict[str, List], result: Dict) -> List[Dict]:
+    """Per-transaction batch results, with reason texts if the result has them"""
+    rows = [
+        {
+            "transaction_id": transaction_id,
+            "is_fraud": is_fraud,
+            "fraud_probability": fraud_probability,
+            "reason_mask": reason_mask
+        }
+        for transaction_id, is_fraud, fraud_probability, reason_mask in zip(
+            columns['transaction_id'],
+            result['is_fraud'].tolist(),
+            result['fraud_probability'].tolist(),
+            result['reason_mask'].tolist()
+        )
+    ]
+    if 'reasons' in result:
+        for row, reasons in zip(rows, result['reasons']):
+            row["reasons"] = reasons
+    return rows
+
+async def _batch_detect(columns: Dict[str, List], explain: bool = False) -> Dict:
+    """Score transaction columns for the batch endpoint's JSON response"""
+    results = _batch_rows(columns, await _batch_score(columns, explain))
+    return {"results": results, "count": len(results)}
+
+async def _batch_score(columns: Dict[str, List], with_reasons: bool = False) -> Dict:
+    """Score transaction columns (reason texts only if asked), updating state once per transaction"""
+    n = len(columns['transaction_id'])
+    # Transactions already scored must not update stateful features again
+    update_state = None
+    if result_cache is not None:
+        update_state = np.array([result_cache.claim_state_update(tid) for tid in columns['transaction_id']], dtype=bool)
+    # Feature engineering stays on threads; inference may run in a process pool
+    BATCH_SIZE.labels('fraud_batch').observe(n)
+    try:
+        with BATCH_FEATURES_SECONDS.time():
+            features = await light_executor.run(
+                feature_engineer.engineer_batch, columns, update_state, fraud_detector.required_features
+            )
+    except BaseException:
+        # No state was updated (e.g. the executor was saturated), so a retry must be free to update it
+        if update_state is not None:
+            for tid, claimed in zip(columns['transaction_id'], update_state.tolist()):
+                if claimed:
+                    result_cache.release_state_update(tid)
+        raise
+    with BATCH_PREDICT_SECONDS.time():
+        # Hits are counted here: a process-pool worker's counters never reach this process
+        result = await heavy_executor.call('fraud_detector', 'predict_batch', features,
+                                           with_reasons=with_reasons, count_hits=False)
+    fraud_detector.record_hits(result['reason_mask'])
+    _invalidate_risk_profiles(columns['user_id'])
+    record_fraud_decisions(result['risk_level'].tolist(),
+                           [_recommended_action(p) for p in result['fraud_probability'].tolist()])
+    return result
+
 # Batch Fraud Detection
-@app.post("/api/fraud/batch")
-async def batch_fraud_detection(transactions: List[TransactionRequest]):
+@_post_served_by("/api/fraud/batch", lambda default: _with_columnar(
+    batch_fraud_detection_fast if settings.fast_path_enabled else default
+))
+async def batch_fraud_detection(transactions: List[TransactionRequest], explain: bool = False):
     """
-    Detect fraud for multiple transactions
+    Detect fraud for multiple transactions. Results carry reason_mask;
+    explain=true adds the reason texts.
     """
     try:
-        results = []
-        for txn in transactions:
-            features = feature_engineer.engineer_transaction_features(txn.dict())
-            result = fraud_detector.predict(features)
-            results.append({
-                "transaction_id": txn.transaction_id,
-                "is_fraud": result['is_fraud'],
-                "fraud_probability": result['fraud_probability']
-            })
-        
-        return {"results": results, "count": len(results)}
+        return await _batch_detect(_to_columns(transactions), explain)
         
+    except ExecutorSaturatedError as e:
+        raise _saturated(e)
     except Exception as e:
         logger.error(f"Batch fraud detection error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _stream_scored(chunks: AsyncIterator[List], score: Callable[[List], Awaitable[bytes]],
+                         name: str) -> StreamingResponse:
+    """
+    Stream NDJSON produced by score() for each chunk. The next chunk is only
+    read once the previous results are sent, so memory stays at one chunk.
+    """
+    # Score the first chunk up front so bad input still gets an HTTP error status
+    try:
+        first = await anext(chunks, None)
+        first_lines = await score(first) if first else b''
+        
+    except ExecutorSaturatedError as e:
+        raise _saturated(e)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        logger.error(f"{name} error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def results():
+        yield first_lines
+        try:
+            async for rows in chunks:
+                yield await score(rows)
+        except Exception as e:
+            # Headers are already sent; report the failure in-band and stop
+            logger.error(f"{name} error: {str(e)}")
+            yield json.dumps({"error": str(e)}).encode() + b'\n'
+    
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+# Batch Risk Assessment
+@app.post("/api/risk/batch")
+async def batch_risk_assessment(request: Request):
+    """
+    Assess risk for many users. Accepts a JSON array or NDJSON (one user per
+    line, read incrementally) and streams NDJSON results chunk by chunk.
+    Lines carry reason_mask; ?explain=true adds the reason texts.
+    """
+    chunk_size = max(1, settings.risk_batch_chunk_size)
+    explain = _explain_flag(request, False)
+    
+    async def score(rows: List[Dict]) -> bytes:
+        BATCH_SIZE.labels('risk_batch').observe(len(rows))
+        features = await light_executor.run(_user_features, rows)
+        result = await heavy_executor.call('risk_scorer', 'predict_batch', features, with_reasons=explain)
+        record_risk_levels(result['risk_level'].tolist())
+        return _risk_lines(features['user_id'], result)
+    
+    try:
+        if request.headers.get('content-type', '').startswith('application/json'):
+            users = await request.json()
+            if not isinstance(users, list):
+                raise ValueError("Expected a JSON array of users")
+            chunks = list_chunks(users, chunk_size)
+        else:
+            chunks = ndjson_chunks(request.stream(), chunk_size)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    
+    return await _stream_scored(chunks, score, "Batch risk assessment")
+
 # Model Info
 @app.get("/api/models/info")
 async def get_model_info():
@@ -197,15 +792,216 @@ async def get_model_info():
         "fraud_detector": {
             "version": fraud_detector.model_version,
             "loaded": fraud_detector.is_loaded(),
-            "type": "XGBoost Classifier"
+            "type": fraud_detector.model_type,
+            "registry": model_registries['fraud'].info()
         },
         "risk_scorer": {
             "version": risk_scorer.model_version,
             "loaded": risk_scorer.is_loaded(),
-            "type": "Random Forest Regressor"
+            "type": risk_scorer.model_type,
+            "registry": model_registries['risk'].info()
         }
     }
 
+# Model Reload
+@app.post("/api/models/reload")
+async def reload_models():
+    """
+    Rescan the model directory and hot-swap in any newer models
+    """
+    swapped = {}
+    for name, registry in model_registries.items():
+        swapped[name] = await asyncio.to_thread(registry.refresh)
+    return {"swapped": swapped}
+
+# Model Activation
+@app.post("/api/models/{name}/activate")
+async def activate_model(name: str, version: Optional[str] = None):
+    """
+    Activate a specific model version, or fall back to rules if none is given
+    """
+    registry = model_registries.get(name)
+    if registry is None:
+        raise HTTPException(status_code=404, detail=f"Unknown model: {name}")
+    if version is None:
+        registry.deactivate()
+        return {"model": name, "active": None}
+    try:
+        activated = await asyncio.to_thread(registry.activate, version)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if not activated:
+        raise HTTPException(status_code=500, detail=f"Failed to load {name} model {version}")
+    return {"model": name, "active": registry.info()['active']}
+
+# Fraud rules
+@app.get("/api/rules")
+async def get_fraud_rules():
+    """
+    Get the active fraud rule table and how often each rule has fired
+    """
+    return fraud_rules.info()
+
+@app.post("/api/rules/reload")
+async def reload_fraud_rules():
+    """
+    Re-read FRAUD_RULES_PATH and hot-swap the table; a bad table keeps the current one
+    """
+    if not settings.fraud_rules_path:
+        raise HTTPException(status_code=400, detail="FRAUD_RULES_PATH is not set; the built-in rules are active")
+    if not await asyncio.to_thread(fraud_rules.reload):
+        raise HTTPException(status_code=422, detail=f"Invalid rule table at {settings.fraud_rules_path}")
+    return fraud_rules.info()
+
+# Reason codes
+@app.get("/api/reasons")
+async def get_reason_codes():
+    """
+    Get the reason text for each bit of fraud and risk reason masks
+    """
+    rules = fraud_rules.active
+    return {
+        "fraud": {"rules_version": rules.version, "codes": rules.codes()},
+        "risk": {"rules_version": risk_scorer.rules_version, "codes": risk_scorer.codes()}
+    }
+
+# Micro-batcher stats
+@app.get("/api/fraud/batcher/stats")
+async def get_batcher_stats():
+    """
+    Get queue depth and batch size statistics for the detect micro-batcher
+    """
+    if fraud_batcher is None:
+        return {"enabled": False}
+    return {"enabled": True, **fraud_batcher.stats()}
+
+# Tiered scoring stats
+@app.get("/api/fraud/tiers/stats")
+async def get_tier_stats():
+    """
+    Get decisions per scoring tier, skipped tiers and the stage estimates deadlines are checked against
+    """
+    return tiered_scorer.stats()
+
+# Feature store stats
+@app.get("/api/features/stats")
+async def get_feature_store_stats():
+    """
+    Get size and memory usage of the in-process feature stores
+    """
+    return {
+        "velocity": velocity_store.stats(),
+        "amount_stats": amount_stats.stats(),
+        "devices": device_tracker.stats(),
+        "timestamps": feature_engineer.timestamps.stats(),
+        "graph": feature_engineer.graph.stats(),
+        "snapshot": feature_snapshotter.stats() if feature_snapshotter is not None else None
+    }
+
+# Result cache stats
+@app.get("/api/fraud/cache/stats")
+async def get_result_cache_stats():
+    """
+    Get hit/miss/eviction counters for the detect result cache
+    """
+    if result_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **result_cache.stats()}
+
+class RiskInvalidationRequest(BaseModel):
+    user_ids: List[str]
+
+# Risk profile invalidation (transaction ingest hook)
+@app.post("/api/risk/profiles/invalidate")
+async def invalidate_risk_profiles(request: RiskInvalidationRequest):
+    """
+    Drop cached risk profiles for users whose transaction history changed
+    """
+    return {"invalidated": _invalidate_risk_profiles(request.user_ids)}
+
+# Risk profile cache stats
+@app.get("/api/risk/cache/stats")
+async def get_risk_cache_stats():
+    """
+    Get hit ratio, invalidation and staleness counters for the risk profile cache
+    """
+    if risk_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **risk_cache.stats()}
+
+# Prometheus metrics
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus exposition of request, stage, batch and decision metrics
+    """
+    for executor in (light_executor, heavy_executor):
+        stats = executor.stats()
+        EXECUTOR_IN_FLIGHT.labels(executor.name).set(stats['running'] + stats['queued'])
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+# Executor stats
+@app.get("/api/executors/stats")
+async def get_executor_stats():
+    """
+    Get utilization of the scoring executors
+    """
+    return {
+        "light": light_executor.stats(),
+        "heavy": heavy_executor.stats()
+    }
+
+async def batch_fraud_detection_columnar(http_request: Request, codec: str) -> Response:
+    """/api/fraud/batch for msgpack or Arrow IPC columns, answered in the same format"""
+    body = await http_request.body()
+    explain = _explain_flag(http_request, False)
+    try:
+        with PARSE_SECONDS.time():
+            columns = decode_columns(body, codec, _STRING_FIELDS, _NUMERIC_FIELDS, _REQUIRED_FIELDS)
+        result = await _batch_score(columns, explain)
+        with SERIALIZE_SECONDS.time():
+            output = {
+                'transaction_id': columns['transaction_id'],
+                'is_fraud': result['is_fraud'],
+                'fraud_probability': result['fraud_probability'],
+                'reason_mask': result['reason_mask']
+            }
+            if explain:
+                output['reasons'] = result['reasons']
+            content = encode_columns(output, codec)
+        return Response(content, media_type=MEDIA_TYPES[codec])
+        
+    except ExecutorSaturatedError as e:
+        raise _saturated(e)
+    except ColumnarFormatError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except ImportError as e:
+        raise HTTPException(status_code=415, detail=f"{codec} support is not installed: {str(e)}")
+    except Exception as e:
+        logger.error(f"Columnar batch fraud detection error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _transaction_columns(rows: List[Dict]) -> Dict[str, List]:
+    """Validate a chunk of raw transaction rows into scoring columns"""
+    transactions = [_transaction_adapter.validate_python(row) for row in rows]
+    return {field: [txn.get(field) for txn in transactions] for field in TransactionRequest.model_fields}
+
+async def batch_fraud_detection_stream(http_request: Request) -> StreamingResponse:
+    """/api/fraud/batch for NDJSON bodies: scores fixed-size chunks as they arrive and streams NDJSON results"""
+    explain = _explain_flag(http_request, False)
+    
+    async def score(rows: List[Dict]) -> bytes:
+        columns = await light_executor.run(_transaction_columns, rows)
+        result = await _batch_score(columns, explain)
+        return b''.join(_encode_json(row).encode("utf-8") + b'\n' for row in _batch_rows(columns, result))
+    
+    chunks = ndjson_chunks(http_request.stream(), max(1, settings.fraud_batch_chunk_size))
+    return await _stream_scored(chunks, score, "Streaming batch fraud detection")
+
+_NUMERIC_FIELDS = ('amount',)
+_STRING_FIELDS = tuple(name for name in TransactionRequest.model_fields if name not in _NUMERIC_FIELDS)
+_REQUIRED_FIELDS = tuple(name for name, field in TransactionRequest.model_fields.items() if field.is_required())
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8010)
@@ -0,0 +1,147 @@
+"""
+Service Metrics
+Prometheus histograms, counters and gauges for request stages and scoring outcomes
+"""
+
+import asyncio
+import functools
+import logging
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional
+
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily
+
+logger = logging.getLogger(__name__)
+
+# Sub-millisecond resolution: rule scoring itself takes tens of microseconds
+STAGE_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384, 65536)
+
+REQUEST_SECONDS = Histogram(
+    'aiml_request_duration_seconds', 'End-to-end request latency by route',
+    ['endpoint'], buckets=STAGE_BUCKETS
+)
+STAGE_SECONDS = Histogram(
+    'aiml_stage_duration_seconds',
+    'Latency by stage: parse and serialize per request, features and predict per scoring call',
+    ['stage'], buckets=STAGE_BUCKETS
+)
+IN_FLIGHT = Gauge('aiml_requests_in_flight', 'Requests currently being handled by route', ['endpoint'])
+EXECUTOR_IN_FLIGHT = Gauge('aiml_executor_in_flight', 'Calls running or queued on a scoring executor', ['executor'])
+BATCH_SIZE = Histogram(
+    'aiml_batch_size', 'Items per scoring batch by source', ['source'], buckets=BATCH_SIZE_BUCKETS
+)
+FRAUD_DECISIONS = Counter(
+    'aiml_fraud_decisions_total', 'Scored transactions by risk level and recommended action',
+    ['risk_level', 'recommended_action']
+)
+RISK_ASSESSMENTS = Counter('aiml_risk_assessments_total', 'Risk assessments by risk level', ['risk_level'])
+SCORING_TIERS = Counter(
+    'aiml_scoring_tier_total', 'Fraud decisions by the richest tier that produced them (rules, features, model)',
+    ['tier']
+)
+SCORING_TIER_SKIPS = Counter(
+    'aiml_scoring_tier_skipped_total', 'Scoring tiers skipped because they did not fit the request deadline',
+    ['tier']
+)
+TIMESTAMP_PARSE_FAILURES = Counter(
+    'aiml_timestamp_parse_failures_total', 'Transaction timestamps that could not be parsed (defaults were used)'
+)
+
+# Pre-bound children keep label lookups off the hot path
+PARSE_SECONDS = STAGE_SECONDS.labels('parse')
+SERIALIZE_SECONDS = STAGE_SECONDS.labels('serialize')
+FEATURES_SECONDS = STAGE_SECONDS.labels('features')
+PREDICT_SECONDS = STAGE_SECONDS.labels('predict')
+BATCH_FEATURES_SECONDS = STAGE_SECONDS.labels('batch_features')
+BATCH_PREDICT_SECONDS = STAGE_SECONDS.labels('batch_predict')
+
+# (handler started, handler finished) of the request being served
+_handler_span: ContextVar[Optional[list]] = ContextVar('handler_span', default=None)
+
+class InstrumentedRoute(APIRoute):
+    """
+    Route that records latency, in-flight requests and, for async endpoints
+    taking a request body, the parse (body decoding and validation before
+    the endpoint runs) and serialize (response encoding after it returns)
+    stages.
+    """
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        if asyncio.iscoroutinefunction(endpoint):
+            endpoint = _timed_endpoint(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+        self._request_seconds = REQUEST_SECONDS.labels(self.path)
+        self._in_flight = IN_FLIGHT.labels(self.path)
+
+    def get_route_handler(self) -> Callable:
+        return self.instrument(super().get_route_handler())
+
+    def instrument(self, handle: Callable) -> Callable:
+        """Wrap a request handler with this route's latency and in-flight metrics"""
+
+        async def instrumented(request: Request) -> Response:
+            span = [0.0, 0.0]
+            token = _handler_span.set(span)
+            self._in_flight.inc()
+            started = time.perf_counter()
+            try:
+                return await handle(request)
+            finally:
+                finished = time.perf_counter()
+                self._in_flight.dec()
+                _handler_span.reset(token)
+                self._request_seconds.observe(finished - started)
+                if span[1] and self.body_field is not None:
+                    PARSE_SECONDS.observe(span[0] - started)
+                    SERIALIZE_SECONDS.observe(finished - span[1])
+
+        return instrumented
+
+def _timed_endpoint(endpoint: Callable) -> Callable:
+    @functools.wraps(endpoint)
+    async def timed(*args, **kwargs):
+        span = _handler_span.get()
+        if span is not None:
+            span[0] = time.perf_counter()
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            if span is not None:
+                span[1] = time.perf_counter()
+    return timed
+
+def record_fraud_decisions(risk_levels, actions):
+    """Count decisions; accepts parallel sequences of labels"""
+    counts: Dict = {}
+    for key in zip(risk_levels, actions):
+        counts[key] = counts.get(key, 0) + 1
+    for (risk_level, action), count in counts.items():
+        FRAUD_DECISIONS.labels(risk_level, action).inc(count)
+
+def record_risk_levels(risk_levels):
+    counts: Dict = {}
+    for risk_level in risk_levels:
+        counts[risk_level] = counts.get(risk_level, 0) + 1
+    for risk_level, count in counts.items():
+        RISK_ASSESSMENTS.labels(risk_level).inc(count)
+
+class _RuleHitCollector:
+    """Reads per-rule hit counts at scrape time, so the scoring path only bumps plain ints"""
+
+    def __init__(self, hit_counts: Callable[[], Dict[str, int]]):
+        self.hit_counts = hit_counts
+
+    def collect(self):
+        family = CounterMetricFamily('aiml_fraud_rule_hits', 'Scored transactions each fraud rule fired on', labels=['rule'])
+        for rule, count in self.hit_counts().items():
+            family.add_metric([rule], count)
+        yield family
+
+def register_rule_hits(hit_counts: Callable[[], Dict[str, int]]):
+    REGISTRY.register(_RuleHitCollector(hit_counts))
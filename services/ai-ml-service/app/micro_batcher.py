@@ -0,0 +1,170 @@
+"""
+Micro-Batching Dispatcher
+Coalesces concurrent single-item requests into batches for a batched scoring path
+"""
+
+import asyncio
+import inspect
+import logging
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from .executors import ExecutorSaturatedError
+
+logger = logging.getLogger(__name__)
+
+class MicroBatcher:
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = 64, max_wait_ms: float = 2.0,
+                 max_concurrent_batches: int = 4, max_queue: int = 1024):
+        """
+        process_batch receives a list of queued items and must return one
+        result per item, in the same order. It may be sync or async.
+        Up to max_concurrent_batches batches are processed at once; once
+        max_queue items are waiting, submit raises ExecutorSaturatedError.
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.max_concurrent_batches = max(1, max_concurrent_batches)
+        self.max_queue = max(1, max_queue)
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._flushes: Set[asyncio.Task] = set()
+
+        # Stats
+        self._batches = 0
+        self._items = 0
+        self._max_batch_seen = 0
+        self._size_flushes = 0
+        self._deadline_flushes = 0
+        self._batch_size_buckets = {}  # power-of-two upper bound -> count
+        self._rejected = 0
+
+    async def submit(self, item: Any) -> Any:
+        """Queue an item and wait for its own result"""
+        self._ensure_worker()
+        future = self._loop.create_future()
+        try:
+            self._queue.put_nowait((item, future))
+        except asyncio.QueueFull:
+            self._rejected += 1
+            raise ExecutorSaturatedError(f"Micro-batcher queue is full ({self.max_queue} items waiting)")
+        return await future
+
+    async def stop(self):
+        """Stop the worker task and let in-flight batches finish; items still queued are failed"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+        if self._queue is not None:
+            while not self._queue.empty():
+                _, future = self._queue.get_nowait()
+                if not future.done():
+                    future.set_exception(RuntimeError("Micro-batcher stopped"))
+
+    def stats(self) -> Dict:
+        return {
+            'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'max_queue': self.max_queue,
+            'max_concurrent_batches': self.max_concurrent_batches,
+            'in_flight_batches': len(self._flushes),
+            'rejected': self._rejected,
+            'batches': self._batches,
+            'items': self._items,
+            'average_batch_size': self._items / self._batches if self._batches else 0.0,
+            'largest_batch': self._max_batch_seen,
+            'flushes_on_size': self._size_flushes,
+            'flushes_on_deadline': self._deadline_flushes,
+            'batch_size_histogram': {
+                f"<={bound}": count for bound, count in sorted(self._batch_size_buckets.items())
+            }
+        }
+
+    def _ensure_worker(self):
+        """Start (or restart) the worker on the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            if self._loop is not loop:
+                self._queue = asyncio.Queue(maxsize=self.max_queue)
+                self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+                self._loop = loop
+            self._worker = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            # Wait for a free flush slot first, so a backlog coalesces into
+            # bigger batches instead of piling up as in-flight ones
+            await self._slots.acquire()
+            batch = []
+            try:
+                batch.append(await self._queue.get())
+                deadline = self._loop.time() + self.max_wait
+
+                # Fill the batch until it is full or the deadline passes
+                while len(batch) < self.max_batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                        continue
+                    except asyncio.QueueEmpty:
+                        pass
+                    remaining = deadline - self._loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+            except asyncio.CancelledError:
+                self._slots.release()
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(RuntimeError("Micro-batcher stopped"))
+                raise
+
+            task = self._loop.create_task(self._flush(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flush_done)
+
+    def _flush_done(self, task: asyncio.Task):
+        self._flushes.discard(task)
+        self._slots.release()
+
+    async def _flush(self, batch: List):
+        self._record(len(batch))
+        items = [item for item, _ in batch]
+        try:
+            results = self.process_batch(items)
+            if inspect.isawaitable(results):
+                results = await results
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            logger.error(f"Micro-batch of {len(batch)} failed: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def _record(self, size: int):
+        self._batches += 1
+        self._items += size
+        self._max_batch_seen = max(self._max_batch_seen, size)
+        if size >= self.max_batch_size:
+            self._size_flushes += 1
+        else:
+            self._deadline_flushes += 1
+        bound = 1
+        while bound < size:
+            bound *= 2
+        self._batch_size_buckets[bound] = self._batch_size_buckets.get(bound, 0) + 1
@@ -0,0 +1,291 @@
+"""
+Model Registry
+Loads, versions, warms and hot-swaps serialized models from a local directory
+
+Models live in <model_path>/<name>/<version>.joblib (scikit-learn or any
+estimator with predict/predict_proba) or <version>.json (XGBoost). The
+most recently modified file is the one activated on a rescan.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .tree_compiler import compile_model
+
+logger = logging.getLogger(__name__)
+
+MODEL_EXTENSIONS = ('.joblib', '.json')
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+MAX_SPLIT_CHECKS = 20_000  # split points probed when validating a compiled model
+
+# Column order of the feature matrix each model is trained on
+FRAUD_MODEL_FEATURES = [
+    'amount', 'amount_log', 'is_unusual_time', 'hour_of_day', 'day_of_week', 'is_round_amount',
+    'transaction_velocity', 'account_age_days', 'location_change', 'new_device',
+    'amount_ratio', 'amount_zscore'
+]
+RISK_MODEL_FEATURES = [
+    'kyc_verified', 'account_age_days', 'total_transactions', 'average_transaction_amount',
+    'failed_transactions', 'disputes'
+]
+
+class LoadedModel:
+    def __init__(self, name: str, version: str, path: str, estimator, kind: str):
+        self.name = name
+        self.version = version
+        self.path = path
+        self.estimator = estimator
+        self.kind = kind  # 'classifier' scores with P(class 1), 'regressor' with predict()
+        self.model_type = type(estimator).__name__
+        self.mtime = os.path.getmtime(path)
+        self.file_bytes = os.path.getsize(path)
+        self.memory_bytes = 0
+        self.load_seconds = 0.0
+        self.warmup_seconds = 0.0
+        self.first_request_seconds = 0.0
+        self.compiled = None  # CompiledEnsemble when the compiled backend is active
+
+    @property
+    def backend(self) -> str:
+        return 'compiled' if self.compiled is not None else 'library'
+
+    def predict(self, matrix: np.ndarray) -> np.ndarray:
+        """One score per row of the feature matrix"""
+        if self.compiled is not None:
+            return self.compiled.predict(matrix)
+        return self.predict_library(matrix)
+
+    def predict_library(self, matrix: np.ndarray) -> np.ndarray:
+        """Score through the original estimator"""
+        if self.kind == 'classifier' and hasattr(self.estimator, 'predict_proba'):
+            return np.asarray(self.estimator.predict_proba(matrix))[:, 1]
+        return np.asarray(self.estimator.predict(matrix), dtype=np.float64)
+
+    def info(self) -> Dict:
+        return {
+            'version': self.version,
+            'type': self.model_type,
+            'backend': self.backend,
+            'path': self.path,
+            'file_bytes': self.file_bytes,
+            'memory_bytes': self.memory_bytes,
+            'load_seconds': self.load_seconds,
+            'warmup_seconds': self.warmup_seconds,
+            'first_request_seconds': self.first_request_seconds
+        }
+
+class ModelRegistry:
+    def __init__(self, model_path: str, name: str, kind: str, feature_names: List[str],
+                 warmup_rows: int = 256, backend: str = 'library', compile_tolerance: float = 1e-5):
+        """
+        backend 'compiled' flattens tree ensembles into NumPy arrays; models
+        that cannot be compiled, or whose compiled scores differ from the
+        library's by more than compile_tolerance, stay on the library.
+        """
+        if backend not in ('library', 'compiled'):
+            raise ValueError(f"Unknown model backend: {backend}")
+        self.directory = os.path.join(model_path, name)
+        self.name = name
+        self.kind = kind
+        self.feature_names = feature_names
+        self.warmup_rows = warmup_rows
+        self.backend = backend
+        self.compile_tolerance = compile_tolerance
+
+        self._active: Optional[LoadedModel] = None
+        self._lock = threading.Lock()
+        self._swaps = 0
+        self._failures = 0
+
+    def __getstate__(self):
+        # Registries travel to process-pool workers with their scorer
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> Optional[LoadedModel]:
+        """The model serving traffic; None means callers use their rules"""
+        return self._active
+
+    @property
+    def generation(self) -> int:
+        """Changes whenever the active model does"""
+        return self._swaps
+
+    def versions(self) -> List[str]:
+        """Available model versions, oldest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        files = [f for f in os.listdir(self.directory) if f.endswith(MODEL_EXTENSIONS)]
+        files.sort(key=lambda f: os.path.getmtime(os.path.join(self.directory, f)))
+        return [os.path.splitext(f)[0] for f in files]
+
+    def refresh(self) -> bool:
+        """Activate the newest model file if it differs from the active one"""
+        versions = self.versions()
+        if not versions:
+            return False
+        path = self._path_for(versions[-1])
+        active = self._active
+        if active is not None and active.path == path and active.mtime == os.path.getmtime(path):
+            return False
+        return self.activate(versions[-1])
+
+    def activate(self, version: str) -> bool:
+        """
+        Load and warm a version, then swap it in. Requests already holding
+        the previous model finish with it; a failed load keeps the current one.
+        """
+        path = self._path_for(version)
+        if path is None:
+            raise ValueError(f"Unknown {self.name} model version: {version}")
+
+        with self._lock:
+            try:
+                model = self._load(version, path)
+                if self.backend == 'compiled':
+                    self._compile(model)
+                self._warm(model)
+            except Exception as e:
+                self._failures += 1
+                logger.error(f"Failed to load {self.name} model {version}: {str(e)}")
+                return False
+            self._active = model
+            self._swaps += 1
+
+        logger.info(f"Activated {self.name} model {version} "
+                    f"(load {model.load_seconds:.2f}s, warmup {model.warmup_seconds:.3f}s)")
+        return True
+
+    def deactivate(self):
+        """Fall back to the rule-based scorer"""
+        with self._lock:
+            self._active = None
+            self._swaps += 1
+
+    async def watch(self, interval_seconds: float):
+        """Poll the model directory and hot-swap on change until cancelled"""
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                logger.error(f"Model watch for {self.name} failed: {str(e)}")
+
+    def info(self) -> Dict:
+        active = self._active
+        return {
+            'active': active.info() if active is not None else None,
+            'available_versions': self.versions(),
+            'swaps': self._swaps,
+            'load_failures': self._failures
+        }
+
+    def _path_for(self, version: str) -> Optional[str]:
+        # Only names listed in the model directory; never a path built from the version
+        if version not in self.versions():
+            return None
+        for extension in MODEL_EXTENSIONS:
+            path = os.path.join(self.directory, version + extension)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _load(self, version: str, path: str) -> LoadedModel:
+        started = time.perf_counter()
+        rss_before = _rss_bytes()
+        if path.endswith('.json'):
+            import xgboost
+            estimator = xgboost.XGBClassifier() if self.kind == 'classifier' else xgboost.XGBRegressor()
+            estimator.load_model(path)
+        else:
+            import joblib
+            estimator = joblib.load(path)
+        memory_bytes = _rss_bytes() - rss_before
+
+        model = LoadedModel(self.name, version, path, estimator, self.kind)
+        model.memory_bytes = max(0, memory_bytes)  # approximate: RSS growth during load
+        model.load_seconds = time.perf_counter() - started
+        return model
+
+    def _compile(self, model: LoadedModel):
+        """Switch the model to the NumPy backend if it reproduces the library scores"""
+        try:
+            compiled = compile_model(model.estimator)
+        except Exception as e:
+            logger.warning(f"{self.name} model {model.version} cannot be compiled ({str(e)}); using library")
+            return
+        # Random rows rarely land on a split; rows at and one float32 step either
+        # side of every threshold catch a comparison or rounding mismatch
+        matrix = np.vstack([self._warmup_matrix(), self._split_matrix(compiled)])
+        expected = model.predict_library(matrix)
+        actual = compiled.predict(matrix)
+        if not np.allclose(actual, expected, rtol=self.compile_tolerance, atol=self.compile_tolerance):
+            logger.warning(f"{self.name} model {model.version} compiled scores differ by up to "
+                           f"{np.max(np.abs(actual - expected)):.2e}; using library")
+            return
+        model.compiled = compiled
+
+    def _warmup_matrix(self) -> np.ndarray:
+        rng = np.random.default_rng(0)
+        return rng.random((self.warmup_rows, len(self.feature_names))) * 100
+
+    def _split_matrix(self, compiled) -> np.ndarray:
+        """Warmup rows with one feature set at, just below and just above a split threshold"""
+        points = compiled.split_points()
+        if len(points) > MAX_SPLIT_CHECKS:
+            points = points[np.random.default_rng(0).choice(len(points), MAX_SPLIT_CHECKS, replace=False)]
+        features = points[:, 0].astype(np.int64)
+        threshold = points[:, 1].astype(np.float32)
+        values = np.concatenate([np.nextafter(threshold, np.float32(-np.inf)), threshold,
+                                 np.nextafter(threshold, np.float32(np.inf))])
+        base = self._warmup_matrix()
+        matrix = base[np.arange(len(values)) % len(base)]
+        matrix[np.arange(len(values)), np.tile(features, 3)] = values
+        return matrix
+
+    def _warm(self, model: LoadedModel):
+        """Score a synthetic batch, then a single row, before taking traffic"""
+        matrix = self._warmup_matrix()
+
+        started = time.perf_counter()
+        scores = model.predict(matrix)
+        model.warmup_seconds = time.perf_counter() - started
+        if len(scores) != self.warmup_rows or not np.all(np.isfinite(scores)):
+            raise ValueError("Model produced invalid scores on the warmup batch")
+
+        started = time.perf_counter()
+        model.predict(matrix[:1])
+        model.first_request_seconds = time.perf_counter() - started
+
+def _rss_bytes() -> int:
+    """Resident set size of this process (Linux), or 0 if unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+def feature_matrix(features: Dict, feature_names: List[str], n: Optional[int] = None) -> np.ndarray:
+    """
+    Stack features into a float matrix in model column order. Accepts a
+    single feature dict (one row) or batch columns of length n.
+    """
+    if n is None:
+        return np.array([[float(features.get(name) or 0) for name in feature_names]], dtype=np.float64)
+    matrix = np.zeros((n, len(feature_names)), dtype=np.float64)
+    for j, name in enumerate(feature_names):
+        if features.get(name) is not None:
+            matrix[:, j] = np.asarray(features[name], dtype=np.float64)
+    return matrix
@@ -0,0 +1,132 @@
+"""
+Fraud Result Cache
+Idempotent LRU + TTL cache of detection results keyed by transaction id and payload hash
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class ResultCache:
+    def __init__(self, max_entries: int = 100_000, ttl_seconds: float = 600, max_seen: int = 1_000_000):
+        """
+        Caches up to max_entries results for ttl_seconds. Separately
+        remembers the last max_seen transaction ids whose stateful feature
+        updates were applied, so retries and re-checks (even after a result
+        expires or with a changed payload) never apply them twice.
+        Used from the event loop only; it is not thread-safe.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_seen = max_seen
+
+        self._entries: OrderedDict = OrderedDict()  # transaction_id -> (payload_hash, expires_at, result)
+        self._seen: OrderedDict = OrderedDict()     # transaction_id -> None
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._uncached = 0
+
+    @staticmethod
+    def payload_hash(payload: bytes) -> str:
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+    def get(self, transaction_id: str, payload_hash: str) -> Optional[Any]:
+        entry = self._entries.get(transaction_id)
+        if entry is None or entry[0] != payload_hash:
+            return None
+        if entry[1] < time.monotonic():
+            del self._entries[transaction_id]
+            self._expirations += 1
+            return None
+        self._entries.move_to_end(transaction_id)
+        return entry[2]
+
+    def put(self, transaction_id: str, payload_hash: str, result: Any):
+        self._entries[transaction_id] = (payload_hash, time.monotonic() + self.ttl_seconds, result)
+        self._entries.move_to_end(transaction_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def claim_state_update(self, transaction_id: str) -> bool:
+        """True the first time a transaction id is claimed, False afterwards"""
+        if transaction_id in self._seen:
+            self._seen.move_to_end(transaction_id)
+            return False
+        self._seen[transaction_id] = None
+        if len(self._seen) > self.max_seen:
+            self._seen.popitem(last=False)
+        return True
+
+    def release_state_update(self, transaction_id: str):
+        """Undo a claim whose scoring failed before state was updated"""
+        self._seen.pop(transaction_id, None)
+
+    async def get_or_compute(self, transaction_id: str, payload_hash: str,
+                             compute: Callable[[bool], Awaitable[Any]],
+                             cacheable: Optional[Callable[[Any], bool]] = None) -> Tuple[Any, bool]:
+        """
+        Return (result, cached). On a miss, compute(update_state) is awaited;
+        concurrent identical requests share one computation. A result for
+        which cacheable(result) is false is returned but not stored.
+        """
+        cached = self.get(transaction_id, payload_hash)
+        if cached is not None:
+            self._hits += 1
+            return cached, True
+
+        key = (transaction_id, payload_hash)
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self._coalesced += 1
+            return await asyncio.shield(pending), True
+
+        self._misses += 1
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())  # avoid "never retrieved" warnings
+        self._inflight[key] = future
+        update_state = self.claim_state_update(transaction_id)
+        try:
+            result = await compute(update_state)
+        except BaseException as e:
+            if update_state:
+                self.release_state_update(transaction_id)
+            if isinstance(e, Exception):
+                future.set_exception(e)
+            else:
+                future.cancel()
+            raise
+        finally:
+            del self._inflight[key]
+        if cacheable is None or cacheable(result):
+            self.put(transaction_id, payload_hash, result)
+        else:
+            self._uncached += 1
+        future.set_result(result)
+        return result, False
+
+    def stats(self) -> Dict:
+        lookups = self._hits + self._misses + self._coalesced
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds,
+            'seen_transactions': len(self._seen),
+            'hits': self._hits,
+            'misses': self._misses,
+            'coalesced': self._coalesced,
+            'hit_ratio': (self._hits + self._coalesced) / lookups if lookups else 0.0,
+            'evictions': self._evictions,
+            'expirations': self._expirations,
+            'uncached': self._uncached
+        }
@@ -0,0 +1,108 @@
+"""
+Risk Profile Cache
+LRU + TTL cache of risk assessments keyed by user id and a hash of the assessment inputs
+"""
+
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class RiskProfileCache:
+    def __init__(self, max_entries: int = 100_000, ttl_seconds: float = 300):
+        """
+        Keeps the latest assessment of up to max_entries users for
+        ttl_seconds. An entry is only served for identical inputs, and
+        invalidate() drops a user's profile when their history changes.
+        Used from the event loop only; it is not thread-safe.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._entries: OrderedDict = OrderedDict()  # user_id -> (input_hash, computed_at, result)
+        self._inflight: Dict[str, int] = {}          # user_id -> assessments being computed
+        self._dirty = set()                          # users invalidated while being computed
+
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+        self._discarded = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._hit_age_total = 0.0
+        self._hit_age_max = 0.0
+
+    def get(self, user_id: str, input_hash: str) -> Optional[Any]:
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] != input_hash:
+            return None
+        age = time.monotonic() - entry[1]
+        if age > self.ttl_seconds:
+            del self._entries[user_id]
+            self._expirations += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self._hit_age_total += age
+        self._hit_age_max = max(self._hit_age_max, age)
+        return entry[2]
+
+    def put(self, user_id: str, input_hash: str, result: Any, computed_at: Optional[float] = None):
+        self._entries[user_id] = (input_hash, computed_at if computed_at is not None else time.monotonic(), result)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def invalidate(self, user_id: str) -> bool:
+        """Drop a user's cached profile; True if one was cached"""
+        self._invalidations += 1
+        if user_id in self._inflight:
+            self._dirty.add(user_id)
+        return self._entries.pop(user_id, None) is not None
+
+    async def get_or_compute(self, user_id: str, input_hash: str,
+                             compute: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Return (result, cached). A result computed while its user was
+        invalidated is returned but not cached.
+        """
+        cached = self.get(user_id, input_hash)
+        if cached is not None:
+            self._hits += 1
+            return cached, True
+
+        self._misses += 1
+        started = time.monotonic()
+        self._inflight[user_id] = self._inflight.get(user_id, 0) + 1
+        try:
+            result = await compute()
+        finally:
+            stale = user_id in self._dirty
+            self._inflight[user_id] -= 1
+            if not self._inflight[user_id]:
+                del self._inflight[user_id]
+                self._dirty.discard(user_id)
+        if stale:
+            self._discarded += 1
+        else:
+            self.put(user_id, input_hash, result, started)
+        return result, False
+
+    def stats(self) -> Dict:
+        lookups = self._hits + self._misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds,
+            'hits': self._hits,
+            'misses': self._misses,
+            'hit_ratio': self._hits / lookups if lookups else 0.0,
+            'invalidations': self._invalidations,
+            'discarded_stale': self._discarded,
+            'evictions': self._evictions,
+            'expirations': self._expirations,
+            'average_hit_age_seconds': self._hit_age_total / self._hits if self._hits else 0.0,
+            'max_hit_age_seconds': self._hit_age_max
+        }
@@ -4,13 +4,34 @@ Assesses customer creditworthiness and determines credit limits
 """
 
 import logging
-from typing import Dict
+import numpy as np
+from typing import Dict, List, Optional
+
+from .model_registry import ModelRegistry, RISK_MODEL_FEATURES, feature_matrix
 
 logger = logging.getLogger(__name__)
 
+# Reason codes: bit i of a reason mask stands for RISK_REASONS[i]
+RISK_REASONS = [
+    "KYC verified",
+    "KYC not verified",
+    "Established account (>1 year)",
+    "Mature account (>3 months)",
+    "Very new account (<7 days)",
+    "Strong transaction history (>100 txns)",
+    "Good transaction history (>20 txns)",
+    "Limited transaction history (<5 txns)",
+    "High average transaction amount",
+    "Low average transaction amount",
+    "Multiple failed transactions",
+    "Transaction disputes ({disputes})"  # the count is filled in by explain()
+]
+DISPUTES_BIT = 11
+
 class RiskScorer:
-    def __init__(self):
-        self.model_version = "1.0.0"
+    def __init__(self, registry: Optional[ModelRegistry] = None):
+        self.rules_version = "1.0.0"
+        self.registry = registry
         self._loaded = True
         
         # Base credit limits by risk level
@@ -24,65 +45,86 @@ class RiskScorer:
     def is_loaded(self) -> bool:
         return self._loaded
     
-    def predict(self, features: Dict) -> Dict:
+    @property
+    def model_version(self) -> str:
+        model = self.registry.active if self.registry is not None else None
+        return model.version if model is not None else self.rules_version
+    
+    @property
+    def generation(self) -> Optional[int]:
+        """Changes whenever the active model does"""
+        return self.registry.generation if self.registry is not None else None
+    
+    @property
+    def model_type(self) -> str:
+        model = self.registry.active if self.registry is not None else None
+        return model.model_type if model is not None else "Rule-based"
+    
+    def predict(self, features: Dict, explain: bool = False) -> Dict:
         """
-        Predict customer risk score and credit limit
+        Predict customer risk score and credit limit. The factors that
+        applied come back as reason_mask; texts are added only when explain is set.
         """
-        reasons = []
+        mask = 0
         risk_score = 50.0  # Start at medium risk
         
         # Factor 1: KYC Verification
         if features.get('kyc_verified', False):
             risk_score -= 15
-            reasons.append("KYC verified")
+            mask |= 1 << 0
         else:
             risk_score += 20
-            reasons.append("KYC not verified")
+            mask |= 1 << 1
         
         # Factor 2: Account Age
         account_age = features.get('account_age_days', 0)
         if account_age > 365:
             risk_score -= 10
-            reasons.append("Established account (>1 year)")
+            mask |= 1 << 2
         elif account_age > 90:
             risk_score -= 5
-            reasons.append("Mature account (>3 months)")
+            mask |= 1 << 3
         elif account_age < 7:
             risk_score += 15
-            reasons.append("Very new account (<7 days)")
+            mask |= 1 << 4
         
         # Factor 3: Transaction History
         total_txns = features.get('total_transactions', 0)
         if total_txns > 100:
             risk_score -= 10
-            reasons.append("Strong transaction history (>100 txns)")
+            mask |= 1 << 5
         elif total_txns > 20:
             risk_score -= 5
-            reasons.append("Good transaction history (>20 txns)")
+            mask |= 1 << 6
         elif total_txns < 5:
             risk_score += 10
-            reasons.append("Limited transaction history (<5 txns)")
+            mask |= 1 << 7
         
         # Factor 4: Average Transaction Amount
         avg_amount = features.get('average_transaction_amount', 0)
         if avg_amount > 10000:
             risk_score -= 5
-            reasons.append("High average transaction amount")
+            mask |= 1 << 8
         elif avg_amount < 500:
             risk_score += 5
-            reasons.append("Low average transaction amount")
+            mask |= 1 << 9
         
         # Factor 5: Failed Transactions
         failed_txns = features.get('failed_transactions', 0)
         if failed_txns > 5:
             risk_score += 15
-            reasons.append("Multiple failed transactions")
+            mask |= 1 << 10
         
         # Factor 6: Dispute History
         disputes = features.get('disputes', 0)
         if disputes > 0:
             risk_score += 10 * disputes
-            reasons.append(f"Transaction disputes ({disputes})")
+            mask |= 1 << DISPUTES_BIT
+        
+        # A loaded model replaces the rule score; rules still explain it
+        model = self.registry.active if self.registry is not None else None
+        if model is not None:
+            risk_score = float(model.predict(feature_matrix(features, RISK_MODEL_FEATURES))[0])
         
         # Ensure risk score is between 0 and 100
         risk_score = max(0, min(100, risk_score))
@@ -112,9 +154,106 @@ class RiskScorer:
         if not features.get('kyc_verified', False):
             credit_limit *= 0.5
         
-        return {
+        result = {
+            'risk_score': risk_score,
+            'risk_level': risk_level,
+            'credit_limit': credit_limit,
+            'reason_mask': mask,
+            'model_version': model.version if model is not None else self.rules_version
+        }
+        if explain:
+            result['reasons'] = self.explain(mask, disputes)
+        return result
+    
+    @staticmethod
+    def explain(reason_mask: int, disputes=0) -> List[str]:
+        """Reason texts for a mask, in factor order"""
+        reasons = [RISK_REASONS[i] for i in range(DISPUTES_BIT) if reason_mask >> i & 1]
+        if reason_mask >> DISPUTES_BIT & 1:
+            reasons.append(RISK_REASONS[DISPUTES_BIT].format(disputes=disputes))
+        return reasons
+    
+    @staticmethod
+    def codes() -> List[Dict]:
+        """The bit assigned to each reason"""
+        return [{'bit': i, 'reason': reason} for i, reason in enumerate(RISK_REASONS)]
+    
+    def predict_batch(self, features: Dict, with_reasons: bool = False) -> Dict:
+        """
+        Predict risk for a batch of users given column features. All six
+        factors, the risk-level buckets and the credit-limit multipliers are
+        applied as array operations; results match predict() row for row.
+        """
+        n = len(next(iter(features.values())))
+        
+        def column(name, default):
+            values = features.get(name)
+            if values is None:
+                return np.full(n, default, dtype=np.float64)
+            if isinstance(values, np.ndarray):
+                return values.astype(np.float64)
+            return np.array([default if v is None else v for v in values], dtype=np.float64)
+        
+        kyc_verified = column('kyc_verified', False).astype(bool)
+        account_age = column('account_age_days', 0)
+        total_txns = column('total_transactions', 0)
+        avg_amount = column('average_transaction_amount', 0)
+        failed_txns = column('failed_transactions', 0)
+        disputes = column('disputes', 0)
+        
+        # (conditions, score deltas, reason bits) per factor, in predict() order;
+        # the first matching condition of each factor applies
+        factors = [
+            ([kyc_verified, ~kyc_verified], [-15, 20], [0, 1]),
+            ([account_age > 365, account_age > 90, account_age < 7], [-10, -5, 15], [2, 3, 4]),
+            ([total_txns > 100, total_txns > 20, total_txns < 5], [-10, -5, 10], [5, 6, 7]),
+            ([avg_amount > 10000, avg_amount < 500], [-5, 5], [8, 9]),
+            ([failed_txns > 5], [15], [10]),
+            ([disputes > 0], [10 * disputes], [DISPUTES_BIT])
+        ]
+        
+        risk_score = np.full(n, 50.0)
+        reason_mask = np.zeros(n, dtype=np.int64)
+        for conditions, deltas, bits in factors:
+            risk_score += np.select(conditions, deltas, default=0)
+            reason_mask |= np.select(conditions, [1 << bit for bit in bits], default=0)
+        
+        model = self.registry.active if self.registry is not None else None
+        if model is not None:
+            risk_score = model.predict(feature_matrix(features, RISK_MODEL_FEATURES, n))
+        risk_score = np.clip(risk_score, 0, 100)
+        
+        levels = [risk_score >= 75, risk_score >= 60, risk_score >= 40]
+        risk_level = np.select(levels, ["CRITICAL", "HIGH", "MEDIUM"], default="LOW").astype(object)
+        base_limit = np.select(
+            levels,
+            [self.credit_limits['CRITICAL'], self.credit_limits['HIGH'], self.credit_limits['MEDIUM']],
+            default=self.credit_limits['LOW']
+        )
+        credit_limit = base_limit * np.select([total_txns > 100, total_txns > 50], [1.5, 1.2], default=1.0)
+        credit_limit = np.where(kyc_verified, credit_limit, credit_limit * 0.5)
+        
+        result = {
             'risk_score': risk_score,
             'risk_level': risk_level,
             'credit_limit': credit_limit,
-            'reasons': reasons
+            'reason_mask': reason_mask,
+            'model_version': model.version if model is not None else self.rules_version
         }
+        
+        if with_reasons:
+            raw_disputes = features.get('disputes')
+            if raw_disputes is None:
+                raw_disputes = [0] * n
+            # Texts are decoded once per distinct (mask, dispute count)
+            explained = {}
+            reasons = []
+            for mask, count in zip(reason_mask.tolist(), raw_disputes):
+                key = (mask, count if mask >> DISPUTES_BIT & 1 else 0)
+                texts = explained.get(key)
+                if texts is None:
+                    texts = explained[key] = self.explain(*key)
+                reasons.append(texts)
+            result['reasons'] = reasons
+        
+        return result
@@ -0,0 +1,325 @@
+"""
+Fraud Rule Engine
+Compiles a JSON/YAML rule table into scalar and vectorized scoring functions, with hot reload and hit counts
+"""
+
+import asyncio
+import json
+import logging
+import operator
+import os
+import threading
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# The rules FraudDetector has always applied, in evaluation order
+DEFAULT_FRAUD_RULES = {
+    'version': '1.0.0',
+    'fraud_threshold': 0.7,
+    'risk_levels': [
+        {'min_score': 0.8, 'level': 'CRITICAL'},
+        {'min_score': 0.6, 'level': 'HIGH'},
+        {'min_score': 0.4, 'level': 'MEDIUM'}
+    ],
+    'default_level': 'LOW',
+    'rules': [
+        {'name': 'high_amount', 'feature': 'amount', 'op': '>', 'threshold': 50000, 'default': 0,
+         'weight': 0.3, 'reason': 'High transaction amount (>{threshold} KES)'},
+        {'name': 'unusual_time', 'feature': 'is_unusual_time', 'op': 'true', 'default': False,
+         'weight': 0.2, 'reason': 'Transaction at unusual time (10 PM - 6 AM)'},
+        {'name': 'velocity', 'feature': 'transaction_velocity', 'op': '>', 'threshold': 5, 'default': 0,
+         'weight': 0.25, 'reason': 'High transaction velocity (>{threshold}/hour)'},
+        {'name': 'new_account', 'feature': 'account_age_days', 'op': '<', 'threshold': 7, 'default': 365,
+         'weight': 0.15, 'reason': 'New account (< 7 days old)'},
+        {'name': 'round_amount', 'feature': 'is_round_amount', 'op': 'true', 'default': False,
+         'weight': 0.1, 'reason': 'Round transaction amount'},
+        {'name': 'location_change', 'feature': 'location_change', 'op': 'true', 'default': False,
+         'weight': 0.2, 'reason': 'Transaction from different location'},
+        {'name': 'new_device', 'feature': 'new_device', 'op': 'true', 'default': False,
+         'weight': 0.15, 'reason': 'Transaction from new device'},
+        {'name': 'amount_ratio', 'feature': 'amount_ratio', 'op': '>', 'threshold': 5.0, 'default': 1.0,
+         'weight': 0.25, 'reason': 'Amount significantly higher than user average'}
+    ]
+}
+
+OPERATORS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le,
+             '==': operator.eq, '!=': operator.ne}
+
+NO_FRAUD_REASONS = "No fraud indicators detected"
+MAX_RULES = 63  # one bit each in an int64 reason mask
+
+class RuleTableError(ValueError):
+    """Raised when a rule table is malformed"""
+
+class CompiledRules:
+    """
+    One immutable rule table. evaluate(features) is generated Python with
+    the thresholds and weights inlined, so it runs like the hand-written
+    rules it replaces; evaluate_batch(features, n) applies each rule as an
+    array mask. Both add rule weights in table order, so their float sums
+    agree. Fired rules are reported as a reason mask (bit i: rule i), and
+    explain() turns a mask into text only when a caller asks for it.
+    Pickling drops the generated function and recompiles it on load, so a
+    table can be sent to a process pool.
+    """
+
+    def __init__(self, table: Dict, source: Optional[str] = None):
+        self.table = table
+        self.source = source
+        self.version = str(table.get('version', 'unversioned'))
+        self.fraud_threshold = _number(table.get('fraud_threshold', 0.7), 'fraud_threshold')
+        self.risk_levels = [(_number(level['min_score'], 'min_score'), str(level['level']))
+                            for level in table.get('risk_levels', [])]
+        self.default_level = str(table.get('default_level', 'LOW'))
+        self.rules = [_validate_rule(rule, i) for i, rule in enumerate(table.get('rules', []))]
+        if len(self.rules) > MAX_RULES:
+            raise RuleTableError(f"A rule table holds at most {MAX_RULES} rules")
+        names = [rule['name'] for rule in self.rules]
+        if len(set(names)) != len(names):
+            raise RuleTableError("Rule names must be unique")
+        self.names = names
+        self.messages = [rule['message'] for rule in self.rules]
+        self.features = frozenset(rule['feature'] for rule in self.rules)
+        self.hits = [0] * len(self.rules)  # scalar path, bumped by the generated code
+        self.batch_hits = np.zeros(len(self.rules), dtype=np.int64)
+        self.evaluate = self._generate()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['evaluate']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.evaluate = self._generate()
+
+    def evaluate_batch(self, features: Dict, n: int, count_hits: bool = True):
+        """
+        (score array capped at 1.0, int64 reason mask array). count_hits=False
+        leaves hits to the caller (record_batch_hits), for evaluation in a
+        worker process whose counters the server never sees.
+        """
+        score = np.zeros(n, dtype=np.float64)
+        reason_mask = np.zeros(n, dtype=np.int64)
+        for i, rule in enumerate(self.rules):
+            values = features.get(rule['feature'])
+            values = np.full(n, rule['default']) if values is None else np.asarray(values)
+            fired = values.astype(bool) if rule['op'] == 'true' else OPERATORS[rule['op']](values, rule['threshold'])
+            score += np.where(fired, rule['weight'], 0.0)
+            reason_mask |= fired.astype(np.int64) << i
+            if count_hits:
+                self.batch_hits[i] += np.count_nonzero(fired)
+        return np.minimum(score, 1.0), reason_mask
+
+    def record_batch_hits(self, reason_mask: np.ndarray):
+        """Count the rules fired in a reason mask array from evaluate_batch(count_hits=False)"""
+        for i in range(len(self.rules)):
+            self.batch_hits[i] += np.count_nonzero(reason_mask >> i & 1)
+    
+    def explain(self, reason_mask: int) -> List[str]:
+        """Reason texts for a mask, in table order"""
+        messages = self.messages
+        return [messages[i] for i in range(len(messages)) if reason_mask >> i & 1] or [NO_FRAUD_REASONS]
+    
+    def explain_batch(self, reason_mask: np.ndarray) -> List[List[str]]:
+        """Reason texts per row, decoded once per distinct mask (rows with equal masks share a list)"""
+        masks, inverse = np.unique(reason_mask, return_inverse=True)
+        texts = [self.explain(mask) for mask in masks.tolist()]
+        return [texts[j] for j in inverse.tolist()]
+    
+    def codes(self) -> List[Dict]:
+        """The bit assigned to each rule's reason"""
+        return [{'bit': i, 'name': name, 'reason': message}
+                for i, (name, message) in enumerate(zip(self.names, self.messages))]
+
+    def classify(self, score: float) -> str:
+        for min_score, level in self.risk_levels:
+            if score >= min_score:
+                return level
+        return self.default_level
+
+    def classify_batch(self, score: np.ndarray) -> np.ndarray:
+        return np.select([score >= min_score for min_score, _ in self.risk_levels],
+                         [level for _, level in self.risk_levels], default=self.default_level).astype(object)
+
+    def hit_counts(self) -> Dict[str, int]:
+        return {name: self.hits[i] + int(self.batch_hits[i]) for i, name in enumerate(self.names)}
+
+    def with_threshold(self, name: str, threshold) -> 'CompiledRules':
+        """A copy of this table with one rule's threshold replaced"""
+        if name not in self.names:
+            raise KeyError(f"No rule named {name}")
+        rules = [dict(rule, threshold=threshold) if rule['name'] == name else rule
+                 for rule in self.table.get('rules', [])]
+        return CompiledRules(dict(self.table, rules=rules), self.source)
+
+    def threshold(self, name: str):
+        if name not in self.names:
+            raise KeyError(f"No rule named {name}")
+        return self.rules[self.names.index(name)]['threshold']
+
+    def _generate(self) -> Callable[[Dict], tuple]:
+        """Emit one straight-line function (score, reason mask) for the table; values are validated numbers, inlined with repr"""
+        lines = ['def evaluate(features):',
+                 '    get = features.get',
+                 '    score = 0.0',
+                 '    mask = 0']
+        for i, rule in enumerate(self.rules):
+            value = f"get({rule['feature']!r}, {rule['default']!r})"
+            test = value if rule['op'] == 'true' else f"{value} {rule['op']} {rule['threshold']!r}"
+            lines += [f"    if {test}:",
+                      f"        score += {rule['weight']!r}",
+                      f"        mask |= {1 << i}",
+                      f"        HITS[{i}] += 1"]
+        lines += ['    if score > 1.0:',
+                  '        score = 1.0',
+                  '    return score, mask']
+        namespace = {'HITS': self.hits, 'inf': float('inf')}
+        exec(compile('\n'.join(lines), f"<fraud rules {self.version}>", 'exec'), namespace)
+        return namespace['evaluate']
+
+class RuleEngine:
+    """
+    Holds the active CompiledRules. A reload compiles the new table fully
+    before swapping it in with one reference assignment, so requests see
+    either the old table or the new one; a bad table keeps the current one.
+    """
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __init__(self, path: str = '', table: Optional[Dict] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._reloads = 0
+        self._failures = 0
+        self._swaps = 0
+        self._retired_hits: Dict[str, int] = {}
+        if table is None and path:
+            self._mtime = os.path.getmtime(path)
+            table = load_rule_table(path)
+        self._active = CompiledRules(table or DEFAULT_FRAUD_RULES, path or None)
+
+    @property
+    def active(self) -> CompiledRules:
+        return self._active
+
+    @property
+    def generation(self) -> int:
+        """Changes whenever the active table does"""
+        return self._swaps
+
+    def swap(self, rules: CompiledRules):
+        """Make rules the active table, keeping the hit counts of the one it replaces"""
+        with self._lock:
+            retired = self._active
+            self._active = rules
+            self._swaps += 1
+            for name, count in retired.hit_counts().items():
+                self._retired_hits[name] = self._retired_hits.get(name, 0) + count
+
+    def refresh(self) -> bool:
+        """Reload the rule file if it changed on disk"""
+        if not self.path or not os.path.exists(self.path) or os.path.getmtime(self.path) == self._mtime:
+            return False
+        return self.reload()
+
+    def reload(self) -> bool:
+        if not self.path:
+            return False
+        try:
+            mtime = os.path.getmtime(self.path)
+            rules = CompiledRules(load_rule_table(self.path), self.path)
+        except Exception as e:
+            self._failures += 1
+            logger.error(f"Failed to load fraud rules from {self.path}: {str(e)}")
+            return False
+        self.swap(rules)
+        self._mtime = mtime
+        self._reloads += 1
+        logger.info(f"Fraud rules {rules.version} loaded from {self.path}")
+        return True
+
+    async def watch(self, interval_seconds: float):
+        """Poll the rule file and hot-swap on change until cancelled"""
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                logger.error(f"Fraud rule watch failed: {str(e)}")
+
+    def hit_counts(self) -> Dict[str, int]:
+        """Hits per rule name since start-up, across reloads"""
+        counts = dict(self._retired_hits)
+        for name, count in self._active.hit_counts().items():
+            counts[name] = counts.get(name, 0) + count
+        return counts
+
+    def info(self) -> Dict:
+        active = self._active
+        return {
+            'version': active.version,
+            'source': active.source or 'built-in',
+            'fraud_threshold': active.fraud_threshold,
+            'risk_levels': [{'min_score': min_score, 'level': level} for min_score, level in active.risk_levels],
+            'rules': [{key: value for key, value in rule.items() if key != 'message'} for rule in active.rules],
+            'hits': self.hit_counts(),
+            'reloads': self._reloads,
+            'load_failures': self._failures
+        }
+
+def load_rule_table(path: str) -> Dict:
+    """Read a rule table from JSON, or YAML when the file ends in .yaml/.yml"""
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml
+            table = yaml.safe_load(f)
+        else:
+            table = json.load(f)
+    if not isinstance(table, dict) or not isinstance(table.get('rules'), list):
+        raise RuleTableError(f"{path} must hold a mapping with a 'rules' list")
+    return table
+
+def _number(value, field: str):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value != value:
+        raise RuleTableError(f"{field} must be a number, got {value!r}")
+    return value
+
+def _validate_rule(rule: Dict, index: int) -> Dict:
+    """Normalize one rule; everything inlined into generated code is checked here"""
+    if not isinstance(rule, dict):
+        raise RuleTableError(f"Rule {index} must be a mapping")
+    name = rule.get('name', f"rule_{index}")
+    feature = rule.get('feature')
+    op = rule.get('op', 'true')
+    if not isinstance(feature, str) or not feature.isidentifier():
+        raise RuleTableError(f"Rule {name}: feature must be a feature name, got {feature!r}")
+    if op != 'true' and op not in OPERATORS:
+        raise RuleTableError(f"Rule {name}: unknown op {op!r} (use 'true' or one of {', '.join(OPERATORS)})")
+    threshold = None if op == 'true' else _number(rule.get('threshold'), f"Rule {name} threshold")
+    default = rule.get('default', False if op == 'true' else 0)
+    if not isinstance(default, (int, float)):
+        raise RuleTableError(f"Rule {name}: default must be a number or boolean, got {default!r}")
+    return {
+        'name': str(name),
+        'feature': feature,
+        'op': op,
+        'threshold': threshold,
+        'default': default,
+        'weight': float(_number(rule.get('weight'), f"Rule {name} weight")),
+        'reason': str(rule.get('reason', name)),
+        'message': str(rule.get('reason', name)).format(threshold=threshold)
+    }
@@ -0,0 +1,46 @@
+"""
+Streaming Helpers
+Chunked reading of newline-delimited JSON request bodies
+"""
+
+import json
+import logging
+from typing import AsyncIterable, AsyncIterator, List
+
+logger = logging.getLogger(__name__)
+
+async def ndjson_chunks(stream: AsyncIterable[bytes], chunk_size: int) -> AsyncIterator[List]:
+    """
+    Parse an NDJSON byte stream into lists of at most chunk_size objects,
+    holding only one chunk (plus a partial line) in memory. Blank lines are
+    skipped; a malformed line raises ValueError with its line number.
+    """
+    chunk = []
+    buffer = b''
+    line_number = 0
+
+    def parse(line: bytes):
+        nonlocal line_number
+        line_number += 1
+        if line.strip():
+            try:
+                chunk.append(json.loads(line))
+            except ValueError as e:
+                raise ValueError(f"Invalid JSON on line {line_number}: {str(e)}")
+
+    async for data in stream:
+        buffer += data
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            parse(line)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    parse(buffer)
+    if chunk:
+        yield chunk
+
+async def list_chunks(items: List, chunk_size: int) -> AsyncIterator[List]:
+    """Split an already parsed list into slices of at most chunk_size items"""
+    for start in range(0, len(items), chunk_size):
+        yield items[start:start + chunk_size]
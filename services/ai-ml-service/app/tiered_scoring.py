@@ -0,0 +1,146 @@
+"""
+Tiered Scoring
+Scores a transaction in tiers of increasing cost, running each richer tier only if it fits the caller's deadline
+"""
+
+import logging
+import time
+from typing import Dict, FrozenSet, Optional, Tuple
+
+from .feature_engineer import FeatureEngineer
+from .fraud_detector import FraudDetector
+from .metrics import FEATURES_SECONDS, PREDICT_SECONDS, SCORING_TIERS, SCORING_TIER_SKIPS
+
+logger = logging.getLogger(__name__)
+
+TIERS = ('rules', 'features', 'model')
+
+# Pre-bound children keep label lookups off the hot path
+TIER_DECISIONS = {tier: SCORING_TIERS.labels(tier) for tier in TIERS}
+TIER_SKIPS = {tier: SCORING_TIER_SKIPS.labels(tier) for tier in TIERS[1:]}
+
+class TieredScorer:
+    """
+    Tiers, cheapest first:
+      rules     the rules over features computed from the request alone
+      features  the rules over every feature, including stateful lookups
+      model     the loaded model over every feature
+    The rules tier always runs. Without a deadline every tier runs, as
+    before. With one (a time.monotonic() instant), a richer tier runs only
+    if its estimated duration (an exponential moving average of past runs)
+    fits in the time left. When the features tier is skipped the
+    transaction's stateful update is deferred: score() reports it, and the
+    caller applies it with apply_state() after responding.
+    """
+
+    def __init__(self, feature_engineer: FeatureEngineer, fraud_detector: FraudDetector, smoothing: float = 0.2):
+        self.feature_engineer = feature_engineer
+        self.fraud_detector = fraud_detector
+        self.smoothing = smoothing
+        self._stages: Dict = {}  # needed features -> (request-only features, nodes computing them)
+        self._estimates = {'features': None, 'model': None}  # seconds per run
+        self._decisions = {tier: 0 for tier in TIERS}
+        self._skips = {tier: 0 for tier in TIERS[1:]}
+        self._deferred = 0
+
+    def score(self, transaction: Dict, update_state: bool = True, explain: bool = False,
+              deadline: Optional[float] = None) -> Tuple[Dict, bool]:
+        """
+        (prediction with its 'tier', whether the state update was deferred).
+        Features are added to transaction in place.
+        """
+        engineer, detector = self.feature_engineer, self.fraud_detector
+        needed = detector.required_features
+        if deadline is None:
+            # Every tier runs; the timings (request-only features included) keep the estimates current
+            started = time.perf_counter()
+            engineer.engineer_transaction_features(transaction, update_state, in_place=True, needed=needed)
+            elapsed = time.perf_counter() - started
+            FEATURES_SECONDS.observe(elapsed)
+            self._observe('features', elapsed)
+            started = time.perf_counter()
+            result = detector.predict(transaction, explain)
+            elapsed = time.perf_counter() - started
+            PREDICT_SECONDS.observe(elapsed)
+            tier = 'model' if result['used_model'] else 'features'
+            if result['used_model']:
+                self._observe('model', elapsed)
+            self.record(tier)
+            result['tier'] = tier
+            return result, False
+
+        # Rules tier: request-only features, no state touched yet
+        cheap, cheap_nodes = self._rules_stage(needed)
+        started = time.perf_counter()
+        engineer.engineer_transaction_features(transaction, False, in_place=True, needed=cheap)
+        tier, deferred = 'rules', False
+
+        if self._fits('features', deadline):
+            stage = time.perf_counter()
+            engineer.engineer_transaction_features(transaction, update_state, in_place=True, needed=needed,
+                                                   skip=cheap_nodes)
+            self._observe('features', time.perf_counter() - stage)
+            tier = 'features'
+        else:
+            self._skipped('features')
+            deferred = update_state
+        FEATURES_SECONDS.observe(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        model_loaded = detector.registry is not None and detector.registry.active is not None
+        use_model = tier == 'features' and model_loaded and self._fits('model', deadline)
+        if model_loaded and not use_model:
+            self._skipped('model')
+        result = detector.predict(transaction, explain, use_model=use_model)
+        elapsed = time.perf_counter() - started
+        PREDICT_SECONDS.observe(elapsed)
+        if result['used_model']:
+            self._observe('model', elapsed)
+            tier = 'model'
+        self.record(tier)
+        result['tier'] = tier
+        return result, deferred
+
+    def is_full(self, tier: str) -> bool:
+        """Whether tier is the richest one available, i.e. the result a caller without a deadline gets"""
+        registry = self.fraud_detector.registry
+        return tier == 'model' or (tier == 'features' and (registry is None or registry.active is None))
+
+    def apply_state(self, transaction: Dict):
+        """Apply the stateful feature updates a deadline-limited score() deferred"""
+        self.feature_engineer.engineer_transaction_features(transaction, True, needed=frozenset())
+        self._deferred += 1
+
+    def record(self, tier: str, count: int = 1):
+        """Count decisions made by a tier (batch paths score every row at full tier)"""
+        TIER_DECISIONS[tier].inc(count)
+        self._decisions[tier] += count
+
+    def stats(self) -> Dict:
+        return {
+            'decisions': dict(self._decisions),
+            'skipped': dict(self._skips),
+            'deferred_state_updates': self._deferred,
+            'estimated_ms': {stage: None if seconds is None else seconds * 1000
+                             for stage, seconds in self._estimates.items()}
+        }
+
+    def _rules_stage(self, needed: FrozenSet[str]) -> Tuple[FrozenSet[str], FrozenSet[str]]:
+        stage = self._stages.get(needed)
+        if stage is None:
+            cheap = needed & self.feature_engineer.graph.request_features
+            nodes = frozenset(node.name for node in self.feature_engineer.graph.plan(cheap, False))
+            stage = self._stages[needed] = (cheap, nodes)
+        return stage
+
+    def _fits(self, stage: str, deadline: float) -> bool:
+        estimate = self._estimates[stage]
+        return time.monotonic() + (estimate or 0.0) <= deadline
+
+    def _observe(self, stage: str, seconds: float):
+        estimate = self._estimates[stage]
+        self._estimates[stage] = seconds if estimate is None else estimate + self.smoothing * (seconds - estimate)
+
+    def _skipped(self, stage: str):
+        TIER_SKIPS[stage].inc()
+        self._skips[stage] += 1
@@ -0,0 +1,185 @@
+"""
+Timestamp Features
+Parses transaction timestamps once and derives epoch seconds, hour, weekday and the unusual-time flag
+"""
+
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from zoneinfo import ZoneInfo
+
+from .metrics import TIMESTAMP_PARSE_FAILURES
+
+logger = logging.getLogger(__name__)
+
+# Unusual time is 10 PM - 6 AM inclusive, in minutes since midnight
+UNUSUAL_START_MINUTE = 22 * 60
+UNUSUAL_END_MINUTE = 6 * 60
+DEFAULT_HOUR = 12
+DEFAULT_WEEKDAY = 3
+US_PER_DAY = 86_400 * 10**6
+US_PER_MINUTE = 60 * 10**6
+SIGNS = (ord('+'), ord('-'))
+ZONE_MARKERS = [ord(c) for c in '+-Zz']
+WHITESPACE = [ord(c) for c in ' \t\n\r\f\v']
+
+class TimestampFeatures:
+    """
+    Calendar features are taken in business_timezone when one is set, and
+    otherwise in each timestamp's own UTC offset. Naive timestamps are
+    read as UTC. Calendar lookups are cached per minute for the scalar path,
+    and malformed timestamps are counted rather than silently defaulted.
+    """
+
+    def __init__(self, business_timezone: Optional[str] = None, cache_size: int = 4096):
+        self.business_timezone = business_timezone or None
+        self._zone = ZoneInfo(business_timezone) if business_timezone else None
+        self.cache_size = cache_size
+        # Minute key -> (hour, weekday, minute of day). The key is the written
+        # minute ('YYYY-MM-DDTHH:MM') for own offsets, the UTC minute otherwise.
+        self._calendar: Dict = {}
+        self._hits = 0
+        self._misses = 0
+        self._parse_failures = 0
+
+    def parse(self, timestamp) -> Optional[Tuple[float, bool, int, int]]:
+        """(epoch seconds, is_unusual_time, hour_of_day, day_of_week), or None if malformed"""
+        try:
+            dt = datetime.fromisoformat(timestamp)
+        except (TypeError, ValueError):
+            self._record_failures(1, timestamp)
+            return None
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        epoch = dt.timestamp()
+
+        # Any ISO layout fromisoformat accepts spells out the minute within 16 characters
+        key = timestamp[:16] if self._zone is None else int(epoch // 60)
+        calendar = self._calendar.get(key)
+        if calendar is None:
+            self._misses += 1
+            local = dt.astimezone(self._zone) if self._zone is not None else dt
+            calendar = (local.hour, local.weekday(), local.hour * 60 + local.minute)
+            if len(self._calendar) >= self.cache_size:
+                self._calendar.pop(next(iter(self._calendar)))
+            self._calendar[key] = calendar
+        else:
+            self._hits += 1
+        hour, weekday, minute = calendar
+        unusual = (minute >= UNUSUAL_START_MINUTE or minute < UNUSUAL_END_MINUTE
+                   or (minute == UNUSUAL_END_MINUTE and dt.second == 0 and dt.microsecond == 0))
+        return epoch, unusual, hour, weekday
+
+    def parse_batch(self, timestamps: Sequence) -> Dict[str, np.ndarray]:
+        """
+        Parse a column of timestamps (str or None) and derive the same
+        features as parse(). A column in one layout (same length and zone
+        style, as exports and clients produce) is parsed straight to
+        datetime64 and the calendar fields come from array arithmetic;
+        mixed layouts fall back to parse() per row. Rows that are missing
+        or malformed have valid=False and default features.
+        """
+        n = len(timestamps)
+        rows = np.array([i for i, timestamp in enumerate(timestamps) if timestamp], dtype=np.int64)
+        features = {
+            'valid': np.zeros(n, dtype=bool),
+            'epoch_seconds': np.full(n, np.nan),
+            'is_unusual_time': np.zeros(n, dtype=bool),
+            'hour_of_day': np.full(n, DEFAULT_HOUR, dtype=np.int64),
+            'day_of_week': np.full(n, DEFAULT_WEEKDAY, dtype=np.int64)
+        }
+        uniform = _parse_uniform([timestamps[i] for i in rows]) if len(rows) else None
+
+        if uniform is None:
+            for i in rows:
+                parsed = self.parse(timestamps[i])
+                if parsed is not None:
+                    features['valid'][i] = True
+                    (features['epoch_seconds'][i], features['is_unusual_time'][i],
+                     features['hour_of_day'][i], features['day_of_week'][i]) = parsed
+            return features
+
+        utc_us, wall_us = uniform
+        if self._zone is not None:
+            wall_us = (pd.DatetimeIndex(utc_us.astype('datetime64[us]')).tz_localize('UTC')
+                       .tz_convert(self._zone).tz_localize(None).as_unit('us').asi8)
+        time_of_day = np.mod(wall_us, US_PER_DAY)
+        minute = time_of_day // US_PER_MINUTE
+        features['valid'][rows] = True
+        features['epoch_seconds'][rows] = utc_us / 1e6
+        features['is_unusual_time'][rows] = _is_unusual(minute, np.mod(time_of_day, US_PER_MINUTE) == 0)
+        features['hour_of_day'][rows] = minute // 60
+        features['day_of_week'][rows] = np.mod(wall_us // US_PER_DAY + 3, 7)  # 1970-01-01 was a Thursday
+        return features
+
+    def stats(self) -> Dict:
+        lookups = self._hits + self._misses
+        return {
+            'business_timezone': self.business_timezone,
+            'parse_failures': self._parse_failures,
+            'calendar_cache_entries': len(self._calendar),
+            'calendar_cache_size': self.cache_size,
+            'calendar_cache_hit_ratio': self._hits / lookups if lookups else 0.0
+        }
+
+    def _record_failures(self, count: int, example):
+        self._parse_failures += count
+        TIMESTAMP_PARSE_FAILURES.inc(count)
+        logger.debug(f"Unparseable timestamp ({count} in this call), e.g. {example!r}")
+
+def _parse_uniform(timestamps: Sequence) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    (UTC, wall clock) microseconds for strings that all share one length
+    and zone style ('Z', '+HH:MM' or none), or None when they do not.
+    """
+    if not all(isinstance(timestamp, str) for timestamp in timestamps):
+        return None
+    text = np.array(timestamps, dtype=str)
+    width = text.dtype.itemsize // 4
+    if width < 10:
+        return None
+    codes = text.view(np.uint32).reshape(len(text), width)
+    if (codes[:, -1] == 0).any():
+        return None  # shorter strings are zero-padded: lengths differ
+
+    if codes[0, -1] == ord('Z'):
+        suffix = 1
+        if (codes[:, -1] != ord('Z')).any():
+            return None
+        offset_us = 0
+    elif width >= 16 and codes[0, -6] in SIGNS and codes[0, -3] == ord(':'):
+        suffix = 6
+        zone = codes[:, -6:]
+        digits = zone[:, [1, 2, 4, 5]].astype(np.int64) - ord('0')
+        if (~np.isin(zone[:, 0], SIGNS)).any() or (zone[:, 3] != ord(':')).any() or \
+                ((digits < 0) | (digits > 9)).any():
+            return None
+        minutes = (digits[:, 0] * 10 + digits[:, 1]) * 60 + digits[:, 2] * 10 + digits[:, 3]
+        offset_us = np.where(zone[:, 0] == ord('-'), -minutes, minutes) * US_PER_MINUTE
+    else:
+        suffix = 0
+        offset_us = 0
+    # Any other zone marker after the date means another layout ('+03', '+0300', 'z')
+    if np.isin(codes[:, 10:width - suffix], ZONE_MARKERS).any():
+        return None
+    # NumPy skips surrounding whitespace that fromisoformat rejects; only the date/time separator may be a space
+    blank = np.isin(codes, WHITESPACE)
+    if width > 11:
+        blank[:, 10] &= codes[:, 10] != ord(' ')
+    if blank.any():
+        return None
+
+    try:
+        wall_us = text.astype(f'U{width - suffix}').astype('datetime64[us]').astype(np.int64)
+    except ValueError:
+        return None
+    if (wall_us == np.iinfo(np.int64).min).any():
+        return None  # 'NaT' parses in NumPy but not in fromisoformat
+    return wall_us - offset_us, wall_us
+
+def _is_unusual(minute: np.ndarray, on_minute: np.ndarray) -> np.ndarray:
+    """10 PM through exactly 6:00:00 AM, as parse() decides it per row"""
+    return (minute >= UNUSUAL_START_MINUTE) | (minute < UNUSUAL_END_MINUTE) | ((minute == UNUSUAL_END_MINUTE) & on_minute)
@@ -0,0 +1,184 @@
+"""
+Tree Ensemble Compiler
+Flattens scikit-learn forests and XGBoost boosters into NumPy arrays and
+scores them with a vectorized traversal, without per-call library overhead
+"""
+
+import json
+import logging
+from typing import List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class CompiledEnsemble:
+    def __init__(self, feature: np.ndarray, threshold: np.ndarray, left: np.ndarray, right: np.ndarray,
+                 default_left: np.ndarray, value: np.ndarray, roots: np.ndarray, max_depth: int,
+                 strict_less: bool, aggregate: str, base_score: float = 0.0, transform: str = 'identity'):
+        """
+        Node arrays are indexed by global node id; leaves have feature -1.
+        A row goes left when x <= threshold (x < threshold if strict_less),
+        or by default_left when x is NaN. Tree outputs are combined with
+        aggregate ('mean' or 'sum' + base_score) and then transform
+        ('identity' or 'sigmoid').
+        """
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.default_left = default_left
+        self.value = value
+        self.roots = roots
+        self.max_depth = max_depth
+        self.strict_less = strict_less
+        self.aggregate = aggregate
+        self.base_score = base_score
+        self.transform = transform
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.feature)
+
+    def split_points(self) -> np.ndarray:
+        """Distinct (feature, threshold) pairs of the internal nodes, as an (n, 2) array"""
+        internal = self.feature >= 0
+        return np.unique(np.column_stack([self.feature[internal], self.threshold[internal]]), axis=0)
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """Score each row of X"""
+        # Both libraries compare float32 inputs, so round the same way
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        n = X.shape[0]
+        rows = np.arange(n)[:, None]
+        node = np.broadcast_to(self.roots, (n, self.n_trees)).copy()
+        compare = np.less if self.strict_less else np.less_equal
+
+        for _ in range(self.max_depth):
+            feature = self.feature[node]
+            internal = feature >= 0
+            if not internal.any():
+                break
+            x = X[rows, np.where(internal, feature, 0)]
+            go_left = np.where(np.isnan(x), self.default_left[node], compare(x, self.threshold[node]))
+            node = np.where(internal, np.where(go_left, self.left[node], self.right[node]), node)
+
+        leaves = self.value[node]
+        if self.aggregate == 'mean':
+            raw = leaves.mean(axis=1)
+        else:
+            raw = leaves.sum(axis=1) + self.base_score
+        if self.transform == 'sigmoid':
+            return 1.0 / (1.0 + np.exp(-raw))
+        return raw
+
+def _concatenate(trees: List[dict], **kwargs) -> CompiledEnsemble:
+    """Join per-tree node arrays (with local child ids) into one ensemble"""
+    offsets = np.cumsum([0] + [len(tree['feature']) for tree in trees[:-1]])
+    left, right = [], []
+    for tree, offset in zip(trees, offsets):
+        internal = tree['feature'] >= 0
+        left.append(np.where(internal, tree['left'] + offset, -1))
+        right.append(np.where(internal, tree['right'] + offset, -1))
+    return CompiledEnsemble(
+        feature=np.concatenate([tree['feature'] for tree in trees]).astype(np.int64),
+        threshold=np.concatenate([tree['threshold'] for tree in trees]).astype(np.float64),
+        left=np.concatenate(left).astype(np.int64),
+        right=np.concatenate(right).astype(np.int64),
+        default_left=np.concatenate([tree['default_left'] for tree in trees]).astype(bool),
+        value=np.concatenate([tree['value'] for tree in trees]).astype(np.float64),
+        roots=offsets.astype(np.int64),
+        max_depth=max(tree['depth'] for tree in trees),
+        **kwargs
+    )
+
+def compile_sklearn(estimator) -> CompiledEnsemble:
+    """Compile a fitted scikit-learn decision tree, random forest or extra-trees model"""
+    estimators = getattr(estimator, 'estimators_', [estimator])
+    if not all(hasattr(tree, 'tree_') for tree in estimators):
+        raise ValueError(f"Cannot compile {type(estimator).__name__}")
+    is_classifier = hasattr(estimator, 'classes_')
+    if is_classifier and len(estimator.classes_) != 2:
+        raise ValueError("Only binary classifiers can be compiled")
+
+    trees = []
+    for tree in (t.tree_ for t in estimators):
+        if is_classifier:
+            # Probability of class 1 at each node
+            counts = tree.value[:, 0, :]
+            value = counts[:, 1] / counts.sum(axis=1)
+        else:
+            value = tree.value[:, 0, 0]
+        missing_left = getattr(tree, 'missing_go_to_left', None)
+        trees.append({
+            'feature': np.where(tree.children_left >= 0, tree.feature, -1),
+            'threshold': tree.threshold,
+            'left': tree.children_left,
+            'right': tree.children_right,
+            'default_left': missing_left if missing_left is not None else np.zeros(tree.node_count, dtype=bool),
+            'value': value,
+            'depth': tree.max_depth
+        })
+    return _concatenate(trees, strict_less=False, aggregate='mean')
+
+def compile_xgboost(model) -> CompiledEnsemble:
+    """Compile a fitted XGBoost model (sklearn wrapper or Booster) with a gbtree booster"""
+    booster = model.get_booster() if hasattr(model, 'get_booster') else model
+    config = json.loads(booster.save_config())
+    objective = config['learner']['objective']['name']
+    if objective == 'binary:logistic':
+        transform = 'sigmoid'
+    elif objective in ('reg:squarederror', 'reg:linear'):
+        transform = 'identity'
+    else:
+        raise ValueError(f"Cannot compile XGBoost objective {objective}")
+
+    base_score = float(config['learner']['learner_model_param']['base_score'].strip('[]'))
+    if transform == 'sigmoid':
+        base_score = float(np.log(base_score / (1 - base_score)))
+
+    # The raw model keeps every threshold as the exact float32 XGBoost compares
+    # against; get_dump() prints rounded decimals that misroute rows at a split
+    forest = json.loads(booster.save_raw('json'))['learner']['gradient_booster']
+    if forest['name'] != 'gbtree':
+        raise ValueError(f"Cannot compile XGBoost booster {forest['name']}")
+    raw_trees = forest['model']['trees']
+    best_iteration = getattr(model, 'best_iteration', None)
+    if best_iteration is not None:
+        raw_trees = raw_trees[:forest['model']['iteration_indptr'][best_iteration + 1]]
+
+    trees = []
+    for raw in raw_trees:
+        if any(raw['split_type']):
+            raise ValueError("Cannot compile categorical XGBoost splits")
+        left = np.asarray(raw['left_children'], dtype=np.int64)
+        right = np.asarray(raw['right_children'], dtype=np.int64)
+        internal = left >= 0
+        condition = np.asarray(raw['split_conditions'], dtype=np.float32).astype(np.float64)
+        depth, stack = 0, [(0, 0)]
+        while stack:
+            node, level = stack.pop()
+            depth = max(depth, level)
+            if internal[node]:
+                stack.extend(((left[node], level + 1), (right[node], level + 1)))
+        trees.append({
+            'feature': np.where(internal, np.asarray(raw['split_indices'], dtype=np.int64), -1),
+            'threshold': np.where(internal, condition, 0.0),
+            'left': left,
+            'right': right,
+            'default_left': np.asarray(raw['default_left'], dtype=bool),
+            'value': np.where(internal, 0.0, condition),  # a leaf's split condition holds its value
+            'depth': depth
+        })
+
+    return _concatenate(trees, strict_less=True, aggregate='sum', base_score=base_score, transform=transform)
+
+def compile_model(estimator) -> CompiledEnsemble:
+    """Compile any supported tree ensemble"""
+    if hasattr(estimator, 'get_booster') or type(estimator).__name__ == 'Booster':
+        return compile_xgboost(estimator)
+    return compile_sklearn(estimator)
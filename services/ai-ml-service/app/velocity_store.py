@@ -0,0 +1,154 @@
+"""
+Velocity Feature Store
+Per-account sliding-window transaction counts backed by fixed-size ring buffers
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class VelocityStore:
+    def __init__(self, window_seconds: int = 3600, capacity: int = 16, max_accounts: int = 1_000_000):
+        """
+        Keeps the last `capacity` transaction times (epoch seconds) of up to
+        `max_accounts` accounts in one preallocated array. Counts saturate
+        at `capacity`, so it should exceed any velocity threshold in use.
+        The least recently seen account is evicted when the store is full.
+        """
+        self.window_seconds = window_seconds
+        self.capacity = capacity
+        self.max_accounts = max_accounts
+
+        # Struct-of-arrays layout: one row per account slot. Times are int64 so
+        # any timestamp a client sends (before 1970, after 2106) fits
+        self._times = np.zeros((max_accounts, capacity), dtype=np.int64)
+        self._head = np.zeros(max_accounts, dtype=np.int32)   # next write position
+        self._size = np.zeros(max_accounts, dtype=np.int32)   # live entries in window
+
+        self._slots: OrderedDict = OrderedDict()  # account -> slot, least recent first
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def record(self, account: str, timestamp: float) -> int:
+        """
+        Record a transaction and return how many transactions the account
+        made within the window ending at `timestamp`, including this one.
+        """
+        now = int(timestamp)
+        with self._lock:
+            slot = self._slot_for(account)
+            size = self._expire(slot, now - self.window_seconds)
+
+            head = int(self._head[slot])
+            self._times[slot, head] = now
+            self._head[slot] = (head + 1) % self.capacity
+            size = min(size + 1, self.capacity)
+            self._size[slot] = size
+            return size
+
+    def record_batch(self, accounts: Sequence[Optional[str]], timestamps: Sequence[float],
+                     update: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Record transactions in order and return the velocity of each one.
+        Rows where the `update` mask is False are only counted.
+        """
+        velocity = np.zeros(len(accounts), dtype=np.int64)
+        for i, (account, timestamp) in enumerate(zip(accounts, timestamps)):
+            if account:
+                apply = self.record if update is None or update[i] else self.count
+                velocity[i] = apply(account, timestamp)
+        return velocity
+
+    def count(self, account: str, timestamp: float, window_seconds: Optional[int] = None) -> int:
+        """
+        Count an account's transactions in the last `window_seconds` without
+        recording one. Windows longer than the store's only see what is
+        still held in the ring buffer.
+        """
+        window = self.window_seconds if window_seconds is None else window_seconds
+        now = int(timestamp)
+        with self._lock:
+            slot = self._slots.get(account)
+            if slot is None:
+                return 0
+            size = int(self._size[slot]) if window <= self.window_seconds else self.capacity
+            head = int(self._head[slot])
+            positions = (head - 1 - np.arange(size)) % self.capacity
+            times = self._times[slot, positions]
+            return int(np.count_nonzero((times > now - window) & (times <= now)))
+
+    def export_state(self) -> Dict:
+        """Copy of the store's contents, least recently seen account first"""
+        # Only the live rows are gathered under the lock; the keys are encoded by the caller
+        with self._lock:
+            slots = np.fromiter(self._slots.values(), dtype=np.int64, count=len(self._slots))
+            return {
+                'accounts': list(self._slots.keys()),
+                'times': self._times[slots],
+                'head': self._head[slots],
+                'size': self._size[slots],
+                'window_seconds': np.array([self.window_seconds], dtype=np.int64)
+            }
+
+    def import_state(self, state: Dict):
+        """Replace the store's contents with an exported state"""
+        if state['times'].shape[1] != self.capacity:
+            logger.warning(f"Velocity snapshot capacity {state['times'].shape[1]} != {self.capacity}; skipping")
+            return
+        saved_window = int(state['window_seconds'][0]) if 'window_seconds' in state else self.window_seconds
+        if saved_window != self.window_seconds:
+            # Times are absolute, so they stay valid; entries the shorter window already expired are gone
+            logger.warning(f"Velocity snapshot window {saved_window}s != {self.window_seconds}s; "
+                           f"counts may be low until {max(saved_window, self.window_seconds)}s of new traffic")
+        # Keep the most recently seen accounts if the snapshot exceeds the cap
+        accounts = state['accounts'][-self.max_accounts:]
+        n = len(accounts)
+        start = len(state['accounts']) - n
+        with self._lock:
+            self._times[:n] = state['times'][start:]
+            self._head[:n] = state['head'][start:]
+            self._size[:n] = state['size'][start:]
+            self._slots = OrderedDict(zip(accounts, range(n)))
+
+    def stats(self) -> Dict:
+        return {
+            'accounts': len(self._slots),
+            'max_accounts': self.max_accounts,
+            'capacity': self.capacity,
+            'window_seconds': self.window_seconds,
+            'evictions': self._evictions,
+            'memory_bytes': self._times.nbytes + self._head.nbytes + self._size.nbytes
+        }
+
+    def _slot_for(self, account: str) -> int:
+        slot = self._slots.get(account)
+        if slot is not None:
+            self._slots.move_to_end(account)
+            return slot
+
+        if len(self._slots) < self.max_accounts:
+            slot = len(self._slots)
+        else:
+            # Reuse the slot of the least recently seen account
+            _, slot = self._slots.popitem(last=False)
+            self._evictions += 1
+        self._times[slot] = 0
+        self._head[slot] = 0
+        self._size[slot] = 0
+        self._slots[account] = slot
+        return slot
+
+    def _expire(self, slot: int, cutoff: int) -> int:
+        """Drop entries at or before cutoff from the tail; each entry expires once"""
+        size = int(self._size[slot])
+        tail = (int(self._head[slot]) - size) % self.capacity
+        while size and self._times[slot, tail] <= cutoff:
+            tail = (tail + 1) % self.capacity
+            size -= 1
+        self._size[slot] = size
+        return size
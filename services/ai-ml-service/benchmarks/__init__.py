@@ -0,0 +1,10 @@
+"""
+AI/ML Service Benchmarks
+Synthetic workloads, microbenchmarks and an in-process load test; run with `python -m benchmarks`
+"""
+
+from .generators import generate_transactions, generate_users
+from .micro import run_microbenchmarks
+from .load import run_load_tests
+
+__all__ = ['generate_transactions', 'generate_users', 'run_microbenchmarks', 'run_load_tests']
@@ -0,0 +1,101 @@
+"""
+Benchmark Runner
+Runs the benchmark suite and writes results as JSON, optionally diffing against a baseline
+
+    python -m benchmarks --output results.json
+    python -m benchmarks --quick --compare results.json
+"""
+
+import argparse
+import json
+import logging
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+from typing import Dict
+
+import numpy as np
+
+from .load import run_load_tests
+from .micro import run_microbenchmarks
+
+# Lower-is-better and higher-is-better metrics reported by --compare
+LATENCY_KEYS = ('us_per_item', 'p50_ms', 'p95_ms', 'p99_ms')
+THROUGHPUT_KEYS = ('items_per_second', 'requests_per_second')
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+def compare(baseline: Dict, current: Dict) -> str:
+    """Percent change of every shared metric; positive means faster"""
+    lines = []
+    for section in ('micro', 'load'):
+        for name, metrics in current.get(section, {}).items():
+            before = baseline.get(section, {}).get(name)
+            if before is None:
+                continue
+            for key in LATENCY_KEYS + THROUGHPUT_KEYS:
+                if key in metrics and before.get(key):
+                    change = (metrics[key] - before[key]) / before[key] * 100
+                    if key in LATENCY_KEYS:
+                        change = -change
+                    lines.append(f"{change:+7.1f}%  {name} {key}: {before[key]:.4g} -> {metrics[key]:.4g}")
+    return '\n'.join(lines)
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__.strip().splitlines()[1])
+    parser.add_argument('--output', help='write results JSON here (default: stdout)')
+    parser.add_argument('--compare', metavar='BASELINE', help='print changes against a previous results file')
+    parser.add_argument('--quick', action='store_true', help='small sizes for a smoke run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-micro', action='store_true')
+    parser.add_argument('--skip-load', action='store_true')
+    args = parser.parse_args(argv)
+
+    # Per-request service logging would dominate the load test
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'git_commit': _git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'quick': args.quick
+        }
+    }
+    if not args.skip_micro:
+        results['micro'] = run_microbenchmarks(
+            n=1_000 if args.quick else 10_000, seed=args.seed, repeat=2 if args.quick else 5
+        )
+    if not args.skip_load:
+        from app.main import app
+        results['load'] = run_load_tests(
+            app,
+            concurrency_levels=(1, 8) if args.quick else (1, 8, 32),
+            requests_per_run=50 if args.quick else 500,
+            seed=args.seed
+        )
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(json.load(f), results), file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+Synthetic Workload Generators
+Seeded transactions and user profiles with realistic mobile-money distributions
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+import numpy as np
+
+MERCHANT_CATEGORIES = ['groceries', 'transport', 'utilities', 'airtime', 'restaurants',
+                       'electronics', 'transfer', 'fuel', 'pharmacy', 'entertainment']
+LOCATIONS = ['Nairobi', 'Mombasa', 'Kisumu', 'Nakuru', 'Eldoret', 'Thika', 'Malindi', 'Kitale']
+# Share of transactions per hour of day (UTC+3 business hours peak, few at night)
+HOURLY_WEIGHTS = np.array([1, 1, 1, 1, 1, 2, 4, 6, 8, 9, 9, 9, 10, 9, 9, 9, 9, 10, 10, 8, 6, 4, 2, 1], dtype=float)
+
+def generate_transactions(n: int, seed: int = 0, n_accounts: int = 10_000,
+                          start: datetime = datetime(2024, 1, 1, tzinfo=timezone.utc),
+                          days: int = 30) -> List[Dict]:
+    """
+    n transaction payloads for /api/fraud/detect. Amounts are log-normal
+    (median ~1,500 KES) with a share of round amounts and rare very large
+    ones; account activity is Zipf-skewed; times follow a daily cycle.
+    """
+    rng = np.random.default_rng(seed)
+
+    amounts = np.round(rng.lognormal(mean=np.log(1500), sigma=1.3, size=n), 2)
+    round_mask = rng.random(n) < 0.25
+    amounts[round_mask] = np.maximum(500, np.round(amounts[round_mask] / 500) * 500)
+    large_mask = rng.random(n) < 0.005
+    amounts[large_mask] = rng.uniform(50_000, 500_000, size=large_mask.sum()).round(-3)
+
+    # Zipf-skewed account popularity: a few accounts are very active
+    ranks = rng.zipf(1.3, size=n)
+    senders = (ranks - 1) % n_accounts
+    receivers = rng.integers(0, n_accounts, size=n)
+
+    day = rng.integers(0, days, size=n)
+    hour = rng.choice(24, size=n, p=HOURLY_WEIGHTS / HOURLY_WEIGHTS.sum())
+    second = rng.integers(0, 3600, size=n)
+    offsets = np.sort(day * 86400 + hour * 3600 + second)
+
+    # Most accounts stick to one or two devices and a home location
+    device_index = np.where(rng.random(n) < 0.9, 0, rng.integers(1, 4, size=n))
+    home = senders % len(LOCATIONS)
+    location_index = np.where(rng.random(n) < 0.85, home, rng.integers(0, len(LOCATIONS), size=n))
+    categories = rng.integers(0, len(MERCHANT_CATEGORIES), size=n)
+
+    return [
+        {
+            'transaction_id': f"bench_{seed}_{i}",
+            'amount': float(amounts[i]),
+            'from_account': f"acct_{senders[i]}",
+            'to_account': f"acct_{receivers[i]}",
+            'merchant_category': MERCHANT_CATEGORIES[categories[i]],
+            'location': LOCATIONS[location_index[i]],
+            'device_id': f"dev_{senders[i]}_{device_index[i]}",
+            'ip_address': f"10.{senders[i] % 256}.{device_index[i]}.{senders[i] % 200 + 1}",
+            'timestamp': (start + timedelta(seconds=int(offsets[i]))).isoformat().replace('+00:00', 'Z'),
+            'user_id': f"user_{senders[i]}"
+        }
+        for i in range(n)
+    ]
+
+def generate_users(n: int, seed: int = 0, history_length: int = 0) -> List[Dict]:
+    """
+    n user payloads for /api/risk/assess. Account ages are exponential,
+    about 80% are KYC-verified and activity is log-normal; with
+    history_length > 0 each user also carries a transaction_history.
+    """
+    rng = np.random.default_rng(seed)
+
+    account_age = rng.exponential(400, size=n).astype(int)
+    kyc_verified = rng.random(n) < 0.8
+    total_transactions = np.minimum(rng.lognormal(np.log(40), 1.2, size=n).astype(int), account_age * 20 + 1)
+    average_amount = np.round(rng.lognormal(np.log(2500), 1.0, size=n), 2)
+
+    users = []
+    for i in range(n):
+        user = {
+            'user_id': f"user_{seed}_{i}",
+            'account_age_days': int(account_age[i]),
+            'kyc_verified': bool(kyc_verified[i]),
+            'total_transactions': int(total_transactions[i]),
+            'average_transaction_amount': float(average_amount[i])
+        }
+        if history_length:
+            user['transaction_history'] = _history(rng, history_length, average_amount[i])
+        users.append(user)
+    return users
+
+def _history(rng: np.random.Generator, length: int, average_amount: float) -> List[Dict]:
+    amounts = np.round(rng.lognormal(np.log(average_amount), 0.8, size=length), 2)
+    failed = rng.random(length) < 0.03
+    disputed = rng.random(length) < 0.002
+    ages = np.sort(rng.integers(0, 365 * 86400, size=length))[::-1]
+    now = datetime.now(timezone.utc)
+    return [
+        {
+            'amount': float(amounts[j]),
+            'status': 'failed' if failed[j] else 'completed',
+            'disputed': bool(disputed[j]),
+            'timestamp': (now - timedelta(seconds=int(ages[j]))).isoformat()
+        }
+        for j in range(length)
+    ]
@@ -0,0 +1,76 @@
+"""
+In-Process Load Test
+Drives the scoring endpoints through an ASGI transport and reports throughput and latency percentiles
+"""
+
+import asyncio
+import time
+from typing import Dict, List, Sequence
+
+import httpx
+import numpy as np
+
+from .generators import generate_transactions
+
+async def _drive(app, path: str, payloads: List, concurrency: int) -> Dict:
+    """POST every payload with at most `concurrency` requests outstanding"""
+    latencies = []
+    errors = 0
+    pending = iter(payloads)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://bench') as client:
+        async def worker():
+            nonlocal errors
+            for payload in pending:
+                started = time.perf_counter()
+                response = await client.post(path, json=payload)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies_ms = np.array(latencies) * 1000
+    items = sum(len(p) if isinstance(p, list) else 1 for p in payloads)
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return {
+        'requests': len(payloads),
+        'items': items,
+        'errors': errors,
+        'seconds': elapsed,
+        'requests_per_second': len(payloads) / elapsed,
+        'items_per_second': items / elapsed,
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99)
+    }
+
+def run_load_tests(app, concurrency_levels: Sequence[int] = (1, 8, 32),
+                   batch_sizes: Sequence[int] = (16, 128), requests_per_run: int = 500,
+                   seed: int = 0) -> Dict[str, Dict]:
+    """
+    Load /api/fraud/detect at each concurrency and /api/fraud/batch at each
+    batch size and concurrency. Every run uses fresh transaction ids so the
+    result cache never answers for the scorer.
+    """
+    results = {}
+    run = 0
+    for concurrency in concurrency_levels:
+        run += 1
+        payloads = generate_transactions(requests_per_run, seed=seed * 1000 + run)
+        results[f'/api/fraud/detect batch=1 concurrency={concurrency}'] = asyncio.run(
+            _drive(app, '/api/fraud/detect', payloads, concurrency)
+        )
+    for batch_size in batch_sizes:
+        # Fewer requests for large batches so each run moves a similar row count
+        requests = max(10, requests_per_run // max(1, batch_size // 16))
+        for concurrency in concurrency_levels:
+            run += 1
+            transactions = generate_transactions(requests * batch_size, seed=seed * 1000 + run)
+            payloads = [transactions[i:i + batch_size] for i in range(0, len(transactions), batch_size)]
+            results[f'/api/fraud/batch batch={batch_size} concurrency={concurrency}'] = asyncio.run(
+                _drive(app, '/api/fraud/batch', payloads, concurrency)
+            )
+    return results
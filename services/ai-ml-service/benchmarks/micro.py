@@ -0,0 +1,98 @@
+"""
+Microbenchmarks
+Times feature engineering and rule scoring, scalar and columnar, outside the web stack
+"""
+
+import time
+from typing import Callable, Dict, List, Sequence
+
+import numpy as np
+
+from app.amount_stats import AmountStatsStore
+from app.device_tracker import DeviceTracker
+from app.feature_engineer import FeatureEngineer
+from app.fraud_detector import FraudDetector
+from app.risk_scorer import RiskScorer
+from app.velocity_store import VelocityStore
+
+from .generators import generate_transactions, generate_users
+
+def measure(fn: Callable[[], None], items: int, repeat: int = 5) -> Dict:
+    """Run fn (which processes `items` items) repeat times; report the best and median run"""
+    fn()  # warm caches and lazy imports
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - started)
+    best = min(runs)
+    return {
+        'items': items,
+        'repeat': repeat,
+        'best_seconds': best,
+        'median_seconds': float(np.median(runs)),
+        'us_per_item': best / items * 1e6,
+        'items_per_second': items / best
+    }
+
+def _feature_engineer(n_accounts: int) -> FeatureEngineer:
+    """Stateful stores sized for the benchmark instead of production defaults"""
+    return FeatureEngineer(
+        velocity_store=VelocityStore(max_accounts=n_accounts),
+        amount_stats=AmountStatsStore(max_accounts=n_accounts),
+        device_tracker=DeviceTracker(max_hot_accounts=n_accounts, cold_capacity=1_000_000)
+    )
+
+def _columns(rows: List[Dict]) -> Dict[str, List]:
+    return {field: [row.get(field) for row in rows] for field in rows[0]}
+
+def _chunks(rows: List, size: int) -> List[List]:
+    return [rows[start:start + size] for start in range(0, len(rows), size)]
+
+def run_microbenchmarks(n: int = 10_000, batch_sizes: Sequence[int] = (64, 1024),
+                        seed: int = 0, repeat: int = 5) -> Dict[str, Dict]:
+    """Benchmark the scoring hot paths over n synthetic transactions and users"""
+    transactions = generate_transactions(n, seed=seed)
+    users = generate_users(n, seed=seed)
+    n_accounts = len({txn['from_account'] for txn in transactions})
+    engineer = _feature_engineer(n_accounts)
+    fraud_detector = FraudDetector()
+    risk_scorer = RiskScorer()
+    results = {}
+
+    # Fraud path, scalar
+    results['feature_engineer.engineer_transaction_features'] = measure(
+        lambda: [engineer.engineer_transaction_features(txn) for txn in transactions], n, repeat
+    )
+    features = [engineer.engineer_transaction_features(txn, update_state=False) for txn in transactions]
+    results['fraud_detector.predict'] = measure(
+        lambda: [fraud_detector.predict(f) for f in features], n, repeat
+    )
+
+    # Fraud path, columnar
+    for size in batch_sizes:
+        batches = [_columns(chunk) for chunk in _chunks(transactions, size)]
+        results[f'feature_engineer.engineer_batch[{size}]'] = measure(
+            lambda: [engineer.engineer_batch(columns) for columns in batches], n, repeat
+        )
+        engineered = [engineer.engineer_batch(columns, np.zeros(len(columns['amount']), dtype=bool))
+                      for columns in batches]
+        results[f'fraud_detector.predict_batch[{size}]'] = measure(
+            lambda: [fraud_detector.predict_batch(f) for f in engineered], n, repeat
+        )
+
+    # Risk path
+    user_features = [engineer.engineer_user_features(user) for user in users]
+    results['feature_engineer.engineer_user_features'] = measure(
+        lambda: [engineer.engineer_user_features(user) for user in users], n, repeat
+    )
+    results['risk_scorer.predict'] = measure(
+        lambda: [risk_scorer.predict(f) for f in user_features], n, repeat
+    )
+    for size in batch_sizes:
+        batches = [engineer.engineer_user_batch(_columns(chunk)) for chunk in _chunks(users, size)]
+        results[f'risk_scorer.predict_batch[{size}]'] = measure(
+            lambda: [risk_scorer.predict_batch(f) for f in batches], n, repeat
+        )
+
+    return results
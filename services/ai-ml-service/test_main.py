@@ -0,0 +1,858 @@
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app, fraud_detector
+from app.feature_engineer import FeatureEngineer
+from app.velocity_store import VelocityStore
+from app.amount_stats import AmountStatsStore
+from app.device_tracker import DeviceTracker
+
+client = TestClient(app)
+
+TRANSACTIONS = [
+    {"transaction_id": "txn_1", "amount": 1000, "from_account": "acc_1", "to_account": "acc_2",
+     "timestamp": "2025-10-22T10:00:00Z"},
+    {"transaction_id": "txn_2", "amount": 75000, "from_account": "acc_1", "to_account": "acc_3",
+     "timestamp": "2025-10-22T23:30:00Z"},
+    {"transaction_id": "txn_3", "amount": 1234.5, "from_account": "acc_4", "to_account": "acc_2",
+     "timestamp": "not-a-timestamp"},
+    {"transaction_id": "txn_4", "amount": 60500, "from_account": "acc_5", "to_account": "acc_6"},
+]
+
+def test_health_check():
+    response = client.get("/health")
+    assert response.status_code == 200
+    assert response.json()["status"] == "healthy"
+
+def test_batch_matches_scalar_path():
+    columns = {field: [txn.get(field) for txn in TRANSACTIONS]
+               for field in ("transaction_id", "amount", "from_account", "timestamp")}
+    batch = fraud_detector.predict_batch(FeatureEngineer(VelocityStore(max_accounts=16), AmountStatsStore(min_history=1, max_accounts=16)).engineer_batch(columns), with_reasons=True)
+
+    scalar_engineer = FeatureEngineer(VelocityStore(max_accounts=16), AmountStatsStore(min_history=1, max_accounts=16))
+    for i, txn in enumerate(TRANSACTIONS):
+        scalar = fraud_detector.predict(scalar_engineer.engineer_transaction_features(txn), explain=True)
+        assert batch['is_fraud'][i] == scalar['is_fraud']
+        assert batch['fraud_probability'][i] == scalar['fraud_probability']
+        assert batch['risk_score'][i] == scalar['risk_score']
+        assert batch['risk_level'][i] == scalar['risk_level']
+        assert batch['reason_mask'][i] == scalar['reason_mask']
+        assert batch['reasons'][i] == scalar['reasons']
+
+def test_batch_endpoint():
+    response = client.post("/api/fraud/batch", json=TRANSACTIONS)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["count"] == len(TRANSACTIONS)
+    assert [r["transaction_id"] for r in body["results"]] == [t["transaction_id"] for t in TRANSACTIONS]
+
+def test_risk_batch_matches_scalar_path():
+    import json
+    users = [
+        {"user_id": f"user_{i}", "account_age_days": age, "kyc_verified": kyc,
+         "total_transactions": txns, "average_transaction_amount": avg}
+        for i, (age, kyc, txns, avg) in enumerate([
+            (400, True, 150, 12000.0), (100, True, 60, 5000.0), (3, False, 2, 100.0),
+            (30, False, 30, 800.0), (None, True, None, None)
+        ])
+    ]
+    body = "\n".join(json.dumps(u) for u in users) + "\n"
+    response = client.post("/api/risk/batch?explain=true", content=body, headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["user_id"] for line in lines] == [u["user_id"] for u in users]
+
+    for user, line in zip(users, lines):
+        scalar = client.post("/api/risk/assess", json={k: v for k, v in user.items() if v is not None}).json()
+        assert line == scalar
+
+def test_risk_assessment_aggregates_history():
+    history = [
+        {"amount": 1000 + i, "status": "FAILED" if i % 10 == 0 else "completed",
+         "disputed": i % 100 == 0, "timestamp": f"2024-01-{1 + i % 28:02d}T10:00:00Z"}
+        for i in range(300)
+    ]
+    engineer = FeatureEngineer()
+    short = engineer.aggregate_history(history[:50])
+    assert engineer.aggregate_history(history) == pytest.approx({**short, **{
+        "total_transactions": 300, "average_transaction_amount": 1149.5,
+        "failed_transactions": 30, "disputes": 3
+    }})
+    assert short["failed_transactions"] == 5 and short["disputes"] == 1
+
+    # Numeric strings count and junk is skipped on both sides of the vectorized cutoff
+    mixed = [{"amount": amount} for amount in ("1500.00", True, None, "n/a", float("nan"), 1500)]
+    for rows in (10, 300):
+        aggregate = engineer.aggregate_history((mixed * rows)[:rows])
+        assert aggregate["average_transaction_amount"] == 1500.0
+
+    response = client.post("/api/risk/assess", json={"user_id": "user_h", "transaction_history": history})
+    assert response.status_code == 200
+    assert "Multiple failed transactions" in response.json()["reasons"]
+    assert "Transaction disputes (3)" in response.json()["reasons"]
+
+def test_risk_profiles_are_cached_and_invalidated():
+    user = {"user_id": "user_cached", "account_age_days": 200, "kyc_verified": True, "total_transactions": 40}
+    before = client.get("/api/risk/cache/stats").json()
+    first = client.post("/api/risk/assess", json=user).json()
+    assert client.post("/api/risk/assess", json=user).json() == first
+    after = client.get("/api/risk/cache/stats").json()
+    assert after["hits"] == before["hits"] + 1
+    assert after["misses"] == before["misses"] + 1
+
+    # A new transaction for the user drops the profile
+    client.post("/api/fraud/detect", json={**TRANSACTIONS[0], "transaction_id": "txn_cache_1", "user_id": "user_cached"})
+    client.post("/api/risk/assess", json=user)
+    assert client.get("/api/risk/cache/stats").json()["misses"] == after["misses"] + 1
+
+    response = client.post("/api/risk/profiles/invalidate", json={"user_ids": ["user_cached", "user_unknown"]})
+    assert response.json() == {"invalidated": 1}
+
+def test_metrics_endpoint():
+    client.post("/api/fraud/detect", json={**TRANSACTIONS[0], "transaction_id": "txn_metrics_1"})
+    client.post("/api/fraud/batch", json=TRANSACTIONS)
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    for stage in ("parse", "features", "predict", "serialize", "batch_features", "batch_predict"):
+        assert f'aiml_stage_duration_seconds_count{{stage="{stage}"}}' in response.text
+    assert 'aiml_batch_size_count{source="fraud_batch"}' in response.text
+    assert "aiml_fraud_decisions_total{" in response.text
+    assert 'aiml_requests_in_flight{endpoint="/api/fraud/detect"} 0.0' in response.text
+
+def test_benchmark_generators_and_load_test():
+    from benchmarks import generate_transactions, generate_users, run_load_tests
+
+    assert generate_transactions(50, seed=1) == generate_transactions(50, seed=1)
+    assert all(client.post("/api/fraud/detect", json=txn).status_code == 200
+               for txn in generate_transactions(5, seed=2))
+    assert all(client.post("/api/risk/assess", json=user).status_code == 200
+               for user in generate_users(5, seed=2, history_length=3))
+
+    results = run_load_tests(app, concurrency_levels=(2,), batch_sizes=(4,), requests_per_run=10, seed=3)
+    assert set(results) == {"/api/fraud/detect batch=1 concurrency=2", "/api/fraud/batch batch=4 concurrency=2"}
+    for run in results.values():
+        assert run["errors"] == 0
+        assert run["p50_ms"] <= run["p95_ms"] <= run["p99_ms"]
+
+def test_fast_path_is_byte_compatible():
+    from fastapi import FastAPI
+    from app.main import detect_fraud_fast, batch_fraud_detection_fast
+
+    fast_app = FastAPI()
+    fast_app.router.add_route("/detect", detect_fraud_fast, methods=["POST"])
+    fast_app.router.add_route("/batch", batch_fraud_detection_fast, methods=["POST"])
+    fast_client = TestClient(fast_app)
+
+    for i, txn in enumerate(TRANSACTIONS):
+        # Fresh accounts on each side so stateful features start out identical
+        slow = client.post("/api/fraud/detect", json={**txn, "transaction_id": f"slow_{i}", "from_account": f"slow_acct_{i}"})
+        fast = fast_client.post("/detect", json={**txn, "transaction_id": f"fast_{i}", "from_account": f"fast_acct_{i}"})
+        assert fast.headers["content-type"] == slow.headers["content-type"]
+        assert fast.content.replace(b"fast_", b"slow_") == slow.content
+
+    batch = [{**txn, "transaction_id": f"batch_{i}", "from_account": f"batch_acct_{i}"} for i, txn in enumerate(TRANSACTIONS)]
+    slow = client.post("/api/fraud/batch", json=batch)
+    fast = fast_client.post("/batch", json=[{**txn, "from_account": "fast_" + txn["from_account"]} for txn in batch])
+    assert fast.content == slow.content
+    assert fast_client.post("/detect", json={"amount": 5}).status_code == 422
+
+def test_columnar_batch_formats_match_json():
+    import msgpack
+    import numpy as np
+    import pyarrow as pa
+
+    def batch(prefix):
+        return [{**txn, "transaction_id": f"{prefix}_{i}", "from_account": f"{prefix}_acct_{i}"}
+                for i, txn in enumerate(TRANSACTIONS)]
+
+    def columns(rows):
+        return {field: [row.get(field) for row in rows] for field in ("transaction_id", "amount", "from_account", "to_account", "timestamp")}
+
+    expected = client.post("/api/fraud/batch", json=batch("json")).json()["results"]
+    probabilities = [r["fraud_probability"] for r in expected]
+
+    packed = columns(batch("mp"))
+    packed["amount"] = np.asarray(packed["amount"], dtype="<f8").tobytes()  # raw float64 column
+    response = client.post("/api/fraud/batch", content=msgpack.packb(packed), headers={"Content-Type": "application/msgpack"})
+    assert response.headers["content-type"] == "application/msgpack"
+    result = msgpack.unpackb(response.content)
+    assert result["fraud_probability"] == probabilities
+    assert result["is_fraud"] == [r["is_fraud"] for r in expected]
+
+    table = pa.table(columns(batch("arrow")))
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    response = client.post("/api/fraud/batch", content=sink.getvalue().to_pybytes(),
+                           headers={"Content-Type": "application/vnd.apache.arrow.stream"})
+    result = pa.ipc.open_stream(response.content).read_all()
+    assert result.column("fraud_probability").to_pylist() == probabilities
+    assert result.column("transaction_id").to_pylist() == [f"arrow_{i}" for i in range(len(TRANSACTIONS))]
+
+    response = client.post("/api/fraud/batch", content=msgpack.packb({"amount": [1.0]}), headers={"Content-Type": "application/msgpack"})
+    assert response.status_code == 422
+
+def test_ndjson_batch_streams_results():
+    import json
+    rows = [{**txn, "transaction_id": f"nd_{i}", "from_account": f"nd_acct_{i}"} for i, txn in enumerate(TRANSACTIONS)]
+    expected = client.post("/api/fraud/batch", json=[{**row, "transaction_id": "js" + row["transaction_id"],
+                                                      "from_account": "js" + row["from_account"]} for row in rows]).json()
+    body = "\n".join(json.dumps(row) for row in rows)
+    response = client.post("/api/fraud/batch", content=body, headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["transaction_id"] for line in lines] == [row["transaction_id"] for row in rows]
+    assert [line["fraud_probability"] for line in lines] == [r["fraud_probability"] for r in expected["results"]]
+
+    response = client.post("/api/fraud/batch", content='{"amount": 1}\n', headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 422
+
+def test_micro_batcher_coalesces_concurrent_calls():
+    import asyncio
+    from app.main import _score_transactions, TransactionRequest
+    from app.micro_batcher import MicroBatcher
+
+    batcher = MicroBatcher(_score_transactions, max_batch_size=3, max_wait_ms=5)
+    requests = [TransactionRequest(**txn) for txn in TRANSACTIONS]
+
+    async def run():
+        responses = await asyncio.gather(*(batcher.submit(r) for r in requests))
+        await batcher.stop()
+        return responses
+
+    responses = asyncio.run(run())
+    assert [r.transaction_id for r in responses] == [t["transaction_id"] for t in TRANSACTIONS]
+    stats = batcher.stats()
+    assert stats["items"] == len(TRANSACTIONS)
+    assert stats["batches"] == 2
+    assert stats["largest_batch"] == 3
+
+def test_micro_batcher_flushes_concurrently_and_bounds_queue():
+    import asyncio
+    from app.executors import ExecutorSaturatedError
+    from app.micro_batcher import MicroBatcher
+
+    running = []
+    peak = []
+
+    async def slow_batch(items):
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.05)
+        running.pop()
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(slow_batch, max_batch_size=2, max_wait_ms=0,
+                           max_concurrent_batches=2, max_queue=4)
+
+    async def run():
+        calls = [asyncio.ensure_future(batcher.submit(i)) for i in range(4)]
+        await asyncio.sleep(0)
+        results = await asyncio.gather(*calls)
+        # Two batches in flight hold 4 items; 4 more fill the queue
+        blocked = [asyncio.ensure_future(batcher.submit(i)) for i in range(4)]
+        await asyncio.sleep(0.01)
+        blocked += [asyncio.ensure_future(batcher.submit(i)) for i in range(4)]
+        await asyncio.sleep(0)
+        assert batcher.stats()["queue_depth"] == 4
+        with pytest.raises(ExecutorSaturatedError):
+            await batcher.submit(99)
+        await asyncio.gather(*blocked)
+        await batcher.stop()
+        return results
+
+    assert asyncio.run(run()) == [0, 2, 4, 6]
+    assert max(peak) == 2
+    stats = batcher.stats()
+    assert stats["rejected"] == 1
+    assert stats["in_flight_batches"] == 0
+
+def test_saturated_executor_rejects():
+    import asyncio
+    import threading
+    from app.executors import BoundedExecutor, ExecutorSaturatedError
+
+    executor = BoundedExecutor('test', max_workers=1, max_queue=0)
+    release = threading.Event()
+
+    async def run():
+        blocked = asyncio.ensure_future(executor.run(release.wait))
+        await asyncio.sleep(0.01)
+        with pytest.raises(ExecutorSaturatedError):
+            await executor.run(lambda: None)
+        release.set()
+        await blocked
+
+    asyncio.run(run())
+    executor.shutdown()
+    assert executor.stats()["rejected"] == 1
+
+def test_process_workers_keep_shared_scorers():
+    import asyncio
+    import numpy as np
+    from app.executors import BoundedExecutor
+    from app.fraud_detector import FraudDetector
+
+    detector = FraudDetector()
+    executor = BoundedExecutor("test", kind="process", max_workers=1)
+    executor.share("fraud_detector", detector)
+    columns = {"amount": np.array([60000.0, 100.0])}
+
+    async def run():
+        first = await executor.call("fraud_detector", "predict_batch", columns)
+        second = await executor.call("fraud_detector", "predict_batch", columns)
+        # A rule swap reaches the worker on its next call
+        detector.high_amount_threshold = 75000
+        swapped = await executor.call("fraud_detector", "predict_batch", columns)
+        return first, second, swapped
+
+    first, second, swapped = asyncio.run(run())
+    stats = executor.stats()
+    executor.shutdown()
+    assert first["reason_mask"].tolist() == second["reason_mask"].tolist() == [1, 0]
+    assert swapped["reason_mask"].tolist() == [0, 0]
+    assert stats["resends"] == 1 and stats["failed"] == 0
+
+def test_velocity_store_sliding_window():
+    store = VelocityStore(window_seconds=3600, capacity=8, max_accounts=2)
+    assert [store.record("acc_1", 1000 + 60 * i) for i in range(6)] == [1, 2, 3, 4, 5, 6]
+    assert store.record("acc_1", 1000 + 3600 + 61) == 5  # first two entries expired
+    assert store.count("acc_1", 1000 + 3600 + 61, window_seconds=120) == 1
+
+    # A third account evicts the least recently seen one
+    store.record("acc_2", 5000)
+    store.record("acc_3", 5000)
+    assert store.count("acc_1", 5000) == 0
+    assert store.stats()["evictions"] == 1
+
+def test_velocity_store_accepts_any_epoch():
+    store = VelocityStore(window_seconds=3600, max_accounts=4)
+    assert store.record("acc_old", -86400.0) == 1  # 1969
+    assert store.record("acc_far", 5_000_000_000.0) == 1 and store.record("acc_far", 5_000_000_100.0) == 2  # 2128
+    response = client.post("/api/fraud/batch", json=[
+        {**TRANSACTIONS[0], "transaction_id": "txn_1969", "from_account": "acc_1969", "timestamp": "1969-07-20T20:17:00Z"},
+        {**TRANSACTIONS[0], "transaction_id": "txn_2150", "from_account": "acc_2150", "timestamp": "2150-01-01T00:00:00Z"}
+    ])
+    assert response.status_code == 200 and response.json()["count"] == 2
+
+def test_amount_stats_welford():
+    store = AmountStatsStore(min_history=3, max_accounts=4)
+    for amount in (100.0, 200.0, 300.0):
+        assert store.update("user_1", amount) == (1.0, 0.0)
+    ratio, zscore = store.update("user_1", 1200.0)
+    assert ratio == 6.0
+    assert zscore == 10.0
+    stats = store.get("user_1")
+    assert stats["count"] == 4
+    assert stats["mean"] == 450.0
+
+def test_device_tracker_cold_accounts():
+    tracker = DeviceTracker(max_hot_accounts=1, cold_capacity=1000)
+    assert tracker.stats()["cold_memory_bytes"] == 0  # allocated on the first eviction
+    assert tracker.observe("acc_1", "dev_1", "Nairobi") == (False, False)  # unknown account
+    assert tracker.observe("acc_1", "dev_2", "Mombasa") == (True, True)
+    assert tracker.observe("acc_1", "dev_1", "Mombasa") == (False, False)
+
+    # acc_1 is evicted to the Bloom filter but its history is still recognised
+    tracker.observe("acc_2", "dev_9", None)
+    assert tracker.observe("acc_1", "dev_2", "Nairobi") == (False, False)
+    assert tracker.observe("acc_1", "dev_3", "Kisumu") == (True, True)
+    assert tracker.stats()["cold_memory_bytes"] > 0
+
+def test_device_tracker_location_window_hot_and_cold():
+    places = ["Nairobi", "Mombasa", "Kisumu", "Nakuru", "Eldoret", "Thika"]
+
+    # Hot accounts compare against their last max_locations locations only
+    tracker = DeviceTracker(max_hot_accounts=2, max_locations=3, cold_capacity=1000)
+    for place in places[:4]:
+        tracker.observe("acc_hot", "dev", place)
+    assert tracker.peek("acc_hot", "dev", "Nairobi") == (False, True)
+
+    # The Bloom filter keeps every location recent at an eviction, beyond the window
+    for place in places[:3]:
+        tracker.observe("acc_cold", "dev", place)
+    tracker.observe("acc_x", "dev", None)
+    tracker.observe("acc_y", "dev", None)  # evicts acc_cold
+    for place in places[3:]:
+        tracker.observe("acc_cold", "dev", place)
+    assert tracker.peek("acc_cold", "dev", "Nairobi") == (False, False)
+
+def test_feature_snapshot_round_trip(tmp_path, caplog):
+    from app.feature_snapshot import FeatureSnapshotter
+
+    velocity, tracker = VelocityStore(max_accounts=4), DeviceTracker(max_hot_accounts=4, cold_capacity=100)
+    velocity.record("acc_1", 1000)
+    velocity.record("acc_1", 1060)
+    tracker.observe("acc_1", "dev_1", "Nairobi")
+    path = str(tmp_path / "features.snap")
+    FeatureSnapshotter(path, {"velocity": velocity, "devices": tracker}).save()
+
+    velocity, tracker = VelocityStore(max_accounts=4), DeviceTracker(max_hot_accounts=4, cold_capacity=100)
+    assert FeatureSnapshotter(path, {"velocity": velocity, "devices": tracker}).load()
+    assert velocity.record("acc_1", 1120) == 3
+    assert tracker.observe("acc_1", "dev_2", "Nairobi") == (True, False)
+
+    # Evicted accounts travel in the Bloom bits; a changed velocity window is loaded with a warning
+    tracker = DeviceTracker(max_hot_accounts=1, cold_capacity=100)
+    tracker.observe("acc_1", "dev_1", "Nairobi")
+    tracker.observe("acc_2", "dev_1", "Nairobi")
+    FeatureSnapshotter(path, {"velocity": velocity, "devices": tracker}).save()
+    velocity, tracker = VelocityStore(window_seconds=60, max_accounts=4), DeviceTracker(max_hot_accounts=1, cold_capacity=100)
+    assert FeatureSnapshotter(path, {"velocity": velocity, "devices": tracker}).load()
+    assert "window 3600s != 60s" in caplog.text
+    assert velocity.count("acc_1", 1120) == 1
+    assert tracker.observe("acc_1", "dev_1", "Mombasa") == (False, True)
+
+def test_activate_rejects_paths_outside_model_directory(tmp_path, monkeypatch):
+    import joblib
+    from app.main import model_registries
+
+    registry = model_registries['fraud']
+    (tmp_path / 'fraud').mkdir()
+    joblib.dump({'not': 'a model'}, tmp_path / 'x.joblib')
+    monkeypatch.setattr(registry, 'directory', str(tmp_path / 'fraud'))
+
+    for version in ('../x', str(tmp_path / 'x')):
+        response = client.post("/api/models/fraud/activate", params={"version": version})
+        assert 400 <= response.status_code < 500
+    assert registry.active is None
+
+def test_model_registry_hot_swap(tmp_path):
+    import joblib
+    import numpy as np
+    from sklearn.linear_model import LogisticRegression
+    from app.fraud_detector import FraudDetector
+    from app.model_registry import ModelRegistry, FRAUD_MODEL_FEATURES
+
+    registry = ModelRegistry(str(tmp_path), 'fraud', 'classifier', FRAUD_MODEL_FEATURES, warmup_rows=8)
+    detector = FraudDetector(registry=registry)
+    features = FeatureEngineer().engineer_transaction_features(TRANSACTIONS[1])
+    assert detector.predict(features)['model_version'] == detector.rules_version
+
+    # Without an active model the plan skips the nodes only the model reads
+    assert 'amount_log' not in detector.required_features
+    assert 'amount_log' not in fraud_detector.required_features
+    planned = FeatureEngineer().engineer_transaction_features(TRANSACTIONS[1], update_state=False,
+                                                              needed=detector.required_features)
+    assert 'amount_log' not in planned
+
+    X = np.random.default_rng(0).random((50, len(FRAUD_MODEL_FEATURES)))
+    model = LogisticRegression().fit(X, (X[:, 0] > 0.5).astype(int))
+    (tmp_path / 'fraud').mkdir()
+    joblib.dump(model, tmp_path / 'fraud' / '2.0.0.joblib')
+
+    assert registry.refresh()
+    assert 'amount_log' in detector.required_features
+    # Features planned before the swap are scored by the rules, not a model missing inputs
+    assert not detector.predict(planned)['used_model']
+    result = detector.predict(features)
+    assert result['model_version'] == '2.0.0'
+    assert 0.0 <= result['fraud_probability'] <= 1.0
+    assert not registry.refresh()  # unchanged file is not reloaded
+
+def test_compiled_forest_matches_library():
+    import numpy as np
+    from sklearn.ensemble import RandomForestClassifier
+    from app.tree_compiler import compile_model
+
+    rng = np.random.default_rng(0)
+    X = rng.random((300, 5)) * 100
+    model = RandomForestClassifier(n_estimators=10, max_depth=6, random_state=0).fit(X, (X[:, 0] > 60).astype(int))
+    np.testing.assert_allclose(compile_model(model).predict(X), model.predict_proba(X)[:, 1], atol=1e-12)
+
+def test_compiled_xgboost_matches_library_at_splits(tmp_path, monkeypatch):
+    import joblib
+    import numpy as np
+    import xgboost as xgb
+    from app import model_registry
+    from app.model_registry import ModelRegistry, FRAUD_MODEL_FEATURES
+    from app.tree_compiler import compile_model
+
+    rng = np.random.default_rng(0)
+    X = rng.random((300, len(FRAUD_MODEL_FEATURES))) * 100
+    model = xgb.XGBClassifier(n_estimators=10, max_depth=4).fit(X, (X[:, 0] + X[:, 1] > 100).astype(int))
+
+    # Rows exactly on a threshold go the way XGBoost sends them
+    compiled = compile_model(model)
+    at_split = np.repeat(X[:1], len(compiled.split_points()), axis=0)
+    for row, (feature, threshold) in enumerate(compiled.split_points()):
+        at_split[row, int(feature)] = threshold
+    np.testing.assert_allclose(compiled.predict(at_split), model.predict_proba(at_split)[:, 1], atol=1e-6)
+
+    registry = ModelRegistry(str(tmp_path), 'fraud', 'classifier', FRAUD_MODEL_FEATURES, warmup_rows=8,
+                             backend='compiled')
+    (tmp_path / 'fraud').mkdir()
+    joblib.dump(model, tmp_path / 'fraud' / '2.0.0.joblib')
+    assert registry.activate('2.0.0') and registry.active.backend == 'compiled'
+
+    # A compiler one float32 step off at each split is caught and the library kept
+    def off_by_one_step(estimator):
+        compiled = compile_model(estimator)
+        compiled.threshold = np.nextafter(compiled.threshold.astype(np.float32), np.float32(np.inf)).astype(np.float64)
+        return compiled
+    monkeypatch.setattr(model_registry, 'compile_model', off_by_one_step)
+    assert registry.activate('2.0.0') and registry.active.backend == 'library'
+
+def test_detect_retries_are_cached_and_update_state_once():
+    from app.main import result_cache, velocity_store
+
+    txn = {"transaction_id": "txn_retry", "amount": 2500, "from_account": "acc_retry", "to_account": "acc_2",
+           "timestamp": "2025-10-22T10:00:00Z"}
+    hits = result_cache.stats()["hits"]
+    first = client.post("/api/fraud/detect", json=txn).json()
+    second = client.post("/api/fraud/detect", json=txn).json()
+    assert first == second
+    assert result_cache.stats()["hits"] == hits + 1
+
+    # A changed payload is re-scored but does not count towards velocity again
+    client.post("/api/fraud/detect", json={**txn, "amount": 2600})
+    assert velocity_store.count("acc_retry", 1761127200) == 1
+
+def test_saturated_batch_releases_state_claims(monkeypatch):
+    from app import main
+
+    txn = {"transaction_id": "txn_saturated", "amount": 2500, "from_account": "acc_saturated", "to_account": "acc_2",
+           "timestamp": "2025-10-22T10:00:00Z"}
+    with monkeypatch.context() as patch:
+        patch.setattr(main.light_executor, "_in_flight", 10**6)
+        assert client.post("/api/fraud/batch", json=[txn]).status_code == 503
+    # The retry still updates velocity, exactly once
+    assert client.post("/api/fraud/batch", json=[txn]).status_code == 200
+    client.post("/api/fraud/batch", json=[txn])
+    assert main.velocity_store.count("acc_saturated", 1761127200) == 1
+
+def test_bulk_score_matches_batch_path_and_resumes(tmp_path):
+    import numpy as np
+    import pandas as pd
+    from app.bulk_score import run
+    from benchmarks import generate_transactions
+
+    transactions = generate_transactions(600, seed=3, n_accounts=50)
+    pd.DataFrame(transactions).to_csv(tmp_path / "txns.csv", index=False)
+    options = {"input": str(tmp_path / "txns.csv"), "output": str(tmp_path / "scored"), "shards": 2,
+               "chunk_size": 200, "checkpoint_every": 1, "max_accounts": 100, "high_amount_threshold": None,
+               "velocity_threshold": None, "model_path": None, "with_reasons": False}
+    assert run(options)["rows"] == 600
+
+    engineer = FeatureEngineer(velocity_store=VelocityStore(max_accounts=100),
+                               amount_stats=AmountStatsStore(max_accounts=100),
+                               device_tracker=DeviceTracker(max_hot_accounts=100))
+    columns = {field: [txn[field] for txn in transactions] for field in transactions[0]}
+    expected = fraud_detector.predict_batch(engineer.engineer_batch(columns), with_reasons=False)
+    scored = pd.read_parquet(tmp_path / "scored").set_index("transaction_id").loc[columns["transaction_id"]]
+    np.testing.assert_allclose(scored["fraud_probability"], expected["fraud_probability"])
+
+    # Every shard checkpointed its last chunk, so a rerun scores nothing
+    assert run(options)["rows"] == 0
+    with pytest.raises(SystemExit):
+        run({**options, "chunk_size": 100})
+    with pytest.raises(SystemExit):
+        run({**options, "max_accounts": 10})
+
+    # Each worker parses one range; together the ranges hold every row once, in order
+    from app.bulk_score import input_ranges, read_range
+    frame = pd.DataFrame(transactions)
+    frame.to_parquet(tmp_path / "txns.parquet", row_group_size=64)
+    for path in (tmp_path / "txns.csv", tmp_path / "txns.parquet"):
+        ranges = input_ranges(str(path), 4)
+        assert len(ranges) == 4
+        ids = [tid for part in ranges for chunk in read_range(str(path), part, 50) for tid in chunk["transaction_id"]]
+        assert ids == columns["transaction_id"]
+
+    # Rows with a missing or malformed amount are reported, not scored as 0
+    frame = frame.astype({"amount": object})
+    frame.loc[[5, 17], "amount"] = ["12,50", None]
+    frame.to_csv(tmp_path / "bad.csv", index=False)
+    summary = run({**options, "input": str(tmp_path / "bad.csv"), "output": str(tmp_path / "bad")})
+    assert summary["rows"] == 598 and summary["rejected"] == 2
+    rejects = pd.read_parquet(tmp_path / "bad" / "_rejects")
+    assert sorted(rejects["transaction_id"]) == sorted(frame["transaction_id"][[5, 17]])
+
+def test_backtest_sweep_matches_direct_replays(tmp_path):
+    import numpy as np
+    import pandas as pd
+    from app.backtest import HistoryOrderError, parse_grid, run
+    from app.fraud_detector import FraudDetector
+    from benchmarks import generate_transactions
+
+    # Stepped grids land on the written cutoffs, so 0.7 alerts a score of exactly 0.7
+    grid = parse_grid("0.05:1.0:0.05")
+    assert len(grid) == 20 and 0.7 in grid and 0.6 in grid
+    assert np.searchsorted(grid, 0.7, side="right") == np.flatnonzero(grid == 0.7)[0] + 1
+
+    transactions = generate_transactions(800, seed=4, n_accounts=40)
+    labels = np.random.default_rng(4).random(800) < 0.1
+    pd.DataFrame(transactions).assign(is_fraud=labels).to_csv(tmp_path / "history.csv", index=False)
+    options = {"input": str(tmp_path / "history.csv"), "label_column": "is_fraud",
+               "amount_thresholds": np.array([5000.0, 50000.0]), "velocity_thresholds": np.array([1.0, 5.0]),
+               "cutoffs": np.array([0.3, 0.5, 0.7]), "sort": False, "shards": 1, "chunk_size": 250,
+               "max_accounts": 100}
+    result = run(options).set_index(["high_amount_threshold", "velocity_threshold", "cutoff"])
+
+    columns = {field: [txn[field] for txn in transactions] for field in transactions[0]}
+    features = FeatureEngineer(velocity_store=VelocityStore(max_accounts=100),
+                               amount_stats=AmountStatsStore(max_accounts=100),
+                               device_tracker=DeviceTracker(max_hot_accounts=100)).engineer_batch(columns)
+    detector = FraudDetector()
+    for amount in options["amount_thresholds"]:
+        for velocity in options["velocity_thresholds"]:
+            detector.high_amount_threshold, detector.velocity_threshold = amount, velocity
+            score = detector.predict_batch(features, with_reasons=False)["fraud_probability"]
+            for cutoff in options["cutoffs"]:
+                row = result.loc[(amount, velocity, cutoff)]
+                assert row["alerts"] == np.count_nonzero(score >= cutoff)
+                assert row["true_positives"] == np.count_nonzero((score >= cutoff) & labels)
+
+    # Out-of-order history is refused unless sorting is requested
+    pd.DataFrame(transactions[::-1]).assign(is_fraud=labels[::-1]).to_csv(tmp_path / "reversed.csv", index=False)
+    with pytest.raises(HistoryOrderError):
+        run({**options, "input": str(tmp_path / "reversed.csv")})
+    assert run({**options, "input": str(tmp_path / "reversed.csv"), "sort": True})["alerts"].sum() > 0
+
+    # Worker shards replay spilled ranges of the input and count the same totals
+    for name, sort in (("history.csv", False), ("reversed.csv", True)):
+        sharded = run({**options, "input": str(tmp_path / name), "sort": sort, "shards": 3})
+        assert sharded.set_index(result.index.names)[["alerts", "true_positives"]].equals(
+            result[["alerts", "true_positives"]])
+    with pytest.raises(HistoryOrderError):
+        run({**options, "input": str(tmp_path / "reversed.csv"), "shards": 3})
+
+def test_backtest_sort_and_rule_operators(tmp_path):
+    import json
+    import numpy as np
+    import pandas as pd
+    from app.backtest import _sorted, run
+    from app.fraud_detector import FraudDetector
+    from app.rules import DEFAULT_FRAUD_RULES, RuleEngine
+    from benchmarks import generate_transactions
+
+    # The external merge sort is a stable sort, also across runs with equal timestamps
+    rng = np.random.default_rng(7)
+    frame = pd.DataFrame({"timestamp": [f"2025-10-22T10:{m:02d}:00Z" for m in rng.integers(0, 5, 500)],
+                          "row": np.arange(500)})
+    frame.loc[::37, "timestamp"] = "not-a-timestamp"
+    merged = pd.concat(_sorted((frame.iloc[i:i + 60] for i in range(0, 500, 60)), 60), ignore_index=True)
+    epochs = pd.to_datetime(frame["timestamp"], utc=True, format="ISO8601", errors="coerce")
+    expected = frame.iloc[np.argsort(epochs.to_numpy("datetime64[ns]"), kind="stable")]["row"].tolist()
+    assert merged["row"].tolist() == expected
+
+    # Swept rules keep the operator of the rule table being tuned
+    table = json.loads(json.dumps(DEFAULT_FRAUD_RULES))
+    table["rules"][0]["op"] = ">="
+    (tmp_path / "rules.json").write_text(json.dumps(table))
+    transactions = [{**txn, "amount": 50000.0 if i % 3 == 0 else txn["amount"]}
+                    for i, txn in enumerate(generate_transactions(300, seed=5, n_accounts=20))]
+    labels = np.zeros(300, dtype=bool)
+    pd.DataFrame(transactions).assign(is_fraud=labels).to_csv(tmp_path / "history.csv", index=False)
+    result = run({"input": str(tmp_path / "history.csv"), "label_column": "is_fraud",
+                  "amount_thresholds": np.array([50000.0]), "velocity_thresholds": np.array([5.0]),
+                  "cutoffs": np.array([0.3]), "sort": False, "shards": 1, "chunk_size": 100,
+                  "max_accounts": 100, "rules_path": str(tmp_path / "rules.json")})
+    columns = {field: [txn[field] for txn in transactions] for field in transactions[0]}
+    features = FeatureEngineer(velocity_store=VelocityStore(max_accounts=100),
+                               amount_stats=AmountStatsStore(max_accounts=100),
+                               device_tracker=DeviceTracker(max_hot_accounts=100)).engineer_batch(columns)
+    score = FraudDetector(rules=RuleEngine(str(tmp_path / "rules.json"))).predict_batch(features)["fraud_probability"]
+    assert result["alerts"].tolist() == [np.count_nonzero(score >= 0.3)]
+
+def test_timestamp_features_batch_matches_scalar():
+    from app.time_features import TimestampFeatures
+
+    uniform = ["2025-10-22T06:00:00+03:00", "2025-10-22T21:59:59-05:30", "2025-10-25T06:00:00+00:00"]
+    mixed = ["2025-10-22T06:00:00Z", "2025-10-22 23:15:00", "2025-10-22T06:00:00.5+0300", "not a time", None]
+    padded = ["  2025-10-22T10:00", "2025-10-22T23:00  ", "  2025-10-22T01:00"]
+    for zone in (None, "Africa/Nairobi"):
+        timestamps = TimestampFeatures(zone)
+        for column in (uniform, mixed, padded):
+            batch = timestamps.parse_batch(column)
+            for i, value in enumerate(column):
+                parsed = timestamps.parse(value) if value else None
+                assert batch["valid"][i] == (parsed is not None)
+                if parsed is not None:
+                    assert parsed == (batch["epoch_seconds"][i], batch["is_unusual_time"][i],
+                                      batch["hour_of_day"][i], batch["day_of_week"][i])
+        assert timestamps.stats()["parse_failures"] == 8  # one bad mixed row, three padded ones, each twice
+
+    # Own offsets keep the written wall clock; a business timezone converts to it
+    assert TimestampFeatures().parse("2025-10-22T20:30:00+00:00")[1:] == (False, 20, 2)
+    assert TimestampFeatures("Africa/Nairobi").parse("2025-10-22T20:30:00+00:00")[1:] == (True, 23, 2)
+
+def test_feature_graph_evaluates_only_needed_features():
+    from app.feature_graph import FeatureGraph, FeatureNode
+    from app.fraud_detector import FraudDetector
+
+    rule_features = FraudDetector().required_features
+
+    engineer = FeatureEngineer(velocity_store=VelocityStore(max_accounts=10))
+    txn = {"transaction_id": "txn_graph", "amount": 1500, "from_account": "acc_graph",
+           "timestamp": "2025-10-22T23:00:00Z"}
+
+    # Re-scoring reads no state, so only the needed subgraph runs
+    features = engineer.engineer_transaction_features(txn, update_state=False, needed=frozenset({"is_round_amount"}))
+    assert features["is_round_amount"] and "transaction_velocity" not in features
+    assert engineer.graph.stats()["timestamp"]["calls"] == 0
+
+    # State-updating calls still feed the stores, and dependencies run first
+    engineer.engineer_transaction_features(txn, needed=frozenset({"is_round_amount"}))
+    assert engineer.velocity_store.count("acc_graph", 1761174000) == 1
+    assert [node.name for node in engineer.graph.plan(frozenset({"transaction_velocity"}), False)] == \
+        ["timestamp", "velocity"]
+
+    # The rules subgraph matches the full computation on every feature the rules read
+    full = engineer.engineer_transaction_features(txn, update_state=False)
+    needed = engineer.engineer_transaction_features(txn, update_state=False, needed=rule_features)
+    assert {name: needed[name] for name in rule_features} == {name: full[name] for name in rule_features}
+    assert fraud_detector.predict(needed) == fraud_detector.predict(full)
+
+    # An expensive feature nobody reads costs nothing
+    calls = []
+    graph = FeatureGraph(engineer.graph.nodes + [
+        FeatureNode("expensive", ("expensive",), ("epoch_seconds",),
+                    lambda f, u: calls.append(1), lambda f, n, u: calls.append(n), cost=500.0)
+    ])
+    graph.evaluate(dict(txn), rule_features, update_state=True)
+    assert calls == [] and graph.plan_cost(rule_features) < graph.plan_cost()
+    with pytest.raises(ValueError):
+        FeatureGraph(list(reversed(engineer.graph.nodes)))
+
+def test_rule_table_hot_reload_and_hits(tmp_path):
+    import json
+    import os
+    import numpy as np
+    from app.fraud_detector import FraudDetector
+    from app.rules import DEFAULT_FRAUD_RULES, RuleEngine
+
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps(DEFAULT_FRAUD_RULES))
+    rules = RuleEngine(str(path))
+    detector = FraudDetector(rules=rules)
+    features = {"amount": 60000, "transaction_velocity": 7, "is_unusual_time": True, "account_age_days": 365}
+    assert detector.predict(features) == FraudDetector().predict(features)
+
+    # Scalar and batch paths agree, and both count hits
+    columns = {"amount": np.array([60000.0, 100.0, 50000.0]), "transaction_velocity": np.array([7, 0, 6]),
+               "is_unusual_time": np.array([True, False, False]), "account_age_days": np.array([365, 2, 30])}
+    batch = detector.predict_batch(columns, with_reasons=True)
+    for i in range(3):
+        single = detector.predict({name: values[i].item() for name, values in columns.items()}, explain=True)
+        assert single["fraud_probability"] == batch["fraud_probability"][i]
+        assert single["reasons"] == batch["reasons"][i]
+    assert rules.hit_counts()["high_amount"] == 3 and rules.hit_counts()["new_account"] == 2
+
+    # An edited table is picked up on refresh; its hits add to the old table's
+    table = json.loads(path.read_text())
+    table["version"] = "2.0.0"
+    table["rules"][0]["threshold"] = 75000
+    path.write_text(json.dumps(table))
+    os.utime(path, (1, 1))
+    assert rules.refresh() and not rules.refresh()
+    assert detector.high_amount_threshold == 75000 and detector.rules_version == "2.0.0"
+    assert "High transaction amount (>75000 KES)" not in detector.predict(features, explain=True)["reasons"]
+    assert rules.hit_counts()["high_amount"] == 3
+
+    # A broken table is rejected and the current one stays active
+    path.write_text(json.dumps({"rules": [{"name": "bad", "feature": "amount", "op": "~", "weight": 1}]}))
+    os.utime(path, (2, 2))
+    assert not rules.refresh()
+    assert rules.info()["version"] == "2.0.0" and rules.info()["load_failures"] == 1
+
+def test_batch_endpoint_on_process_executor(monkeypatch):
+    import pickle
+    from app import main
+    from app.executors import BoundedExecutor
+
+    rules = pickle.loads(pickle.dumps(fraud_detector.rules))
+    assert rules.active.evaluate({"amount": 60000}) == fraud_detector.rules.active.evaluate({"amount": 60000})
+
+    # Scored in a worker process; the rule hits are still counted here
+    monkeypatch.setattr(main, "heavy_executor", BoundedExecutor("heavy", kind="process", max_workers=1))
+    main.heavy_executor.share("fraud_detector", fraud_detector)
+    batch = [{**t, "transaction_id": f"proc_{i}", "from_account": f"proc_acct_{i}"} for i, t in enumerate(TRANSACTIONS)]
+    hits = fraud_detector.rules.hit_counts()["high_amount"]
+    response = client.post("/api/fraud/batch?explain=true", json=batch)
+    main.heavy_executor.shutdown()
+    assert response.status_code == 200
+    assert [r["transaction_id"] for r in response.json()["results"]] == [t["transaction_id"] for t in batch]
+    assert fraud_detector.rules.hit_counts()["high_amount"] == hits + 2
+
+def test_reason_masks_are_explained_on_request():
+    import json
+    import msgpack
+
+    txn = {**TRANSACTIONS[1], "transaction_id": "txn_mask", "from_account": "acc_mask"}
+    explained = client.post("/api/fraud/detect", json=txn).json()
+    masked = client.post("/api/fraud/detect?explain=false", json=txn).json()
+    assert "reasons" not in masked and masked["reason_mask"] == explained["reason_mask"] > 0
+    assert {**masked, "reasons": explained["reasons"]} == explained
+    assert client.post("/api/fraud/detect?explain=maybe", json=txn).status_code == 422
+
+    # The published code table decodes a mask to the same texts
+    codes = client.get("/api/reasons").json()
+    decoded = [code["reason"] for code in codes["fraud"]["codes"] if masked["reason_mask"] >> code["bit"] & 1]
+    assert decoded == explained["reasons"]
+
+    # Batches return masks only unless asked
+    batch = [{**t, "transaction_id": f"mask_{i}", "from_account": f"mask_acct_{i}"} for i, t in enumerate(TRANSACTIONS)]
+    results = client.post("/api/fraud/batch", json=batch).json()["results"]
+    assert all("reasons" not in r and isinstance(r["reason_mask"], int) for r in results)
+    results = client.post("/api/fraud/batch?explain=true", json=batch).json()["results"]
+    assert results[1]["reasons"] == explained["reasons"]
+    response = client.post("/api/fraud/batch?explain=true", headers={"Content-Type": "application/msgpack"},
+                           content=msgpack.packb({f: [t.get(f) for t in batch] for f in ("transaction_id", "amount", "from_account", "to_account", "timestamp")}))
+    assert msgpack.unpackb(response.content)["reasons"] == [r["reasons"] for r in results]
+
+    user = {"user_id": "user_mask", "kyc_verified": False, "disputes": 2}
+    assessed = client.post("/api/risk/assess", json=user).json()
+    line = json.loads(client.post("/api/risk/batch", json=[user], headers={"Content-Type": "application/json"}).text)
+    assert line == {k: v for k, v in assessed.items() if k != "reasons"}
+    assert "Transaction disputes (2)" in assessed["reasons"]
+
+def test_deadline_limits_scoring_tiers(tmp_path):
+    import time
+    import joblib
+    import numpy as np
+    from sklearn.linear_model import LogisticRegression
+    from app.fraud_detector import FraudDetector
+    from app.model_registry import ModelRegistry, FRAUD_MODEL_FEATURES
+    from app.tiered_scoring import TieredScorer
+
+    registry = ModelRegistry(str(tmp_path), 'fraud', 'classifier', FRAUD_MODEL_FEATURES, warmup_rows=8)
+    store = VelocityStore(max_accounts=10)
+    scorer = TieredScorer(FeatureEngineer(velocity_store=store), FraudDetector(registry=registry))
+    txn = {"transaction_id": "txn_tier", "amount": 75000, "from_account": "acc_tier",
+           "timestamp": "2025-10-22T23:30:00Z"}
+
+    # An expired deadline still gets the request-only rules; the state update waits
+    result, deferred = scorer.score(dict(txn), deadline=time.monotonic() - 1, explain=True)
+    assert result["tier"] == "rules" and deferred
+    assert result["reasons"] == ["High transaction amount (>50000 KES)", "Transaction at unusual time (10 PM - 6 AM)",
+                                 "Round transaction amount"]
+    assert store.count("acc_tier", 1761175800) == 0
+    scorer.apply_state(dict(txn))
+    assert store.count("acc_tier", 1761175800) == 1
+
+    result, deferred = scorer.score(dict(txn), deadline=time.monotonic() + 60)
+    assert result["tier"] == "features" and not deferred
+    assert store.count("acc_tier", 1761175800) == 2
+
+    X = np.random.default_rng(0).random((50, len(FRAUD_MODEL_FEATURES)))
+    (tmp_path / 'fraud').mkdir()
+    joblib.dump(LogisticRegression().fit(X, (X[:, 0] > 0.5).astype(int)), tmp_path / 'fraud' / '2.0.0.joblib')
+    assert registry.refresh()
+    assert scorer.score(dict(txn))[0]["tier"] == "model"
+    assert scorer.score(dict(txn), deadline=time.monotonic() + 60)[0]["tier"] == "model"
+    assert scorer.score(dict(txn), deadline=time.monotonic() - 1)[0]["model_version"] == "1.0.0"
+    stats = scorer.stats()
+    assert stats["decisions"] == {"rules": 2, "features": 1, "model": 2}
+    assert stats["skipped"] == {"features": 2, "model": 1} and stats["deferred_state_updates"] == 1
+
+    # Over HTTP, the header sets the budget and the response names the tier
+    body = {**txn, "to_account": "acc_x", "transaction_id": "txn_tier_http", "from_account": "acc_tier_http"}
+    response = client.post("/api/fraud/detect", json=body, headers={"X-Deadline-Ms": "0"})
+    assert response.json()["tier"] == "rules"
+    # A degraded result is not cached: the retry without a deadline gets the full tier
+    assert client.post("/api/fraud/detect", json=body).json()["tier"] == "features"
+    response = client.post("/api/fraud/detect", json={**body, "transaction_id": "txn_tier_http_2"})
+    assert response.json()["tier"] == "features"
+    assert client.post("/api/fraud/detect", json=body, headers={"X-Deadline-Ms": "soon"}).status_code == 422
+    assert client.get("/api/fraud/tiers/stats").json()["skipped"]["features"] >= 1